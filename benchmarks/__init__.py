@@ -0,0 +1 @@
+"""Micro-benchmarks du WAF (hors paquet `waf`, non installés)."""
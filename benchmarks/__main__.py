@@ -0,0 +1,93 @@
+"""Suite de benchmarks du WAF.
+
+    python -m benchmarks run [--skip-proxy] [-o results.json]
+    python -m benchmarks compare base.json results.json [--threshold 10]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from . import compare as cmp
+
+
+def _sizes(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _run(args: argparse.Namespace) -> int:
+    from . import hotpaths, proxy_e2e
+
+    results: Dict[str, Dict[str, Any]] = {}
+    if not args.skip_hot:
+        results.update(hotpaths.run(args.count, args.sizes, args.rounds))
+    if not args.skip_proxy:
+        for engine in args.engines:
+            for size in args.proxy_sizes:
+                label = f"proxy[{engine},{hotpaths.size_label(size)}]"
+                results[label] = proxy_e2e.run(args.requests, args.concurrency, size, engine=engine)
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("func", "output")},
+        "results": results,
+    }
+    for name, values in results.items():
+        print(f"{name:<36} " + "  ".join(f"{k}={v}" for k, v in values.items()))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"résultats écrits dans {args.output}")
+    return 0
+
+
+def _compare(args: argparse.Namespace) -> int:
+    rows = cmp.compare(cmp.load(args.baseline), cmp.load(args.current), args.threshold, args.metrics)
+    if not rows:
+        print("aucun benchmark commun aux deux fichiers", file=sys.stderr)
+        return 2
+    print(cmp.format_rows(rows))
+    regressions = sum(1 for r in rows if r[-1])
+    if regressions:
+        print(f"\n{regressions} régression(s) au-delà de {args.threshold:g} %", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmarks du WAF")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="exécuter les benchmarks")
+    run.add_argument("--count", type=int, default=500, help="requêtes du corpus par taille de corps")
+    run.add_argument("--sizes", type=_sizes, default=[0, 1024, 16384], help="tailles de corps (octets), ex. 0,1024,16384")
+    run.add_argument("--rounds", type=int, default=3, help="passes sur le corpus (chemins chauds)")
+    run.add_argument("--requests", type=int, default=2000, help="requêtes envoyées au proxy")
+    run.add_argument("--concurrency", type=int, default=8, help="clients simultanés")
+    run.add_argument("--proxy-sizes", type=_sizes, default=[0], help="tailles de corps pour le proxy")
+    run.add_argument("--engine", dest="engines", action="append", choices=["wsgi", "asgi"], help="moteur(s) du proxy (défaut wsgi)")
+    run.add_argument("--skip-hot", action="store_true", help="ne pas mesurer les chemins chauds")
+    run.add_argument("--skip-proxy", action="store_true", help="ne pas lancer le benchmark de bout en bout")
+    run.add_argument("-o", "--output", help="fichier JSON de résultats")
+    run.set_defaults(func=_run)
+
+    comp = sub.add_parser("compare", help="comparer deux résultats; code 1 si régression")
+    comp.add_argument("baseline")
+    comp.add_argument("current")
+    comp.add_argument("--threshold", type=float, default=10.0, help="dégradation tolérée en %% (défaut 10)")
+    comp.add_argument("--metrics", type=lambda v: v.split(","), default=None, help=f"parmi {','.join(cmp.METRICS)}")
+    comp.set_defaults(func=_compare)
+
+    args = parser.parse_args(argv)
+    if args.func is _run and not args.engines:
+        args.engines = ["wsgi"]
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
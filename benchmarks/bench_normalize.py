@@ -0,0 +1,77 @@
+"""Micro-benchmark de `normalize_payload` face à l'implémentation d'origine.
+
+    python -m benchmarks.bench_normalize [--count 2000] [--repeat 5]
+"""
+from __future__ import annotations
+
+import argparse
+import re
+import sys
+import urllib.parse
+from time import perf_counter
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from waf.rules import _safe_unquote_plus, normalize_payload
+
+from .corpus import analysis_texts
+
+
+def legacy_normalize_payload(s: str) -> Tuple[str, Dict[str, bool]]:
+    """Implémentation d'origine (toutes les étapes, toujours), pour comparaison."""
+    if not s:
+        decoded, flags = "", {"double_decoded": False, "had_encoding": False}
+    else:
+        had_encoding = ("%" in s) or ("+" in s)
+        try:
+            once = urllib.parse.unquote_plus(s)
+        except Exception:
+            once = _safe_unquote_plus(s)
+        try:
+            twice = urllib.parse.unquote_plus(once)
+        except Exception:
+            twice = _safe_unquote_plus(once)
+        decoded, flags = twice, {"double_decoded": twice != once, "had_encoding": had_encoding}
+    s2 = decoded.lower()
+    s2 = re.sub(r"/\*+\*/", " ", s2)
+    s2 = s2.replace("%0a", " ").replace("%0d", " ").replace("%09", " ")
+    s2 = re.sub(r"\s+", " ", s2)
+    return s2.strip(), flags
+
+
+def _best_of(func: Callable[[str], object], texts: Sequence[str], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = perf_counter()
+        for text in texts:
+            func(text)
+        best = min(best, perf_counter() - t0)
+    return best
+
+
+def check_equivalence(texts: Sequence[str]) -> List[str]:
+    """Textes pour lesquels les deux implémentations divergent (sortie ou flags)."""
+    return [t for t in texts if normalize_payload(t) != legacy_normalize_payload(t)]
+
+
+def main(argv: Sequence[str] = ()) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=2000, help="taille du corpus")
+    parser.add_argument("--repeat", type=int, default=5, help="meilleur temps sur N passes")
+    args = parser.parse_args(list(argv) or None)
+
+    texts = analysis_texts(args.count)
+    mismatches = check_equivalence(texts)
+    if mismatches:
+        print(f"ERREUR: {len(mismatches)} divergence(s), ex: {mismatches[0]!r}", file=sys.stderr)
+        return 1
+    legacy = _best_of(legacy_normalize_payload, texts, args.repeat)
+    current = _best_of(normalize_payload, texts, args.repeat)
+    per_call = lambda seconds: seconds / len(texts) * 1e6  # noqa: E731
+    print(f"corpus: {len(texts)} requêtes, sorties et flags identiques")
+    print(f"legacy  : {per_call(legacy):7.2f} µs/appel")
+    print(f"actuel  : {per_call(current):7.2f} µs/appel  (x{legacy / current:.2f})")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
@@ -0,0 +1,58 @@
+"""Comparaison de deux fichiers de résultats (`python -m benchmarks run -o ...`)."""
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Sens de chaque métrique: True = plus grand est meilleur
+METRICS: Dict[str, bool] = {
+    "ops_per_s": True,
+    "rps": True,
+    "p50_us": False,
+    "p99_us": False,
+    "p50_ms": False,
+    "p99_ms": False,
+}
+
+Row = Tuple[str, str, float, float, float, bool]  # (benchmark, métrique, base, actuel, écart %, régression)
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    threshold: float,
+    metrics: Optional[Sequence[str]] = None,
+) -> List[Row]:
+    """Écarts en % pour les benchmarks présents des deux côtés.
+
+    Un écart est une régression s'il dégrade la métrique de plus de `threshold` %.
+    """
+    selected = [m for m in (metrics or METRICS) if m in METRICS]
+    rows: List[Row] = []
+    base_results = baseline.get("results", {})
+    for name, values in current.get("results", {}).items():
+        base = base_results.get(name)
+        if not base:
+            continue
+        for metric in selected:
+            old, new = base.get(metric), values.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100.0
+            worse = -change if METRICS[metric] else change
+            rows.append((name, metric, old, new, round(change, 1), worse > threshold))
+    return rows
+
+
+def format_rows(rows: Sequence[Row]) -> str:
+    width = max([len(r[0]) for r in rows] + [9])
+    lines = [f"{'benchmark':<{width}}  {'métrique':<9} {'base':>12} {'actuel':>12} {'écart':>8}"]
+    for name, metric, old, new, change, regressed in rows:
+        mark = "  RÉGRESSION" if regressed else ""
+        lines.append(f"{name:<{width}}  {metric:<9} {old:>12g} {new:>12g} {change:>+7.1f}%{mark}")
+    return "\n".join(lines)
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import random
+from typing import Dict, List, NamedTuple, Optional
+
+# Trafic DVWA typique (navigation + formulaires des modules vulnérables)
+_BENIGN_PATHS = (
+    "/", "/index.php", "/login.php", "/setup.php", "/instructions.php", "/security.php",
+    "/vulnerabilities/sqli/", "/vulnerabilities/xss_r/", "/vulnerabilities/xss_s/",
+    "/vulnerabilities/exec/", "/vulnerabilities/fi/", "/vulnerabilities/brute/",
+    "/dvwa/css/main.css", "/dvwa/js/dvwaPage.js", "/dvwa/images/logo.png", "/favicon.ico",
+)
+_BENIGN_QUERIES = (
+    "", "", "", "id=1&Submit=Submit", "id=42&Submit=Submit", "name=alice", "name=Jean+Dupont",
+    "page=include.php", "page=file1.php", "username=admin&password=password&Login=Login",
+    "q=caf%C3%A9+cr%C3%A8me", "redirect=%2Findex.php", "lang=fr&sort=asc&page=2",
+)
+_BENIGN_BODIES = (
+    "", "", "", "username=admin&password=password&Login=Login&user_token=8b1a9953c4611296a827abf8c47804d7",
+    "ip=127.0.0.1&Submit=Submit", "txtName=Alice&mtxMessage=Bonjour+%C3%A0+tous&btnSign=Sign+Guestbook",
+    '{"user": "alice", "items": [1, 2, 3], "note": "livraison rapide"}',
+    "security=low&seclev_submit=Submit",
+)
+_USER_AGENTS = (
+    "Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 14_5) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Safari/605.1.15",
+    "curl/8.5.0",
+)
+_REFERERS = ("", "http://127.0.0.1:8080/index.php", "http://127.0.0.1:8080/vulnerabilities/sqli/")
+_COOKIES = (
+    "", "security=low; PHPSESSID=5f4dcc3b5aa765d61d8327deb882cf99",
+    "security=impossible; PHPSESSID=0c88028bf3aa6a6a143ed846f2be1ea4; _ga=GA1.1.123456789.1700000000",
+)
+
+# Charges d'attaque (formes brutes, encodées et contournements classiques)
+_ATTACKS = (
+    "id=1' OR 1=1-- -&Submit=Submit",
+    "id=1%27%20OR%201%3D1%23&Submit=Submit",
+    "id=1 UNION SELECT user,password FROM users#",
+    "id=1'/**/UNION/**/SELECT/**/null,version()--+",
+    "id=1%2527%2520or%25201%253d1",
+    "id=1 AND SLEEP(5)",
+    "id=1;DROP TABLE users",
+    "name=<script>alert(1)</script>",
+    "name=%3Cscript%3Ealert(document.cookie)%3C%2Fscript%3E",
+    "name=\"><img src=x onerror=alert(1)>",
+    "name=<a href=javascript:alert(1)>x</a>",
+    "page=../../../../etc/passwd",
+    "page=php://filter/convert.base64-encode/resource=index.php",
+    "ip=127.0.0.1; cat /etc/passwd",
+    "ip=127.0.0.1%0Awhoami",
+    "q=%25%32%37%25%32%30%25%34%66%25%35%32",
+)
+
+# Entrées construites pour faire revenir en arrière les règles à risque
+# (cf. `python -m waf.redos`): chaque départ parcourt tout le reste du texte
+ADVERSARIAL = {
+    "img_no_gt": "<img " * 4000,
+    "id_no_sep": "?id=" * 4000,
+    "id_long_token": "?id=" + "1" * 20000 + "?id=" * 2000,
+    "img_attr_flood": "<img" + " src=x" * 8000,
+}
+
+
+class Sample(NamedTuple):
+    method: str
+    path: str
+    query: str
+    body: str
+    user_agent: str
+    referer: str
+    cookie: str
+    attack: bool
+
+    def analysis_text(self) -> str:
+        """Texte analysé en mode blob (cf. `scoring.analysis_text`)."""
+        return "\n".join([self.path, self.query, self.body, self.user_agent, self.referer, self.cookie])
+
+
+_FILLER_WORDS = (
+    "bonjour", "commande", "livraison", "adresse", "message", "produit", "quantite",
+    "paris", "lyon", "merci", "client", "facture", "valider", "texte", "note",
+)
+
+
+def _pad_body(body: str, size: int, rng: random.Random) -> str:
+    """Compléter un corps de formulaire par des champs légitimes jusqu'à `size` caractères."""
+    parts = [body] if body else []
+    length = len(body)
+    n = 0
+    while length < size:
+        field = f"f{n}=" + "+".join(rng.choice(_FILLER_WORDS) for _ in range(rng.randint(2, 8)))
+        parts.append(field)
+        length += len(field) + 1
+        n += 1
+    return "&".join(parts)[:size] if size else body
+
+
+def generate(count: int = 1000, attack_ratio: float = 0.2, seed: int = 3000, body_size: int = 0) -> List[Sample]:
+    """Corpus déterministe: trafic DVWA légitime mêlé de charges d'attaque.
+
+    Avec `body_size` > 0, chaque requête porte un corps de formulaire de cette
+    taille (la charge d'attaque éventuelle reste en tête du corps).
+    """
+    rng = random.Random(seed)
+    samples = []
+    for _ in range(count):
+        attack = rng.random() < attack_ratio
+        path = rng.choice(_BENIGN_PATHS)
+        query = rng.choice(_BENIGN_QUERIES)
+        body = rng.choice(_BENIGN_BODIES)
+        if attack:
+            payload = rng.choice(_ATTACKS)
+            if rng.random() < 0.5:
+                query = payload
+            else:
+                body = payload
+        if body_size:
+            body = _pad_body(body, body_size, rng)
+        method = "POST" if body else "GET"
+        samples.append(Sample(
+            method, path, query, body,
+            rng.choice(_USER_AGENTS), rng.choice(_REFERERS), rng.choice(_COOKIES), attack,
+        ))
+    return samples
+
+
+def adversarial_texts(scale: int = 1) -> Dict[str, str]:
+    """Charges `ADVERSARIAL`, répétées `scale` fois."""
+    return {name: text * scale for name, text in ADVERSARIAL.items()}
+
+
+def analysis_texts(count: int = 1000, seed: Optional[int] = None, body_size: int = 0) -> List[str]:
+    return [s.analysis_text() for s in generate(count, seed=3000 if seed is None else seed, body_size=body_size)]
+
+
+_HTML_ROW = (
+    '<tr><td><a href="{origin}/vulnerabilities/{page}/">{page}</a></td>'
+    '<td><img src="//{netloc}/dvwa/images/{page}.png" alt="é"></td></tr>\n'
+)
+
+
+def html_page(size: int, backend: str = "http://127.0.0.1:8080") -> bytes:
+    """Page HTML (UTF-8) d'environ `size` octets avec des liens absolus vers le backend."""
+    netloc = backend.split("://", 1)[-1]
+    pages = ("sqli", "xss_r", "exec", "fi", "upload", "csrf")
+    rows = []
+    total = 0
+    i = 0
+    while total < size:
+        row = _HTML_ROW.format(origin=backend, netloc=netloc, page=pages[i % len(pages)])
+        rows.append(row)
+        total += len(row.encode("utf-8"))
+        i += 1
+    return ("<html><body><table>\n" + "".join(rows) + "</table></body></html>\n").encode("utf-8")
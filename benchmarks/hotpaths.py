@@ -0,0 +1,70 @@
+"""Débit et latence des chemins chauds de l'analyse (`normalize_payload`,
+`match_rules`, `compute_score`) et de la réécriture des réponses HTML.
+"""
+from __future__ import annotations
+
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Sequence
+
+from waf.rewrite import rewrite_context
+from waf.rules import match_rules, normalize_payload
+from waf.scoring import compute_score
+from waf.verdict_cache import get_verdict_cache
+
+from .corpus import adversarial_texts, analysis_texts, html_page
+from .stats import latency_summary
+
+
+def size_label(size: int) -> str:
+    if not size:
+        return "nobody"
+    return f"{size // 1024}k" if size % 1024 == 0 else str(size)
+
+
+def measure(func: Callable[[str], Any], texts: Sequence[str], rounds: int) -> Dict[str, float]:
+    """Appeler `func` sur chaque texte, `rounds` fois; ops/s et p50/p99 par appel (µs)."""
+    for text in texts[: min(len(texts), 50)]:  # échauffement (plans, caches de regex)
+        func(text)
+    latencies: List[float] = []
+    total = 0.0
+    for _ in range(rounds):
+        for text in texts:
+            t0 = perf_counter()
+            func(text)
+            elapsed = perf_counter() - t0
+            latencies.append(elapsed)
+            total += elapsed
+    return {
+        "n": len(latencies),
+        "ops_per_s": round(len(latencies) / total, 1) if total else 0.0,
+        **latency_summary(latencies, 1e6, "us"),
+    }
+
+
+def run(count: int, sizes: Sequence[int], rounds: int) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+    cache = get_verdict_cache()
+    for size in sizes:
+        label = size_label(size)
+        texts = analysis_texts(count, body_size=size)
+        normalized = [normalize_payload(t)[0] for t in texts]
+        results[f"normalize_payload[{label}]"] = measure(normalize_payload, texts, rounds)
+        results[f"match_rules[{label}]"] = measure(match_rules, normalized, rounds)
+        # Textes tous distincts: chaque appel fait l'analyse complète (cache manqué)
+        unique = [f"{t}\nbench {i}" for i in range(rounds) for t in texts]
+        cache.clear()
+        results[f"compute_score[{label}]"] = measure(compute_score, unique, 1)
+        # Mêmes textes une seconde fois: verdicts servis par le cache
+        results[f"compute_score_cached[{label}]"] = measure(compute_score, unique[: len(texts)], rounds)
+        cache.clear()
+    # Entrées à retour arrière catastrophique: le budget d'analyse doit borner la latence
+    for name, text in adversarial_texts().items():
+        results[f"compute_score_redos[{name}]"] = measure(compute_score, [text], rounds)
+    # Réécriture des URLs du backend dans une page HTML relayée au client
+    ctx = rewrite_context("http://127.0.0.1:8080", "http", "waf.local")
+    for size in (64 * 1024, 1024 * 1024):
+        page = html_page(size)
+        results[f"rewrite_body[{size_label(size)}]"] = measure(
+            lambda body: ctx.rewrite_body(body, "utf-8"), [page], rounds  # type: ignore[list-item]
+        )
+    return results
@@ -0,0 +1,125 @@
+"""Benchmark de bout en bout: client HTTP → proxy WAF (sous-processus) → backend local."""
+from __future__ import annotations
+
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from time import perf_counter
+from typing import Dict, List, Optional, Sequence
+
+import httpx
+
+from .corpus import Sample, generate
+from .stats import latency_summary
+from .stub import StubBackend
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(url: str, proc: subprocess.Popen, timeout: float = 15.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"le proxy s'est arrêté (code {proc.returncode})")
+        try:
+            if httpx.get(f"{url}/healthz", timeout=0.5).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError("le proxy n'a pas répondu sur /healthz")
+
+
+def _client_loop(
+    base_url: str, samples: Sequence[Sample], latencies: List[float], errors: List[int], lock: threading.Lock
+) -> None:
+    local: List[float] = []
+    failed = 0
+    with httpx.Client(base_url=base_url, timeout=30.0) as client:
+        for s in samples:
+            headers = {"User-Agent": s.user_agent}
+            if s.referer:
+                headers["Referer"] = s.referer
+            if s.cookie:
+                headers["Cookie"] = s.cookie
+            if s.body:
+                headers["Content-Type"] = "application/x-www-form-urlencoded"
+            url = f"{s.path}?{s.query}" if s.query else s.path
+            t0 = perf_counter()
+            try:
+                client.request(s.method, url, headers=headers, content=s.body.encode("utf-8") or None).read()
+            except httpx.HTTPError:
+                failed += 1
+                continue
+            local.append(perf_counter() - t0)
+    with lock:
+        latencies.extend(local)
+        errors.append(failed)
+
+
+def run(
+    requests: int,
+    concurrency: int,
+    body_size: int = 0,
+    engine: str = "wsgi",
+    mode: str = "IPS",
+    extra_env: Optional[Dict[str, str]] = None,
+) -> Dict[str, float]:
+    """Lancer le proxy contre un backend local et mesurer p50/p99 (ms) et requêtes/s."""
+    samples = generate(requests, body_size=body_size)
+    port = _free_port()
+    with StubBackend() as backend, tempfile.TemporaryDirectory(prefix="waf-bench-") as data_dir:
+        env = {
+            **os.environ,
+            "WAF_BACKEND": backend.url,
+            "WAF_LISTEN_HOST": "127.0.0.1",
+            "WAF_LISTEN_PORT": str(port),
+            "WAF_DATA_DIR": data_dir,
+            "WAF_MODE": mode,
+            **(extra_env or {}),
+        }
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "waf.run_waf", "--engine", engine],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        base_url = f"http://127.0.0.1:{port}"
+        try:
+            _wait_ready(base_url, proc)
+            # Échauffement (connexions amont, plans de règles)
+            _client_loop(base_url, samples[:20], [], [], threading.Lock())
+            latencies: List[float] = []
+            errors: List[int] = []
+            lock = threading.Lock()
+            threads = [
+                threading.Thread(target=_client_loop, args=(base_url, samples[i::concurrency], latencies, errors, lock))
+                for i in range(concurrency)
+            ]
+            t0 = perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = perf_counter() - t0
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    return {
+        "n": len(latencies),
+        "errors": sum(errors),
+        "concurrency": concurrency,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        **latency_summary(latencies, 1e3, "ms"),
+    }
@@ -0,0 +1,22 @@
+from __future__ import annotations
+
+from typing import Dict, List, Sequence
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """Percentile (interpolation linéaire) d'une liste déjà triée."""
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def latency_summary(samples: List[float], scale: float, unit: str) -> Dict[str, float]:
+    """p50/p99 de durées en secondes, converties par `scale` (1e6 → µs, 1e3 → ms)."""
+    samples.sort()
+    return {
+        f"p50_{unit}": round(percentile(samples, 0.50) * scale, 3),
+        f"p99_{unit}": round(percentile(samples, 0.99) * scale, 3),
+    }
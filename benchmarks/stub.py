@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_PAGE = (
+    b"<!DOCTYPE html><html><head><title>DVWA</title>"
+    b"<link rel='stylesheet' href='http://127.0.0.1:8080/dvwa/css/main.css'></head>"
+    b"<body><div id='main'><h1>Vulnerability: SQL Injection</h1>"
+    b"<form action='http://127.0.0.1:8080/vulnerabilities/sqli/' method='GET'>"
+    b"<input type='text' name='id'><input type='submit' name='Submit' value='Submit'></form>"
+    + b"<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>" * 40
+    + b"</div></body></html>"
+)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # En-têtes et corps partent en deux écritures: sans TCP_NODELAY, l'ACK
+    # retardé ajouterait ~40 ms à chaque réponse keep-alive
+    disable_nagle_algorithm = True
+
+    def _reply(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(_PAGE)))
+        self.end_headers()
+        # HEAD: mêmes en-têtes, sans corps (sinon le cadrage keep-alive est faussé)
+        if self.command != "HEAD":
+            self.wfile.write(_PAGE)
+
+    do_GET = do_POST = do_HEAD = _reply
+
+    def log_message(self, format: str, *args: object) -> None:  # noqa: A002
+        pass
+
+
+class StubBackend:
+    """Backend HTTP local minimal (page type DVWA), pour mesurer le proxy seul."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="bench-stub", daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "StubBackend":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -10,7 +10,8 @@
 #     --backend http://127.0.0.1:8080 \
 #     --mode IPS \
 #     --waf-port 80 \
-#     --dash-port 5001
+#     --dash-port 5001 \
+#     --workers 4
 
 set -euo pipefail
 
@@ -24,6 +25,7 @@ WAF_LISTEN_HOST="0.0.0.0"
 WAF_LISTEN_PORT="80"
 WAF_DASHBOARD_HOST="0.0.0.0"
 WAF_DASHBOARD_PORT="5001"
+WAF_WORKERS="$(nproc 2>/dev/null || echo 2)"
 
 # Parse args
 while [[ $# -gt 0 ]]; do
@@ -37,6 +39,7 @@ while [[ $# -gt 0 ]]; do
     --waf-port) WAF_LISTEN_PORT="$2"; shift 2;;
     --dash-host) WAF_DASHBOARD_HOST="$2"; shift 2;;
     --dash-port) WAF_DASHBOARD_PORT="$2"; shift 2;;
+    --workers) WAF_WORKERS="$2"; shift 2;;
     -h|--help)
       grep '^#' "$0" | sed -e 's/^# \{0,1\}//'; exit 0;;
     *) echo "Unknown option: $1"; exit 1;;
@@ -93,6 +96,9 @@ WAF_DASHBOARD_PORT=${WAF_DASHBOARD_PORT}
 WAF_DATA_DIR=${INSTALL_DIR}/data
 WAF_LOGS_FILE=${INSTALL_DIR}/data/logs.json
 WAF_ALLOW_QUERY_MODE_SWITCH=1
+WAF_WORKERS=${WAF_WORKERS}
+WAF_MAX_REQUESTS=10000
+WAF_GRACEFUL_TIMEOUT=30
 EOF
 chmod 0644 "$ENV_FILE"
 
@@ -108,6 +114,11 @@ Type=simple
 EnvironmentFile=/etc/default/meow-waf
 WorkingDirectory=${INSTALL_DIR}
 ExecStart=${INSTALL_DIR}/.venv/bin/python -m waf.run_waf
+# Prefork (WAF_WORKERS > 1): SIGHUP = rechargement gracieux, SIGTERM = drain
+ExecReload=/bin/kill -HUP \$MAINPID
+KillSignal=SIGTERM
+KillMode=mixed
+TimeoutStopSec=40
 Restart=on-failure
 RestartSec=3
 User=root
@@ -164,6 +175,7 @@ echo "WAF:       http://<this-host>:${WAF_LISTEN_PORT}/  (healthz: /healthz)"
 echo "Dashboard: http://<this-host>:${WAF_DASHBOARD_PORT}/dashboard"
 echo "Backend:   ${WAF_BACKEND}"
 echo "Mode:      ${WAF_MODE}"
+echo "Workers:   ${WAF_WORKERS}"
 echo "Health:    HTTP ${HTTP_CODE}"
 echo "Logs:      ${INSTALL_DIR}/data/logs.json"
 echo "Service:   meow-waf.service, meow-waf-dashboard.service"
@@ -0,0 +1,23 @@
+"""Environnement commun des tests: répertoire de données temporaire, logs
+synchrones et backend local sur un port libre (la configuration est lue à
+l'import de `waf.config`, donc avant tout import du paquet).
+"""
+import os
+import socket
+import tempfile
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+BACKEND_PORT = _free_port()
+
+os.environ["WAF_DATA_DIR"] = tempfile.mkdtemp(prefix="waf-tests-")
+os.environ["WAF_LOG_WRITER"] = "sync"
+os.environ["WAF_BACKEND"] = f"http://127.0.0.1:{BACKEND_PORT}"
+os.environ["WAF_METRICS"] = "0"
+os.environ["WAF_MODE"] = "IPS"
+os.environ["WAF_ALLOW_QUERY_MODE_SWITCH"] = "1"
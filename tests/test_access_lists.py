@@ -0,0 +1,82 @@
+import dataclasses
+
+import pytest
+
+from waf import access_lists
+from waf.access_lists import AutoDeny, SqliteAutoDeny, check_client, install_access_lists, parse_access_lists
+
+
+@pytest.fixture
+def lists():
+    previous = access_lists.active_access_lists()
+    yield lambda data: install_access_lists(parse_access_lists(data))
+    install_access_lists(previous)
+
+
+def test_user_agent_allow_does_not_lift_ip_deny(lists):
+    lists({"deny": {"ips": ["203.0.113.7"], "cidrs": ["198.51.100.0/24"]}, "allow": {"user_agents": ["goodbot"]}})
+    assert check_client("203.0.113.7", "GoodBot/1.0") == "ip"
+    assert check_client("198.51.100.20", "goodbot").startswith("cidr:")
+
+
+def test_ip_allow_lifts_any_deny(lists):
+    lists({"deny": {"cidrs": ["198.51.100.0/24"], "user_agents": ["sqlmap"]}, "allow": {"ips": ["198.51.100.5"]}})
+    assert check_client("198.51.100.5", "sqlmap") is None
+    assert check_client("198.51.100.6", "curl") == "cidr:198.51.100.0/24"
+
+
+def test_user_agent_allow_lifts_user_agent_deny(lists):
+    lists({"deny": {"user_agents": ["bot"]}, "allow": {"user_agents": ["goodbot"]}})
+    assert check_client("192.0.2.1", "goodbot") is None
+    assert check_client("192.0.2.1", "evilbot") == "ua:bot"
+
+
+def test_auto_deny_not_lifted_by_user_agent_allow(lists, monkeypatch):
+    lists({"allow": {"user_agents": ["goodbot"]}})
+    monkeypatch.setattr(access_lists, "settings", dataclasses.replace(access_lists.settings, auto_deny_after=2))
+    monkeypatch.setattr(access_lists, "_auto", None)
+    access_lists.note_block("192.0.2.9")
+    access_lists.note_block("192.0.2.9")
+    assert check_client("192.0.2.9", "goodbot") == "auto"
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_auto_deny_window_and_ttl(tmp_path, shared):
+    args = (3, 60.0, 100.0, 1000)
+    auto = SqliteAutoDeny(*args, str(tmp_path / "state.sqlite3")) if shared else AutoDeny(*args)
+    assert not auto.note_block("10.0.0.1", 0.0)
+    assert not auto.note_block("10.0.0.1", 1.0)
+    # Fenêtre dépassée: le compte repart de zéro
+    assert not auto.note_block("10.0.0.1", 70.0)
+    assert not auto.note_block("10.0.0.1", 71.0)
+    assert auto.note_block("10.0.0.1", 72.0)
+    assert auto.denied("10.0.0.1", 100.0)
+    assert not auto.denied("10.0.0.1", 173.0)
+
+
+def test_sqlite_auto_deny_is_shared(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    worker_a, worker_b = SqliteAutoDeny(2, 60.0, 100.0, 1000, path), SqliteAutoDeny(2, 60.0, 100.0, 1000, path)
+    worker_a.note_block("10.0.0.2", 0.0)
+    assert worker_b.note_block("10.0.0.2", 1.0)
+    assert worker_a.denied("10.0.0.2", 2.0)
+
+
+def test_exact_ip_entries_match_canonical_forms():
+    from waf.access_lists import AccessTable
+
+    table = AccessTable(ips=["10.0.0.5", "2001:0db8:0:0::1"])
+    assert table.match_ip("10.0.0.5") == "ip"
+    assert table.match_ip("::ffff:10.0.0.5") == "ip"
+    assert table.match_ip("2001:db8::1") == "ip"
+    assert table.match_ip("2001:0db8:0000:0000:0000:0000:0000:0001") == "ip"
+    assert table.match_ip("10.0.0.6") is None
+    assert table.match_ip("not-an-ip") is None
+    assert AccessTable().match_ip("::ffff:10.0.0.5") is None
+
+
+def test_exact_ip_deny_without_cidrs(lists):
+    lists({"deny": {"ips": ["10.0.0.5", "2001:db8::1"]}, "allow": {"ips": ["::ffff:10.0.0.9"]}})
+    assert check_client("::ffff:10.0.0.5", "curl") == "ip"
+    assert check_client("2001:0db8:0:0::1", "curl") == "ip"
+    assert check_client("10.0.0.9", "curl") is None
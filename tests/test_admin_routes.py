@@ -0,0 +1,23 @@
+from waf.proxy import create_app
+
+
+def test_metrics_and_health_details_hidden_from_public_clients():
+    client = create_app().test_client()
+    health = client.get("/healthz", environ_base={"REMOTE_ADDR": "203.0.113.9"}).get_json()
+    assert set(health) == {"status", "mode"}
+    # Chemin non intercepté: relayé au backend (injoignable ici -> 502 du proxy)
+    resp = client.get("/metrics", environ_base={"REMOTE_ADDR": "203.0.113.9"})
+    assert resp.status_code == 502
+
+
+def test_admin_address_sees_metrics(monkeypatch):
+    import dataclasses
+
+    from waf import access_lists
+
+    monkeypatch.setattr(access_lists, "settings", dataclasses.replace(access_lists.settings, admin_allow="127.0.0.0/8"))
+    monkeypatch.setattr(access_lists, "_admin", None)
+    client = create_app().test_client()
+    assert "upstream_pool" in client.get("/healthz", environ_base={"REMOTE_ADDR": "127.0.0.1"}).get_json()
+    assert client.get("/metrics", environ_base={"REMOTE_ADDR": "127.0.0.1"}).status_code == 200
+    assert client.get("/metrics/summary", environ_base={"REMOTE_ADDR": "10.0.0.1"}).status_code == 502
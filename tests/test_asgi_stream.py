@@ -0,0 +1,93 @@
+import asyncio
+import json
+import socket
+import threading
+
+import pytest
+
+from conftest import BACKEND_PORT
+from waf.asgi_proxy import create_asgi_app
+from waf.config import settings
+
+
+def _backend(handler):
+    """Backend TCP minimal: `handler(conn)` répond à une seule requête par connexion."""
+    srv = socket.socket()
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(("127.0.0.1", BACKEND_PORT))
+    srv.listen(8)
+
+    def loop():
+        while True:
+            try:
+                conn, _ = srv.accept()
+            except OSError:
+                return
+            with conn:
+                conn.recv(65536)
+                handler(conn)
+
+    threading.Thread(target=loop, daemon=True).start()
+    return srv
+
+
+def _call(app, path="/page"):
+    scope = {
+        "type": "http", "method": "GET", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "headers": [(b"host", b"waf.test")], "client": ("127.0.0.1", 5555), "scheme": "http",
+        "http_version": "1.1", "server": ("127.0.0.1", 80),
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    return messages
+
+
+def _log_events():
+    try:
+        with open(settings.logs_file, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+@pytest.fixture
+def clean_logs():
+    open(settings.logs_file, "w").close()
+    yield
+
+
+def test_upstream_failure_mid_body_sends_one_response_and_logs_once(clean_logs):
+    def truncated(conn):
+        # Content-Length annoncé mais connexion fermée après quelques octets
+        conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\nContent-Length: 1000000\r\n\r\n")
+        conn.sendall(b"x" * 70000)
+
+    srv = _backend(truncated)
+    try:
+        messages = _call(create_asgi_app())
+    finally:
+        # shutdown débloque accept() dans le thread (close seul laisserait le port à l'écoute)
+        srv.shutdown(socket.SHUT_RDWR)
+        srv.close()
+    starts = [m["status"] for m in messages if m["type"] == "http.response.start"]
+    assert starts == [200]
+    assert messages[-1]["type"] == "http.response.body" and not messages[-1].get("more_body", False)
+    events = _log_events()
+    assert len(events) == 1
+    assert events[0]["status"] == 200 and events[0]["flags"].get("proxy_error") is True
+    assert "unhandled_exception" not in events[0]["flags"]
+
+
+def test_upstream_unreachable_is_a_single_502(clean_logs):
+    messages = _call(create_asgi_app())
+    starts = [m["status"] for m in messages if m["type"] == "http.response.start"]
+    assert starts == [502]
+    events = _log_events()
+    assert len(events) == 1 and events[0]["action"] == "ERROR"
@@ -0,0 +1,20 @@
+import http.client
+import urllib.parse
+
+from benchmarks.stub import StubBackend
+
+
+def test_head_keeps_keepalive_framing():
+    with StubBackend() as backend:
+        url = urllib.parse.urlsplit(backend.url)
+        conn = http.client.HTTPConnection(url.hostname, url.port, timeout=5)
+        try:
+            for method in ("HEAD", "GET", "HEAD", "GET"):
+                conn.request(method, "/")
+                resp = conn.getresponse()
+                body = resp.read()
+                assert resp.status == 200
+                length = int(resp.getheader("Content-Length"))
+                assert len(body) == (0 if method == "HEAD" else length)
+        finally:
+            conn.close()
@@ -0,0 +1,93 @@
+import io
+import json
+
+from waf.binlog import MAGIC, encode_events, from_jsonl, iter_events, read_events, sniff, to_jsonl
+
+
+def _event(i, **extra):
+    event = {
+        "timestamp": f"2025-01-01T00:00:{i:02d}.000100Z",
+        "request_id": f"{i:032x}",
+        "source_ip": f"10.0.0.{i % 3}",
+        "method": "GET" if i % 2 else "POST",
+        "url": f"/page?id={i}",
+        "user_agent": "curl/8",
+        "score": i,
+        "severity": "high" if i % 4 == 0 else "low",
+        "matched_rules": ["SQLI_UNION"] if i % 5 == 0 else ["XSS_SCRIPT"],
+        "action": "BLOCK" if i % 4 == 0 else "ALLOW",
+        "status": 403 if i % 4 == 0 else 200,
+        "response_time_ms": i + 0.5,
+        "flags": {"cache_hit": bool(i % 2)},
+    }
+    event.update(extra)
+    return event
+
+
+EVENTS = [_event(i) for i in range(20)]
+
+
+def _write(path, events, block_size=7):
+    with open(path, "wb") as f:
+        for start in range(0, len(events), block_size):
+            data, encoded = encode_events(events[start:start + block_size])
+            assert encoded == len(events[start:start + block_size])
+            f.write(data)
+
+
+def test_round_trip_preserves_events():
+    odd = [
+        {"timestamp": "2025-01-01T00:00:00Z", "action": "ALLOW", "status": None, "response_time_ms": None},
+        {"action": "LOG_DROPPED", "dropped": 3, "overflow": "drop"},
+        {"score": -1, "matched_rules": [], "source_ip": 42, "extra": {"nested": [1, "é"]}},
+    ]
+    data, encoded = encode_events(EVENTS + odd)
+    assert encoded == len(EVENTS) + len(odd)
+    assert sniff(data[:len(MAGIC)]) is True
+    assert list(iter_events(data)) == EVENTS + odd
+
+
+def test_jsonl_conversion_round_trip():
+    src = io.BytesIO(b"".join(json.dumps(e).encode() + b"\n" for e in EVENTS) + b"not json\n\n")
+    binary = io.BytesIO()
+    assert from_jsonl(src, binary, block_size=6) == (len(EVENTS), 1)
+    binary.seek(0)
+    out = io.BytesIO()
+    assert to_jsonl(binary, out) == len(EVENTS)
+    assert [json.loads(line) for line in out.getvalue().splitlines()] == EVENTS
+
+
+def test_read_events_filters_match_python(tmp_path):
+    path = str(tmp_path / "logs.bin")
+    _write(path, EVENTS)
+    cases = [
+        ({}, EVENTS),
+        ({"severity": "HIGH"}, [e for e in EVENTS if e["severity"] == "high"]),
+        ({"action": "block"}, [e for e in EVENTS if e["action"] == "BLOCK"]),
+        ({"rule": "SQLI_UNION"}, [e for e in EVENTS if "SQLI_UNION" in e["matched_rules"]]),
+        ({"source_ip": "10.0.0.1"}, [e for e in EVENTS if e["source_ip"] == "10.0.0.1"]),
+        ({"since": "2025-01-01T00:00:05Z", "until": "2025-01-01T00:00:12Z"}, EVENTS[5:12]),
+        ({"action": "ALLOW", "source_ip": "10.0.0.2", "since": "2025-01-01T00:00:03Z"},
+         [e for e in EVENTS[3:] if e["action"] == "ALLOW" and e["source_ip"] == "10.0.0.2"]),
+        ({"rule": "UNKNOWN"}, []),
+        ({"severity": "none"}, []),
+    ]
+    for filters, expected in cases:
+        assert read_events(path, **filters) == expected, filters
+
+
+def test_read_events_limit_keeps_latest(tmp_path):
+    path = str(tmp_path / "logs.bin")
+    _write(path, EVENTS)
+    assert read_events(path, limit=5) == EVENTS[-5:]
+    allowed = [e for e in EVENTS if e["action"] == "ALLOW"]
+    assert read_events(path, limit=4, action="ALLOW") == allowed[-4:]
+
+
+def test_read_events_skips_truncated_tail(tmp_path):
+    path = str(tmp_path / "logs.bin")
+    _write(path, EVENTS)
+    data, _ = encode_events([_event(30)])
+    with open(path, "ab") as f:
+        f.write(data[:-5])  # bloc en cours d'écriture
+    assert read_events(path) == EVENTS
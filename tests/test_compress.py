@@ -0,0 +1,49 @@
+import asyncio
+import zlib
+
+import pytest
+
+from waf.compress import SUPPORTED_CODINGS, acompress_chunks, compress_chunks
+
+CHUNKS = [b"<html><body>", b"<p>" + b"a" * 5000 + b"</p>", b"", b"</body></html>"]
+
+
+def _decoder(coding):
+    if coding == "br":
+        import brotli
+
+        return brotli.Decompressor().process
+    wbits = 16 + zlib.MAX_WBITS if coding == "gzip" else zlib.MAX_WBITS
+    return zlib.decompressobj(wbits).decompress
+
+
+@pytest.mark.parametrize("coding", SUPPORTED_CODINGS)
+def test_each_upstream_chunk_is_flushed(coding):
+    # Chaque morceau amont (non vide) doit être décodable dès sa réception
+    source = iter(CHUNKS)
+    decode = _decoder(coding)
+    out = compress_chunks(source, coding, 6)
+    received = b""
+    for expected in [c for c in CHUNKS if c]:
+        received += decode(next(out))
+        assert received.endswith(expected)
+    list(out)
+    assert received == b"".join(CHUNKS)
+
+
+@pytest.mark.parametrize("coding", SUPPORTED_CODINGS)
+def test_async_chunks_are_flushed(coding):
+    async def source():
+        for chunk in CHUNKS:
+            yield chunk
+
+    async def collect():
+        decode = _decoder(coding)
+        parts = []
+        async for piece in acompress_chunks(source(), coding, 6):
+            parts.append(decode(piece))
+        return parts
+
+    parts = asyncio.run(collect())
+    assert parts[:3] == [c for c in CHUNKS if c]
+    assert b"".join(parts) == b"".join(CHUNKS)
@@ -0,0 +1,29 @@
+import json
+
+from waf.config import settings
+from waf.dashboard_app import create_dashboard_app
+from waf.logger import append_log, new_request_id, utc_now_iso
+
+
+def _first_frame(client, url, headers=None):
+    resp = client.get(url, headers=headers or {}, buffered=False)
+    try:
+        for chunk in resp.response:
+            text = chunk.decode() if isinstance(chunk, bytes) else chunk
+            if text.startswith("id:"):
+                return json.loads(text.split("data: ", 1)[1])
+    finally:
+        resp.close()
+
+
+def test_last_event_id_wins_over_since_on_reconnect():
+    open(settings.logs_file, "w").close()
+    ids = [new_request_id() for _ in range(3)]
+    for rid in ids:
+        append_log({"timestamp": utc_now_iso(), "request_id": rid, "action": "ALLOW", "severity": "none"})
+    client = create_dashboard_app().test_client()
+    first = _first_frame(client, "/api/logs/stream?since=0")
+    assert [e["request_id"] for e in first["items"]] == ids
+    # Reconnexion du navigateur: même URL, Last-Event-ID = dernier curseur reçu
+    again = _first_frame(client, "/api/logs/stream?since=0", {"Last-Event-ID": "2"})
+    assert [e["request_id"] for e in again["items"]] == ids[2:]
@@ -0,0 +1,73 @@
+from benchmarks.corpus import generate
+from waf.config import settings
+from waf.fields import FORM_CONTENT_TYPE, RequestFields
+from waf.redos import start_budget
+from waf.scoring import analysis_text, compute_field_score, compute_score
+
+ID_RULES = {
+    "SQLI_PARAM_ID_QUOTE", "SQLI_PARAM_ID_AND_1EQ1", "SQLI_PARAM_ID_OR_1EQ1",
+    "SQLI_PARAM_ID_UNION_SELECT", "SQLI_PARAM_ID_AND_SLEEP",
+}
+
+
+def _content_type(body):
+    if not body:
+        return ""
+    return "application/json" if body.startswith("{") else FORM_CONTENT_TYPE
+
+
+def _both(path, query, body, ua="curl/8", referer="", cookie=""):
+    # Budget propre à chaque analyse, comme pour une requête du proxy
+    start_budget()
+    blob = compute_score(analysis_text(path, query, body, ua, referer, cookie))
+    start_budget()
+    fields = compute_field_score(RequestFields(path, query, body, ua, referer, cookie, _content_type(body)))
+    return blob, fields
+
+
+def _blocked(score):
+    return score >= settings.threshold_block
+
+
+def test_fields_verdict_never_weaker_than_blob_on_corpus():
+    blocked = {"blob": 0, "fields": 0}
+    for s in generate(1500, attack_ratio=0.5, seed=5):
+        blob, fields = _both(s.path, s.query, s.body, s.user_agent, s.referer, s.cookie)
+        # Mêmes règles, plus les règles `id` que le mode blob manque en tête de query/corps
+        assert set(blob[1]) <= set(fields[1]), s
+        assert set(fields[1]) - set(blob[1]) <= ID_RULES, s
+        assert fields[2].get("double_decoded") == blob[2].get("double_decoded")
+        if not s.attack:
+            assert blob[1] == fields[1] == [], s
+        assert _blocked(fields[0]) >= _blocked(blob[0]), s
+        blocked["blob"] += _blocked(blob[0])
+        blocked["fields"] += _blocked(fields[0])
+    assert blocked["blob"] > 100
+    assert blocked["fields"] >= blocked["blob"]
+
+
+def test_id_rules_scoped_to_id_parameter():
+    blob, fields = _both("/vulnerabilities/sqli/", "id=1 union select user,password from users", "")
+    assert "SQLI_PARAM_ID_UNION_SELECT" not in blob[1]  # pas de "?"/"&" avant id= dans le texte joint
+    assert fields[3]["SQLI_PARAM_ID_UNION_SELECT"] == "args:id"
+    assert fields[3]["SQLI_UNION_SELECT"] == "args:id"
+    assert _blocked(fields[0]) and fields[0] > blob[0]
+
+    blob, fields = _both("/", "name=1 union select 1&x=2", "")
+    assert "SQLI_PARAM_ID_UNION_SELECT" not in fields[1]
+    assert fields[1] == blob[1]
+
+
+def test_field_targets_and_cross_field_matches():
+    # Match à cheval sur deux champs: vu par le mode blob seulement
+    blob, fields = _both("/", "q=1' or", "1=1", cookie="")
+    assert "SQLI_OR_1EQ1" in blob[1]
+    assert "SQLI_OR_1EQ1" not in fields[1]
+    # LFI_WRAPPER ne cible pas le chemin
+    blob, fields = _both("/php://filter/resource=index.php", "", "")
+    assert "LFI_WRAPPER" in blob[1]
+    assert "LFI_WRAPPER" not in fields[1]
+    # Même charge dans un champ ciblé: même verdict
+    blob, fields = _both("/", "page=php://filter/resource=index.php", "")
+    assert blob[:2] == fields[:2]
+    assert fields[3]["LFI_WRAPPER"] == "args:page"
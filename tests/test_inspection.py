@@ -0,0 +1,69 @@
+import dataclasses
+import io
+import json
+
+import httpx
+import pytest
+
+from waf import proxy
+from waf.config import settings
+from waf.inspection import BodyBlocked, StreamingInspector
+
+ATTACK = b"x=<script>alert(1)</script>&y=../../../../etc/passwd;cat /etc/passwd"
+
+
+class _HoldingDecoder:
+    """Décodeur qui ne rend le texte qu'à la fin (cas limite du flush final)."""
+
+    def __init__(self):
+        self._buf = b""
+
+    def decode(self, data, final=False):
+        self._buf += data
+        if not final:
+            return ""
+        out, self._buf = self._buf.decode("utf-8", errors="replace"), b""
+        return out
+
+
+def test_final_flush_checks_block_threshold():
+    inspector = StreamingInspector("/\n\n", max_bytes=1 << 20, overlap=64, block_threshold=settings.threshold_block)
+    inspector._decoder = _HoldingDecoder()
+    body = inspector.iter_body(io.BytesIO(ATTACK), 16)
+    with pytest.raises(BodyBlocked):
+        list(body)
+    assert inspector.blocked
+
+
+def test_final_flush_without_threshold_only_scores():
+    inspector = StreamingInspector("/\n\n", max_bytes=1 << 20, overlap=64)
+    inspector._decoder = _HoldingDecoder()
+    assert b"".join(inspector.iter_body(io.BytesIO(ATTACK), 16)) == ATTACK
+    assert inspector.verdict()[0] >= settings.threshold_block
+
+
+class _ConsumingPool:
+    def request(self, method, url, headers=None, content=None, stream=False):
+        if content is not None and not isinstance(content, bytes):
+            b"".join(content)  # corps relayé (et inspecté) comme par httpx
+        return httpx.Response(200, content=b"ok")
+
+
+def test_error_handler_uses_stream_inspector_verdict(monkeypatch):
+    monkeypatch.setattr(proxy, "settings", dataclasses.replace(proxy.settings, body_inspection="stream", mode="IDS"))
+    monkeypatch.setattr(proxy, "get_upstream_pool", lambda: _ConsumingPool())
+
+    def _boom(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(proxy, "_filtered_response", _boom)
+    open(settings.logs_file, "w").close()
+    client = proxy.create_app_with_error_handler().test_client()
+    resp = client.post("/form", data=ATTACK, content_type="application/x-www-form-urlencoded")
+    assert resp.status_code == 500
+    with open(settings.logs_file, encoding="utf-8") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    assert events[-1]["flags"].get("unhandled_exception")
+    # Score du corps déjà relayé (le flux ne peut plus être relu)
+    assert events[-1]["score"] >= settings.threshold_block
+    assert "XSS_SCRIPT_TAG" in events[-1]["matched_rules"]
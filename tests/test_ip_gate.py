@@ -0,0 +1,30 @@
+import pytest
+
+from waf import proxy
+from waf.ip_tracker import ClientVerdict
+
+
+class _Tracker:
+    def __init__(self, verdict):
+        self.verdict = verdict
+        self.backend = type("B", (), {"name": "memory"})()
+
+    def check(self, ip):
+        return self.verdict
+
+    def count_blocked(self):
+        pass
+
+    def record(self, ip, score):
+        pass
+
+
+@pytest.mark.parametrize(
+    "verdict, status",
+    [(ClientVerdict(True, 0.0, 1.0), 429), (ClientVerdict(False, 100.0, 0.0), 403)],
+)
+def test_query_mode_switch_does_not_bypass_ip_gate(monkeypatch, verdict, status):
+    assert proxy.settings.mode == "IPS" and proxy.settings.allow_query_mode_switch
+    monkeypatch.setattr(proxy, "get_ip_tracker", lambda: _Tracker(verdict))
+    client = proxy.create_app().test_client()
+    assert client.get("/page?waf_mode=IDS").status_code == status
@@ -0,0 +1,56 @@
+import inspect
+import json
+
+from waf.config import settings
+from waf.logger import BatchLogWriter
+
+
+def _read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_default_overflow_is_block():
+    assert settings.log_overflow == "block"
+    assert inspect.signature(BatchLogWriter).parameters["overflow"].default == "block"
+
+
+def test_drop_notice_written_to_log(tmp_path):
+    path = str(tmp_path / "logs.json")
+    writer = BatchLogWriter(path, overflow="drop", flush_interval=0.05)
+    writer.submit({"action": "ALLOW", "n": 0})
+    writer._incr("dropped", 3)
+    assert writer.flush()
+    writer.close()
+    events = _read(path)
+    notices = [e for e in events if e["action"] == "LOG_DROPPED"]
+    assert len(notices) == 1
+    assert notices[0]["dropped"] == 3
+    assert notices[0]["overflow"] == "drop"
+
+
+def test_drop_accounting_matches_stream(tmp_path):
+    path = str(tmp_path / "logs.json")
+    writer = BatchLogWriter(path, max_queue=1, batch_size=1, overflow="drop", flush_interval=0.05)
+    total = 2000
+    for i in range(total):
+        writer.submit({"action": "ALLOW", "n": i})
+    assert writer.flush()
+    writer.close()
+    events = _read(path)
+    kept = [e for e in events if e["action"] == "ALLOW"]
+    dropped = sum(e["dropped"] for e in events if e["action"] == "LOG_DROPPED")
+    assert len(kept) + dropped == total
+    assert dropped == writer.stats()["dropped"]
+
+
+def test_block_keeps_every_event(tmp_path):
+    path = str(tmp_path / "logs.json")
+    writer = BatchLogWriter(path, max_queue=1, batch_size=1, flush_interval=0.05)
+    for i in range(300):
+        assert writer.submit({"action": "ALLOW", "n": i})
+    assert writer.flush()
+    writer.close()
+    events = _read(path)
+    assert [e["n"] for e in events] == list(range(300))
+    assert writer.stats()["dropped"] == 0
@@ -0,0 +1,101 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from waf.logstore import LogStore, active_filters, event_matches
+from waf.rotation import RotatingAppender, RotationPolicy, list_segments
+
+BASE = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def _event(i, **fields):
+    return {
+        "timestamp": (BASE + timedelta(seconds=i)).isoformat(),
+        "request_id": f"{i:032x}",
+        "source_ip": f"10.0.0.{i % 4}",
+        "severity": "high" if i % 3 == 0 else "none",
+        "action": "BLOCK" if i % 3 == 0 else "ALLOW",
+        "matched_rules": ["XSS"] if i % 3 == 0 else [],
+        **fields,
+    }
+
+
+def _write(path, events):
+    with open(path, "ab") as f:
+        for event in events:
+            f.write((json.dumps(event) + "\n").encode())
+
+
+def _ts(i):
+    return (BASE + timedelta(seconds=i)).isoformat()
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "logs.json")
+
+
+def test_time_window_matches_linear_scan(path):
+    events = [_event(i) for i in range(1000)]
+    _write(path, events)
+    store = LogStore(path)
+    for since, until, filters in [
+        (_ts(100), _ts(200), {}),
+        (_ts(0), _ts(5), {"severity": "HIGH"}),
+        (_ts(990), "", {"source_ip": "10.0.0.1"}),
+        ("", _ts(10), {"action": "block", "rule": "XSS"}),
+    ]:
+        got, _ = store.query(limit=0, since=since, until=until, **filters)
+        expected = [
+            e for e in events
+            if (not since or e["timestamp"] >= since) and (not until or e["timestamp"] <= until)
+            and event_matches(e, active_filters(**{"severity": "", "action": "", "rule": "",
+                                                 "source_ip": "", **filters}))
+        ]
+        assert got == expected
+
+
+def test_time_window_limit_returns_latest(path):
+    _write(path, [_event(i) for i in range(100)])
+    got, _ = LogStore(path).query(limit=3, since=_ts(10), until=_ts(50))
+    assert [e["request_id"] for e in got] == [f"{i:032x}" for i in (48, 49, 50)]
+
+
+def test_slightly_out_of_order_writers(path):
+    # Deux workers: lots entrelacés, horodatages localement non monotones
+    order = [0, 2, 1, 3, 5, 4, 6]
+    _write(path, [_event(i) for i in order])
+    got, _ = LogStore(path).query(limit=0, since=_ts(2), until=_ts(4))
+    assert sorted(e["request_id"] for e in got) == [f"{i:032x}" for i in (2, 3, 4)]
+
+
+def test_tail_follows_rotation(path):
+    appender = RotatingAppender(path, RotationPolicy(max_bytes=2000, compress="gzip"))
+    store = LogStore(path)
+    seen = []
+    cursor = 0
+    for i in range(60):
+        appender.append((json.dumps(_event(i)) + "\n").encode())
+        if i % 7 == 0:
+            items, cursor = store.since_cursor(cursor)
+            seen.extend(items)
+    items, cursor = store.since_cursor(cursor)
+    seen.extend(items)
+    appender.close()
+    assert list_segments(path), "la politique aurait dû provoquer des rotations"
+    assert [e["request_id"] for e in seen] == [f"{i:032x}" for i in range(60)]
+    # Un nouvel index relit segments (compressés ou non) puis fichier courant
+    fresh, _ = LogStore(path).query(limit=0)
+    assert [e["request_id"] for e in fresh] == [f"{i:032x}" for i in range(60)]
+
+
+def test_truncation_resets(path):
+    _write(path, [_event(i) for i in range(5)])
+    store = LogStore(path)
+    _, cursor = store.query()
+    open(path, "w").close()
+    _write(path, [_event(100)])
+    items, next_cursor = store.since_cursor(cursor)
+    assert [e["request_id"] for e in items] == [f"{100:032x}"] and next_cursor == cursor + 1
@@ -0,0 +1,66 @@
+import re
+import urllib.parse
+
+import pytest
+
+from benchmarks.corpus import adversarial_texts, analysis_texts
+from waf.rules import _safe_unquote_plus, normalize_payload
+
+
+def _legacy_normalize(s):
+    """`normalize_payload` d'origine (toutes les étapes, sans court-circuit)."""
+    had_encoding = ("%" in s) or ("+" in s)
+    if not s:
+        decoded, flags = "", {"double_decoded": False, "had_encoding": False}
+    else:
+        try:
+            once = urllib.parse.unquote_plus(s)
+        except Exception:
+            once = _safe_unquote_plus(s)
+        try:
+            twice = urllib.parse.unquote_plus(once)
+        except Exception:
+            twice = _safe_unquote_plus(once)
+        decoded, flags = twice, {"double_decoded": twice != once, "had_encoding": had_encoding}
+    s2 = decoded.lower()
+    s2 = re.sub(r"/\*+\*/", " ", s2)
+    s2 = s2.replace("%0a", " ").replace("%0d", " ").replace("%09", " ")
+    s2 = re.sub(r"\s+", " ", s2)
+    return s2.strip(), flags
+
+
+EDGE_CASES = [
+    "",
+    " ",
+    "plain text without encoding",
+    "a+b",
+    "%",
+    "%E",
+    "%ZZ",
+    "%%41",
+    "%2541",
+    "%252541",
+    "%25%30a",
+    "%0A%0d%09",
+    "%250a%250d%2509",
+    "%25250a%25252b",
+    "union/**/select/***/x/*not a comment*/",
+    "/%2A%2A/union",
+    "UPPER%20Caseİß",
+    "tabs\t\tand\nnewlines\r\n\x0b\x0c\x1c\x1d\x1e\x1f\x85  　end",
+    "%C3%A9%E2%80%A8%C2%A0",
+    "%FF%FE invalid utf-8",
+    "café crème",
+]
+
+
+@pytest.mark.parametrize("text", EDGE_CASES)
+def test_normalize_matches_legacy_edge_cases(text):
+    assert normalize_payload(text) == _legacy_normalize(text)
+
+
+def test_normalize_matches_legacy_corpus():
+    texts = analysis_texts(500) + analysis_texts(50, seed=7, body_size=4096)
+    texts += list(adversarial_texts().values())
+    for text in texts:
+        assert normalize_payload(text) == _legacy_normalize(text), text[:200]
@@ -0,0 +1,94 @@
+import dataclasses
+import re
+import time
+
+import pytest
+
+from waf import redos, ruleset
+from waf.redos import TIMEOUT_RULE, AnalysisBudget, apply_timeout, start_budget
+from waf.scoring import compute_field_score, compute_score
+
+RISKY = re.compile(r"[?&]id=[^\s&]*union")
+SAFE = re.compile(r"<script")
+ATTACK = "q=../../../../etc/passwd;cat /etc/passwd&x=<script>alert(1)</script>"
+
+
+def _time_exhausted_budget():
+    budget = AnalysisBudget(1e-9, 0)
+    time.sleep(0.001)
+    assert not budget.allow(SAFE, "<script>")
+    assert budget.exhausted and not budget.over_steps
+    return budget
+
+
+def test_time_budget_default_verdict_is_open():
+    assert redos.settings.analysis_timeout_verdict == "open"
+    matches = [("SQLI_UNION", 5)]
+    flags = {}
+    apply_timeout(_time_exhausted_budget(), matches, flags)
+    assert flags == {"analysis_timeout": True}
+    assert matches == [("SQLI_UNION", 5)]
+
+
+def test_time_budget_closed_verdict_scores_at_block_threshold(monkeypatch):
+    monkeypatch.setattr(redos, "settings", dataclasses.replace(redos.settings, analysis_timeout_verdict="closed"))
+    matches = []
+    flags = {}
+    apply_timeout(_time_exhausted_budget(), matches, flags)
+    assert flags["analysis_timeout"]
+    assert matches == [(TIMEOUT_RULE, redos.settings.threshold_block)]
+
+
+def test_step_budget_skips_only_the_risky_rule_and_fails_closed():
+    budget = AnalysisBudget(0, 10)
+    assert not budget.allow(RISKY, "?id=" + "a" * 100)
+    assert budget.over_steps and not budget.exhausted
+    # Les règles suivantes restent évaluées
+    assert budget.allow(SAFE, "?id=" + "a" * 100)
+    matches, flags = [("XSS", 5)], {}
+    apply_timeout(budget, matches, flags)
+    assert flags["analysis_timeout"]
+    assert matches == [("XSS", 5), (TIMEOUT_RULE, redos.settings.threshold_block)]
+
+
+def test_budget_not_exhausted_leaves_verdict():
+    budget = AnalysisBudget(0, 0)
+    assert budget.allow(RISKY, "?id=" + "a" * 10000)
+    matches, flags = [], {}
+    apply_timeout(budget, matches, flags)
+    assert matches == [] and flags == {}
+
+
+@pytest.mark.parametrize("engine", ["legacy", "compiled", "verify"])
+def test_padding_with_id_does_not_bypass_rules(monkeypatch, engine):
+    monkeypatch.setattr(ruleset, "settings", dataclasses.replace(ruleset.settings, rule_engine=engine))
+    threshold = redos.settings.threshold_block
+    attack = f"{ATTACK}&engine={engine}"  # texte propre au test: pas de cache de verdicts partagé
+    start_budget()
+    score, rules, flags = compute_score(attack)
+    assert score >= threshold and not flags.get("analysis_timeout")
+    # Préfixe qui fait dépasser le budget de pas à SQLI_PARAM_ID_AND_1EQ1 (moteur
+    # historique; le pré-filtre du moteur compilé écarte la règle sans l'estimer)
+    start_budget()
+    score, rules, flags = compute_score("q=" + "id=" * 1000 + "&" + attack)
+    assert bool(flags.get("analysis_timeout")) == (engine != "compiled")
+    assert {"PATH_TRAVERSAL", "CMD_INJECTION", "XSS_SCRIPT_TAG"} <= set(rules)
+    assert score >= threshold
+
+
+def test_padding_with_id_does_not_bypass_field_rules():
+    from waf.fields import RequestFields
+
+    start_budget()
+    fields = RequestFields("/", "id=" + "id=" * 1000 + "&" + ATTACK, "", "curl/8", "", "")
+    score, rules, flags, _ = compute_field_score(fields)
+    assert "XSS_SCRIPT_TAG" in rules
+    assert score >= redos.settings.threshold_block
+
+
+def test_rule_pack_reload_clears_pattern_risks():
+    redos.pattern_risk(re.compile(r"[?&]tmp=[^\s&]*x"))
+    assert redos._risks
+    ruleset.install_rule_pack(ruleset.builtin_rule_pack())
+    names = {p for p in redos._risks}
+    assert names == {p for _, p, _ in ruleset.active_rule_pack().patterns}
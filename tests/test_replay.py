@@ -0,0 +1,38 @@
+import dataclasses
+import subprocess
+import sys
+
+from waf import redos, replay
+from waf.ruleset import CompiledRuleSet, builtin_rule_pack
+
+
+def _ruleset():
+    pack = builtin_rule_pack()
+    return CompiledRuleSet(pack.patterns, pack.anchors)
+
+
+def test_score_text_ignores_wall_clock_budget(monkeypatch):
+    # Budget de temps déjà épuisé: le rejeu ne doit pas en tenir compte
+    for module in (redos, replay):
+        monkeypatch.setattr(module, "settings", dataclasses.replace(module.settings, analysis_budget_ms=1e-9))
+    ruleset = _ruleset()
+    text = "GET /search?q=" + "hello world " * 5000
+    score, matched, flags = replay.score_text(text, ruleset, 9)
+    assert not flags.get("analysis_timeout")
+    attack = replay.score_text("GET /?id=1' UNION SELECT password FROM users--", ruleset, 9)
+    assert attack[0] > 0 and attack[1]
+    assert not attack[2].get("analysis_timeout")
+
+
+def test_score_text_step_budget_still_applies(monkeypatch):
+    monkeypatch.setattr(replay, "settings", dataclasses.replace(replay.settings, regex_step_budget=10))
+    text = "GET /?id=" + "a" * 5000 + "+union select 1"
+    _, _, flags = replay.score_text(text, _ruleset(), 9)
+    assert flags.get("analysis_timeout")
+
+
+def test_replay_does_not_import_proxy_stack():
+    # Les workers du pool n'importent que le moteur d'analyse, pas Flask ni le proxy
+    code = "import sys, waf.replay; print(sorted(m for m in ('flask', 'waf.proxy') if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "[]"
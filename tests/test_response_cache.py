@@ -0,0 +1,47 @@
+from waf.response_cache import CachedResponse, ResponseCache, _MappedStream
+
+HEADERS = [(b"Content-Type", b"application/octet-stream"), (b"Cache-Control", b"max-age=60")]
+BIG = bytes(range(256)) * 1024  # 256 KiB
+
+
+def _no_header(name):
+    return None
+
+
+def _spilled_cache(tmp_path):
+    cache = ResponseCache(
+        max_bytes=len(BIG), max_entry=len(BIG), max_ttl=300, stale=0,
+        spill_dir=str(tmp_path), max_disk_bytes=4 * len(BIG),
+    )
+    assert cache._store("http://b/big", 200, HEADERS, BIG, _no_header)
+    assert cache._store("http://b/other", 200, HEADERS, b"x" * 100, _no_header)
+    assert cache.stats()["spills"] == 1
+    return cache
+
+
+def test_spilled_body_streamed_in_slices(tmp_path):
+    cache = _spilled_cache(tmp_path)
+    resp = cache.lookup("GET", "http://b/big", _no_header).response
+    assert isinstance(resp.stream, _MappedStream)
+    assert resp.headers["content-length"] == str(len(BIG))
+    chunks = list(resp.stream)
+    assert all(len(c) <= _MappedStream.CHUNK for c in chunks)
+    assert len(chunks) == len(BIG) // _MappedStream.CHUNK
+    assert b"".join(chunks) == BIG
+
+
+def test_spilled_body_survives_eviction_mid_stream(tmp_path):
+    cache = _spilled_cache(tmp_path)
+    resp = cache.lookup("GET", "http://b/big", _no_header).response
+    it = iter(resp.stream)
+    first = next(it)
+    cache.clear()
+    assert first + b"".join(it) == BIG
+
+
+def test_memory_body_and_not_modified():
+    entry = CachedResponse(("http://b/", ()), 200, list(HEADERS), (), b"hello", (0.0, 60.0, 0.0))
+    resp = entry.response(0.0)
+    assert resp.read() == b"hello"
+    assert resp.headers["content-length"] == "5"
+    assert entry.response(0.0, not_modified=True).read() == b""
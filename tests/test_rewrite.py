@@ -0,0 +1,85 @@
+import asyncio
+import random
+import re
+
+import pytest
+
+from benchmarks.corpus import html_page
+from waf.rewrite import RewriteContext, backend_url, rewrite_context
+
+BACKEND = "http://127.0.0.1:8080"
+HOSTS = [("http", "waf.local"), ("https", "waf.local:8443"), ("http", "10.0.0.5"), ("https", "wäf.example")]
+EDGE = (
+    "<a href='http://127.0.0.1:8080/x'>http://127.0.0.1:8080</a>"
+    "<img src=\"//127.0.0.1:8080/i.png\"> https://127.0.0.1:8080/s "
+    "http://127.0.0.1:80800 //127.0.0.1:8080http://127.0.0.1:8080//127.0.0.1:8080 "
+    "http://127.0.0.1:808 hthttp://127.0.0.1:8080 é ü 日本 url(//127.0.0.1:8080/c.css)"
+)
+
+
+def _legacy_rewrite(text, waf_scheme, waf_host):
+    """Remplacement d'origine: regex d'alternatives (plus long motif d'abord) sur le texte décodé."""
+    backend = backend_url(BACKEND)
+    table = {backend.origin: f"{waf_scheme}://{waf_host}", f"//{backend.netloc}": f"//{waf_host}"}
+    olds = sorted(table, key=lambda old: (-len(old), old))
+    regex = re.compile("|".join(re.escape(old) for old in olds))
+    return regex.sub(lambda m: table[m.group(0)], text)
+
+
+def _bodies():
+    return [EDGE, EDGE * 50, html_page(64 * 1024).decode("utf-8"), "", "no backend url here"]
+
+
+def _splits(data, rng):
+    cuts = sorted(rng.sample(range(1, len(data)), min(len(data) - 1, 40))) if len(data) > 1 else []
+    return [data[i:j] for i, j in zip([0] + cuts, cuts + [len(data)])]
+
+
+@pytest.mark.parametrize("scheme,host", HOSTS)
+@pytest.mark.parametrize("encoding", ["utf-8", "latin-1", "utf-16", "shift_jis"])
+def test_rewrite_body_matches_legacy(scheme, host, encoding):
+    ctx = RewriteContext(backend_url(BACKEND), scheme, host)
+    for text in _bodies():
+        try:
+            body = text.encode(encoding)
+        except UnicodeEncodeError:
+            body = text.encode(encoding, errors="replace")
+        expected = _legacy_rewrite(body.decode(encoding), scheme, host).encode(encoding, errors="replace")
+        assert ctx.rewrite_body(body, encoding) == expected
+
+
+@pytest.mark.parametrize("scheme,host", HOSTS)
+@pytest.mark.parametrize("encoding", ["utf-8", "utf-16"])
+def test_chunked_rewrite_matches_whole_body(scheme, host, encoding):
+    ctx = RewriteContext(backend_url(BACKEND), scheme, host)
+    rng = random.Random(21)
+    for text in _bodies():
+        body = text.encode(encoding)
+        whole = ctx.rewrite_body(body, encoding)
+        for _ in range(5):
+            chunks = _splits(body, rng)
+            assert b"".join(ctx.rewrite_chunks(chunks, encoding)) == whole
+
+            async def _collect():
+                async def _gen():
+                    for chunk in chunks:
+                        yield chunk
+                return b"".join([c async for c in ctx.arewrite_chunks(_gen(), encoding)])
+
+            assert asyncio.run(_collect()) == whole
+
+
+def test_one_byte_chunks_across_patterns():
+    ctx = rewrite_context(BACKEND, "https", "waf.local")
+    body = EDGE.encode("utf-8")
+    expected = _legacy_rewrite(EDGE, "https", "waf.local").encode("utf-8")
+    assert b"".join(ctx.rewrite_chunks([body[i:i + 1] for i in range(len(body))], "utf-8")) == expected
+
+
+def test_location_and_set_cookie():
+    ctx = rewrite_context(BACKEND, "https", "waf.local:8443")
+    assert ctx.rewrite_location("http://127.0.0.1:8080/login.php?x=1#f") == "https://waf.local:8443/login.php?x=1#f"
+    assert ctx.rewrite_location("http://other.host/login.php") == "http://other.host/login.php"
+    assert ctx.rewrite_location("/relative") == "/relative"
+    assert ctx.rewrite_set_cookie("a=1; Domain=127.0.0.1; Path=/") == "a=1; Domain=waf.local; Path=/"
+    assert ctx.rewrite_set_cookie("a=1; Path=/") == "a=1; Path=/"
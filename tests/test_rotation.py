@@ -0,0 +1,80 @@
+import gzip
+import os
+
+from waf.config import settings
+from waf.logger import rotation_policy
+from waf.rotation import (
+    RotatingAppender,
+    RotationPolicy,
+    apply_retention,
+    iter_lines,
+    list_segments,
+    open_segment,
+)
+
+
+def test_defaults_keep_full_history():
+    policy = rotation_policy()
+    assert not policy.enabled
+    assert policy.keep == 0 and policy.max_age == 0
+    assert settings.log_rotate_bytes == 0
+
+
+def _fill(path, policy, n=50):
+    appender = RotatingAppender(path, policy)
+    for i in range(n):
+        appender.append(f'{{"timestamp": "t{i:04d}", "n": {i}}}\n'.encode())
+    appender.close()
+
+
+def test_size_rotation_keeps_every_line_in_order(tmp_path):
+    path = str(tmp_path / "logs.json")
+    _fill(path, RotationPolicy(max_bytes=300, naming="numbered", compress="none"))
+    segments = list_segments(path)
+    assert len(segments) > 3
+    assert [os.path.basename(s) for s in segments] == [f"logs.json.{i:06d}" for i in range(1, len(segments) + 1)]
+    lines = list(iter_lines(path))
+    assert [int(line.split('"n": ')[1].rstrip("}\n")) for line in lines] == list(range(50))
+
+
+def test_compressed_segments_are_readable(tmp_path):
+    path = str(tmp_path / "logs.json")
+    policy = RotationPolicy(max_bytes=50, compress="gzip")
+    appender = RotatingAppender(path, policy)
+    for i in range(20):
+        appender.append(f'{{"n": {i}}}\n'.encode())
+    appender.close()
+    for segment in list_segments(path):
+        # Compression faite en arrière-plan: la compresser ici si besoin
+        if not segment.endswith(".gz"):
+            appender._finish_segment(segment)
+    segments = list_segments(path)
+    assert segments and all(s.endswith(".gz") for s in segments)
+    with open_segment(segments[0]) as f:
+        assert f.read().startswith(b'{"n": 0}')
+    with gzip.open(segments[0]) as f:
+        assert f.read()
+    assert len(list(iter_lines(path))) == 20
+
+
+def test_retention_is_explicit(tmp_path):
+    path = str(tmp_path / "logs.json")
+    _fill(path, RotationPolicy(max_bytes=300, naming="numbered", compress="none"))
+    count = len(list_segments(path))
+    apply_retention(path, RotationPolicy(max_bytes=300))
+    assert len(list_segments(path)) == count
+    apply_retention(path, RotationPolicy(max_bytes=300, keep=2))
+    assert [os.path.basename(s) for s in list_segments(path)] == [f"logs.json.{i:06d}" for i in (count - 1, count)]
+
+
+def test_segment_compressed_after_listing_still_opens(tmp_path):
+    path = str(tmp_path / "logs.json")
+    _fill(path, RotationPolicy(max_bytes=300, naming="numbered", compress="none"))
+    segment = list_segments(path)[0]
+    with open(segment, "rb") as f:
+        content = f.read()
+    with gzip.open(segment + ".gz", "wb") as f:
+        f.write(content)
+    os.remove(segment)
+    with open_segment(segment) as f:
+        assert f.read() == content
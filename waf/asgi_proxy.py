@@ -0,0 +1,574 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import urllib.parse
+from time import perf_counter
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .compress import acompress_chunks
+from .config import settings
+from .fields import RequestFields
+from .access_lists import (
+    DENY_BODY,
+    DENY_HEADERS,
+    access_lists_stats,
+    admin_client,
+    check_client,
+    denial_event,
+    init_access_lists,
+    should_log_denial,
+)
+from .inspection import StreamingInspector
+from .ip_tracker import get_ip_tracker, ip_tracker_stats
+from .logger import append_log, get_log_writer, log_writer_stats, new_request_id, utc_now_iso, time_ms
+from .metrics import PROMETHEUS_CONTENT_TYPE, get_metrics
+from .proxy import (
+    ADMIN_METRICS_PATHS,
+    _buffered_response,
+    _build_target_url,
+    _client_gate,
+    _client_info,
+    _client_rejection,
+    _fields_info,
+    _log_with_timings,
+    _passthrough,
+    _revalidation_headers,
+    _rewrite_context,
+    _rewrite_upstream_response,
+    _rewrites_body,
+    _server_timing_headers,
+    _streamed_response_headers,
+    _upstream_request_headers,
+    _waf_headers,
+)
+from .redos import start_budget
+from .response_cache import CacheLookup, aread_limited, get_response_cache, response_cache_stats
+from .rulepack import init_rule_pack, rule_pack_status
+from .ruleset import rules_version, verify_stats
+from .scoring import analysis_text, compute_field_score, compute_score, severity_from_score
+from .timing import StageTimer, start_timer
+from .verdict_cache import verdict_cache_stats
+from .upstream import AsyncUpstreamPool, new_async_upstream_pool
+
+Scope = Dict[str, Any]
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class _AsgiRequest:
+    """Vue minimale d'une requête ASGI (équivalent des attributs Flask utilisés par le proxy)."""
+
+    def __init__(self, scope: Scope, receive: Receive) -> None:
+        self.receive = receive
+        self.method: str = scope.get("method", "GET")
+        self.path: str = scope.get("path") or "/"
+        self.query_string: str = (scope.get("query_string") or b"").decode("utf-8", errors="ignore")
+        self.headers: List[Tuple[str, str]] = [
+            (k.decode("latin-1"), v.decode("latin-1")) for k, v in scope.get("headers") or []
+        ]
+        client = scope.get("client")
+        self.remote_addr: str = client[0] if client else "unknown"
+        self.scheme: str = scope.get("scheme", "http")
+        server = scope.get("server")
+        default_host = f"{server[0]}:{server[1]}" if server else "localhost"
+        self.host: str = self.header("Host") or default_host
+        self.url = f"{self.scheme}://{self.host}{self.path}"
+        if self.query_string:
+            self.url += "?" + self.query_string
+
+    def header(self, name: str, default: str = "") -> str:
+        lname = name.lower()
+        for k, v in self.headers:
+            if k.lower() == lname:
+                return v
+        return default
+
+    def arg(self, name: str) -> Optional[str]:
+        values = urllib.parse.parse_qs(self.query_string).get(name)
+        return values[0] if values else None
+
+    def has_body(self) -> bool:
+        if self.header("Content-Length") not in ("", "0"):
+            return True
+        return "chunked" in self.header("Transfer-Encoding").lower()
+
+    async def iter_body(self) -> AsyncIterator[bytes]:
+        while True:
+            message = await self.receive()
+            if message["type"] == "http.disconnect":
+                break
+            chunk = message.get("body", b"")
+            if chunk:
+                yield chunk
+            if not message.get("more_body", False):
+                break
+
+    async def body(self) -> bytes:
+        return b"".join([chunk async for chunk in self.iter_body()])
+
+    def fields(self, body_text: str = "") -> RequestFields:
+        return RequestFields(
+            self.path,
+            self.query_string,
+            body_text,
+            self.header("User-Agent"),
+            self.header("Referer"),
+            self.header("Cookie"),
+            self.header("Content-Type"),
+        )
+
+
+class _ResponseSend:
+    """`send` ASGI qui retient si la réponse a commencé (en-têtes partis) ou est terminée."""
+
+    __slots__ = ("send", "started", "finished")
+
+    def __init__(self, send: Send) -> None:
+        self.send = send
+        self.started = False
+        self.finished = False
+
+    async def __call__(self, message: Dict[str, Any]) -> None:
+        if message["type"] == "http.response.start":
+            self.started = True
+        elif message["type"] == "http.response.body" and not message.get("more_body", False):
+            self.finished = True
+        await self.send(message)
+
+    async def end(self) -> None:
+        """Clore un corps commencé (tronqué) sans envoyer de seconde réponse."""
+        if self.started and not self.finished:
+            try:
+                await self({"type": "http.response.body", "body": b"", "more_body": False})
+            except Exception:
+                pass
+
+
+async def _send_response(
+    send: Send, status: int, body: bytes, headers: List[Tuple[str, str]]
+) -> None:
+    raw_headers = [(k.encode("latin-1"), v.encode("latin-1", errors="replace")) for k, v in headers]
+    raw_headers.append((b"content-length", str(len(body)).encode("ascii")))
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_stream(
+    send: Send, status: int, chunks: AsyncIterator[bytes], headers: List[Tuple[str, str]]
+) -> None:
+    """Réponse envoyée morceau par morceau (sans Content-Length: transfert par morceaux)."""
+    raw_headers = [(k.encode("latin-1"), v.encode("latin-1", errors="replace")) for k, v in headers]
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+    async for chunk in chunks:
+        if chunk:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _send_json(send: Send, status: int, obj: Dict[str, Any], extra: Dict[str, str]) -> None:
+    body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+    await _send_response(send, status, body, [("Content-Type", "application/json"), *extra.items()])
+
+
+async def _log(event: Dict[str, Any], timer: Optional[StageTimer] = None) -> None:
+    if timer is None:
+        log: Callable[..., None] = append_log
+        args: Tuple[Any, ...] = (event,)
+    else:
+        log, args = _log_with_timings, (event, timer)
+    tracker = get_ip_tracker()
+    shared_tracker = timer is not None and tracker is not None and tracker.backend.name != "memory"
+    if settings.log_writer == "async" and not shared_tracker and (
+        settings.log_overflow != "block" or not get_log_writer().full()
+    ):
+        # Simple mise en file, non bloquante (file non pleine ou politique sans attente)
+        log(*args)
+        return
+    # Écriture disque (ou attente de place en file) hors de la boucle d'événements
+    await asyncio.to_thread(log, *args)
+
+
+# Revalidations du microcache en cours (référencées jusqu'à leur fin)
+_revalidations: set = set()
+
+
+async def _revalidate(lookup: CacheLookup, pool: AsyncUpstreamPool, target_url: str, headers: Dict[str, str]) -> None:
+    """Revalider une entrée périmée du microcache (déjà servie au client)."""
+    cache = get_response_cache()
+    if cache is None:
+        return
+    try:
+        resp = await pool.request("GET", target_url, headers=headers, stream=True)
+        try:
+            body = await aread_limited(resp.aiter_raw(), cache.max_entry)
+        finally:
+            await resp.aclose()
+        cache.revalidated(lookup, resp.status_code, list(resp.headers.raw), body)
+    except Exception:
+        cache.revalidated(lookup, 0, None, None)
+
+
+async def _proxy(req: _AsgiRequest, send: _ResponseSend, pool: AsyncUpstreamPool) -> None:
+    source_ip = req.remote_addr
+    user_agent = req.header("User-Agent")
+    # Listes d'accès: refus immédiat, sans analyse ni événement complet
+    denied = check_client(source_ip, user_agent)
+    if denied is not None:
+        if should_log_denial():
+            await _log(denial_event(denied, source_ip, req.method, req.url, user_agent))
+        await _send_response(send, 403, DENY_BODY, list(DENY_HEADERS))
+        return
+
+    started = time_ms()
+    timer = start_timer()
+    start_budget()
+    rid = new_request_id()
+    method = req.method
+
+    # Allow mode override via query param for demo if enabled
+    mode = settings.mode
+    if settings.allow_query_mode_switch:
+        qmode = req.arg("waf_mode")
+        if qmode and qmode.upper() in {"IDS", "IPS"}:
+            mode = qmode.upper()
+
+    # Suivi par IP, avant toute lecture du corps ou analyse
+    tracker = get_ip_tracker()
+    if tracker is not None:
+        if tracker.backend.name == "memory":
+            client = tracker.check(source_ip)
+        else:
+            client = await asyncio.to_thread(tracker.check, source_ip)
+        timer.details["client"] = _client_info(client)
+        gate = _client_gate(client, settings.mode)
+        if gate is not None:
+            action, status = gate
+            if action == "BLOCK":
+                tracker.count_blocked()
+            await _log({
+                "timestamp": utc_now_iso(),
+                "request_id": rid,
+                "source_ip": source_ip,
+                "method": method,
+                "url": req.url,
+                "backend_url": _build_target_url(req.path, req.query_string),
+                "score": 0,
+                "severity": "none",
+                "matched_rules": [],
+                "flags": {},
+                "action": action,
+                "status": status,
+                "user_agent": user_agent,
+                "response_time_ms": time_ms() - started,
+            }, timer)
+            body, headers = _client_rejection(action, client, rid)
+            await _send_json(send, status, body, {**headers, **_server_timing_headers(timer)})
+            return
+
+    # Compute score hors de la boucle (les regex peuvent être coûteuses sur de gros corps)
+    inspector: Optional[StreamingInspector] = None
+    req_body: Any = b""
+    fields_mode = settings.inspection_mode == "fields"
+    matched_fields: Dict[str, str] = {}
+    try:
+        if settings.body_inspection == "stream" and req.has_body():
+            t0 = perf_counter()
+            head: Any = req.fields() if fields_mode else analysis_text(
+                req.path, req.query_string, "", user_agent, req.header("Referer"), req.header("Cookie")
+            )
+            timer.mark("collect", t0)
+            inspector = await asyncio.to_thread(
+                StreamingInspector,
+                head,
+                settings.body_inspect_max_bytes,
+                settings.body_inspect_overlap,
+                settings.threshold_block if mode == "IPS" else None,
+            )
+            score, matched_rules, flags = inspector.verdict()
+            matched_fields = inspector.matched_fields
+        elif fields_mode:
+            t0 = perf_counter()
+            req_body = await req.body()
+            fields = req.fields(req_body.decode("utf-8", errors="replace"))
+            timer.mark("collect", t0)
+            score, matched_rules, flags, matched_fields = await asyncio.to_thread(compute_field_score, fields)
+        else:
+            t0 = perf_counter()
+            req_body = await req.body()
+            text = analysis_text(
+                req.path,
+                req.query_string,
+                req_body.decode("utf-8", errors="replace"),
+                user_agent,
+                req.header("Referer"),
+                req.header("Cookie"),
+            )
+            timer.mark("collect", t0)
+            score, matched_rules, flags = await asyncio.to_thread(compute_score, text)
+    except Exception:
+        # En cas d'erreur d'analyse, on marque score=0 mais on continue et on loguera l'erreur
+        inspector = None
+        score, matched_rules, flags = 0, [], {"analysis_error": True}
+        matched_fields = {}
+    severity = severity_from_score(score)
+
+    # Action resolution
+    action = "ALLOW"
+    if mode == "IPS" and score >= settings.threshold_block:
+        action = "BLOCK"
+
+    target_url = _build_target_url(req.path, req.query_string)
+    waf_hdrs = _waf_headers(score, severity, action, rid)
+
+    def _event(**fields: Any) -> Dict[str, Any]:
+        event = {
+            "timestamp": utc_now_iso(),
+            "request_id": rid,
+            "source_ip": source_ip,
+            "method": method,
+            "url": req.url,
+            "backend_url": target_url,
+            "score": score,
+            "severity": severity,
+            "matched_rules": matched_rules,
+            **_fields_info(matched_fields),
+            "flags": flags,
+            "action": action,
+            "status": None,
+            "user_agent": user_agent,
+            "response_time_ms": time_ms() - started,
+        }
+        event.update(fields)
+        return event
+
+    async def _blocked() -> None:
+        await _log(_event(action="BLOCK", status=403), timer)
+        body = {
+            "error": "Blocked by WAF",
+            "action": "BLOCK",
+            "score": score,
+            "severity": severity,
+            "rules": matched_rules,
+            "request_id": rid,
+        }
+        extra = {**_waf_headers(score, severity, "BLOCK", rid), **_server_timing_headers(timer)}
+        await _send_json(send, 403, body, extra)
+
+    if action == "BLOCK":
+        await _blocked()
+        return
+
+    # Microcache des réponses amont (requête analysée et journalisée comme les autres)
+    cache = get_response_cache()
+    cached = None
+    if cache is not None and inspector is None:
+        cached = cache.lookup(method, target_url, req.header, req.has_body())
+
+    # Forward to backend
+    try:
+        if inspector is not None:
+            req_body = _inspected_body(req, inspector)
+        headers = _upstream_request_headers(req.headers, target_url, source_ip, req.scheme, req.host)
+        if cached is not None and cached.response is not None:
+            upstream_resp = cached.response
+            flags = {**flags, "cache_hit": True}
+            if cached.revalidate is not None:
+                task = asyncio.create_task(
+                    _revalidate(cached, pool, target_url, _revalidation_headers(headers, cached.revalidate))
+                )
+                _revalidations.add(task)
+                task.add_done_callback(_revalidations.discard)
+        else:
+            t0 = perf_counter()
+            try:
+                upstream_resp = await pool.request(method, target_url, headers=headers, content=req_body, stream=True)
+            finally:
+                timer.mark("upstream", t0)
+            if cache is not None and cached is not None:
+                # Réponse mémorisée pendant son relais si elle est cacheable
+                upstream_resp = cache.tee(cached, upstream_resp, req.header)
+    except Exception as e:  # Capture toute erreur (httpx, encodage, etc.)
+        if inspector is not None:
+            score, matched_rules, flags = inspector.verdict()
+            severity = severity_from_score(score)
+            if inspector.blocked:
+                await _blocked()
+                return
+            waf_hdrs = _waf_headers(score, severity, action, rid)
+        await _log(_event(
+            flags={**(flags or {}), "proxy_error": True},
+            action="ERROR",
+            status=502,
+            error=str(e),
+        ), timer)
+        extra = {**waf_hdrs, **_server_timing_headers(timer)}
+        await _send_json(send, 502, {"error": "Bad Gateway", "details": str(e)}, extra)
+        return
+
+    if inspector is not None:
+        # Verdict final (en-têtes + corps inspecté)
+        score, matched_rules, flags = inspector.verdict()
+        severity = severity_from_score(score)
+        waf_hdrs = _waf_headers(score, severity, action, rid)
+
+    duration_ms = time_ms() - started
+    accept_encoding = req.header("Accept-Encoding")
+    failure: Dict[str, Any] = {}
+    try:
+        if _buffered_response(upstream_resp) and not _passthrough(upstream_resp, accept_encoding):
+            await upstream_resp.aread()
+            t0 = perf_counter()
+            body_bytes, headers, _ = _rewrite_upstream_response(
+                upstream_resp, req.scheme, req.host, method, accept_encoding
+            )
+            timer.mark("rewrite", t0)
+            # La réponse part avant l'écriture du log: Server-Timing n'inclut pas l'étape `log`
+            extra = {**waf_hdrs, **_server_timing_headers(timer)}
+            await _send_response(send, upstream_resp.status_code, body_bytes, [*headers, *extra.items()])
+        else:
+            # Relais en flux: le corps n'est jamais entièrement en mémoire
+            t0 = perf_counter()
+            ctx = _rewrite_context(req.scheme, req.host)
+            headers, passthrough, coding = _streamed_response_headers(upstream_resp, ctx, method, accept_encoding)
+            if passthrough:
+                # Octets compressés amont relayés sans décompression
+                chunks = upstream_resp.aiter_raw(settings.response_chunk_size)
+            else:
+                chunks = upstream_resp.aiter_bytes(settings.response_chunk_size)
+                if _rewrites_body(upstream_resp):
+                    chunks = ctx.arewrite_chunks(chunks, upstream_resp.encoding or "utf-8")
+                    if coding is not None:
+                        chunks = acompress_chunks(chunks, coding, settings.response_compression_level)
+            timer.mark("rewrite", t0)
+            extra = {**waf_hdrs, **_server_timing_headers(timer)}
+            await _send_stream(send, upstream_resp.status_code, chunks, [*headers, *extra.items()])
+    except Exception as e:
+        # Erreur pendant la lecture ou le relais du corps: un seul événement, une seule réponse
+        failure = {"flags": {**(flags or {}), "proxy_error": True}, "error": str(e)}
+        if send.started:
+            # En-têtes déjà envoyés: le corps est clos (tronqué), pas de 500 en plus
+            await send.end()
+        else:
+            failure.update(action="ERROR", status=502)
+            extra = {**waf_hdrs, **_server_timing_headers(timer)}
+            await _send_json(send, 502, {"error": "Bad Gateway", "details": str(e)}, extra)
+    finally:
+        await upstream_resp.aclose()
+        # Log event (même si le client est parti en cours de réponse)
+        await _log(_event(**{"status": upstream_resp.status_code, "response_time_ms": duration_ms, **failure}), timer)
+
+
+async def _inspected_body(req: _AsgiRequest, inspector: StreamingInspector) -> AsyncIterator[bytes]:
+    """Relais morceau par morceau, analysé dans un thread (mémoire bornée)."""
+    async for chunk in req.iter_body():
+        await asyncio.to_thread(inspector.feed, chunk)
+        yield chunk
+    await asyncio.to_thread(inspector.finish)
+
+
+async def _unexpected_error(req: _AsgiRequest, send: Send) -> None:
+    # Équivalent de l'errorhandler Flask: toujours journaliser l'événement
+    rid = new_request_id()
+    try:
+        text = analysis_text(
+            req.path, req.query_string, "", req.header("User-Agent"), req.header("Referer"), req.header("Cookie")
+        )
+        score, matched_rules, flags = await asyncio.to_thread(compute_score, text)
+    except Exception:
+        score, matched_rules, flags = 0, [], {"analysis_error": True}
+    severity = severity_from_score(score)
+    try:
+        target_url = _build_target_url(req.path, req.query_string)
+    except Exception:
+        target_url = ""
+    await _log({
+        "timestamp": utc_now_iso(),
+        "request_id": rid,
+        "source_ip": req.remote_addr,
+        "method": req.method,
+        "url": req.url,
+        "backend_url": target_url,
+        "score": score,
+        "severity": severity,
+        "matched_rules": matched_rules,
+        "flags": {**(flags or {}), "unhandled_exception": True},
+        "rules_version": rules_version(),
+        "action": "ERROR",
+        "status": 500,
+        "user_agent": req.header("User-Agent"),
+        "response_time_ms": None,
+    })
+    await _send_json(
+        send,
+        500,
+        {"error": "Internal Server Error", "request_id": rid},
+        _waf_headers(score, severity, "ERROR", rid),
+    )
+
+
+def create_asgi_app() -> Callable[[Scope, Receive, Send], Awaitable[None]]:
+    """Application ASGI équivalente à `create_app_with_error_handler()`.
+    Le pool amont asynchrone est créé au démarrage (lifespan) et fermé à l'arrêt.
+    """
+    state: Dict[str, Optional[AsyncUpstreamPool]] = {"pool": None}
+    init_rule_pack()
+    init_access_lists()
+
+    def _pool() -> AsyncUpstreamPool:
+        if state["pool"] is None:
+            state["pool"] = new_async_upstream_pool()
+        return state["pool"]
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    _pool()
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    if state["pool"] is not None:
+                        await state["pool"].aclose()
+                        state["pool"] = None
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+
+        req = _AsgiRequest(scope, receive)
+        if req.path == "/healthz" and req.method == "GET":
+            status: Dict[str, Any] = {"status": "ok", "mode": settings.mode}
+            # Détails internes réservés aux adresses d'administration
+            if admin_client(req.remote_addr):
+                status.update({
+                    "engine": "asgi",
+                    "rule_engine": {"engine": settings.rule_engine, **verify_stats()},
+                    "rule_pack": rule_pack_status(),
+                    "upstream_pool": _pool().stats(),
+                    "log_writer": log_writer_stats(),
+                    "verdict_cache": verdict_cache_stats(),
+                    "ip_tracker": ip_tracker_stats(),
+                    "access_lists": access_lists_stats(),
+                    "response_cache": response_cache_stats(),
+                })
+            await _send_json(send, 200, status, {})
+            return
+        if req.method == "GET" and req.path in ADMIN_METRICS_PATHS and admin_client(req.remote_addr):
+            if req.path == "/metrics":
+                body = get_metrics().prometheus().encode("utf-8")
+                await _send_response(send, 200, body, [("Content-Type", PROMETHEUS_CONTENT_TYPE)])
+            else:
+                await _send_json(send, 200, get_metrics().summary(), {})
+            return
+        response = _ResponseSend(send)
+        try:
+            await _proxy(req, response, _pool())
+        except Exception:
+            if response.started:
+                # Une réponse est déjà en cours: la terminer, jamais de seconde réponse
+                await response.end()
+            else:
+                await _unexpected_error(req, response)
+
+    return app
@@ -0,0 +1,583 @@
+"""Format binaire compact du journal des événements (`WAF_LOG_FORMAT=binary`).
+
+Le fichier est une suite de blocs autonomes, un par écriture (lot du writer
+asynchrone, ou événement isolé en mode sync), ajoutés avec O_APPEND sous
+verrou comme les lignes JSONL (plusieurs processus peuvent donc écrire dans le
+même fichier, et la rotation reste celle de `waf/rotation.py`):
+
+    en-tête   "WAFB", version, nombre d'enregistrements, taille du bloc,
+              horodatages min/max (µs depuis l'epoch)
+    chaînes   table des chaînes internées du bloc (règles, severity, action,
+              méthode, IP source, User-Agent)
+    colonnes  timestamp (int64), severity, action, source_ip (index uint16
+              dans la table)
+    données   enregistrements préfixés par leur longueur: champs fixes
+              (request_id sur 16 octets, statut, score, durée, règles...)
+              puis les autres champs en JSON
+
+L'en-tête et les colonnes forment l'index du bloc: un lecteur saute les blocs
+hors de la plage de temps ou dont la table ne contient pas la valeur cherchée,
+filtre sur les colonnes et ne décode que les enregistrements retenus.
+
+Conversion depuis/vers JSONL:
+
+    python -m waf.binlog from-jsonl data/logs.json -o data/logs.bin
+    python -m waf.binlog to-jsonl data/logs.bin.20250101T000000Z.gz > old.json
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import mmap
+import os
+import struct
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from typing import IO, Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple, Union
+
+try:
+    import orjson  # type: ignore
+except Exception:  # pragma: no cover - optional
+    orjson = None  # type: ignore
+
+from .rotation import iter_log_files, open_segment
+
+MAGIC = b"WAFB"
+VERSION = 1
+
+# magic, version, (réservé), nombre d'enregistrements, taille totale, ts min, ts max
+_HEADER = struct.Struct("<4sB3xIIqq")
+# présence, request_id, méthode, User-Agent, statut, score, durée (ms), nombre de règles
+_RECORD = struct.Struct("<H16sHHhiiH")
+_U32 = struct.Struct("<I")
+
+_ABSENT = 0xFFFF  # index de chaîne: champ absent (ou non textuel, alors gardé dans le JSON)
+_MAX_STRINGS = 0xFFFF
+_MAX_RECORDS = 4096
+_MAX_RULES = 1024
+
+# Bits de présence des champs fixes d'un enregistrement
+_TS = 1 << 0
+_RID = 1 << 1
+_STATUS = 1 << 2
+_STATUS_NULL = 1 << 3
+_SCORE = 1 << 4
+_RT = 1 << 5
+_RT_NULL = 1 << 6
+_RULES = 1 << 7
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+Buffer = Union[bytes, bytearray, mmap.mmap]
+
+
+def iso_to_us(value: str) -> Optional[int]:
+    """Horodatage ISO 8601 -> µs depuis l'epoch (sans fuseau: UTC)."""
+    try:
+        dt = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    delta = dt - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def us_to_iso(us: int) -> str:
+    return (_EPOCH + timedelta(microseconds=us)).isoformat()
+
+
+def sniff(head: bytes) -> Optional[bool]:
+    """Début de fichier binaire (True), JSONL (False) ou encore indéterminé (None)."""
+    if head.startswith(MAGIC):
+        return True
+    if not head or MAGIC.startswith(head):
+        return None
+    return False
+
+
+def first_timestamp(head: bytes) -> Optional[float]:
+    """Horodatage (s) du premier bloc d'un fichier binaire."""
+    if len(head) < _HEADER.size or not head.startswith(MAGIC):
+        return None
+    ts_min = _HEADER.unpack_from(head)[4]
+    return ts_min / 1e6 if ts_min > 0 else None
+
+
+def _dumps(obj: Dict[str, Any]) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _loads(data: bytes) -> Dict[str, Any]:
+    obj = orjson.loads(data) if orjson is not None else json.loads(data.decode("utf-8", errors="replace"))
+    return obj if isinstance(obj, dict) else {}
+
+
+def _is_int(value: Any, low: int, high: int) -> bool:
+    return type(value) is int and low <= value <= high
+
+
+# --- écriture ----------------------------------------------------------------------
+
+
+class _BlockEncoder:
+    __slots__ = ("ids", "strings", "ts", "severity", "action", "source_ip", "records")
+
+    def __init__(self) -> None:
+        self.ids: Dict[str, int] = {}
+        self.strings: List[str] = []
+        self.ts: List[int] = []
+        self.severity: List[int] = []
+        self.action: List[int] = []
+        self.source_ip: List[int] = []
+        self.records: List[bytes] = []
+
+    def full(self) -> bool:
+        # Chaque enregistrement ajoute au plus 5 chaînes plus ses règles
+        return len(self.records) >= _MAX_RECORDS or len(self.strings) > _MAX_STRINGS - _MAX_RULES - 6
+
+    def _intern(self, rest: Dict[str, Any], key: str) -> int:
+        value = rest.get(key)
+        if not isinstance(value, str):
+            return _ABSENT
+        del rest[key]
+        index = self.ids.get(value)
+        if index is None:
+            index = self.ids[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+    def add(self, event: Dict[str, Any]) -> None:
+        rest = dict(event)
+        mask = 0
+        ts = 0
+        value = rest.get("timestamp")
+        if isinstance(value, str):
+            ts = iso_to_us(value) or 0
+            # Colonne renseignée dès que l'horodatage est lisible; la chaîne
+            # n'est supprimée du JSON que si elle se reconstruit à l'identique
+            if ts and us_to_iso(ts) == value:
+                mask |= _TS
+                del rest["timestamp"]
+        rid = b""
+        value = rest.get("request_id")
+        if isinstance(value, str) and len(value) == 32:
+            try:
+                rid = bytes.fromhex(value)
+            except ValueError:
+                rid = b""
+            if rid and rid.hex() == value:
+                mask |= _RID
+                del rest["request_id"]
+        status = 0
+        if "status" in rest and rest["status"] is None:
+            mask |= _STATUS_NULL
+            del rest["status"]
+        elif _is_int(rest.get("status"), -0x8000, 0x7FFF):
+            mask |= _STATUS
+            status = rest.pop("status")
+        score = 0
+        if _is_int(rest.get("score"), -0x80000000, 0x7FFFFFFF):
+            mask |= _SCORE
+            score = rest.pop("score")
+        duration = 0
+        if "response_time_ms" in rest and rest["response_time_ms"] is None:
+            mask |= _RT_NULL
+            del rest["response_time_ms"]
+        elif _is_int(rest.get("response_time_ms"), -0x80000000, 0x7FFFFFFF):
+            mask |= _RT
+            duration = rest.pop("response_time_ms")
+        rule_ids: List[int] = []
+        rules = rest.get("matched_rules")
+        if type(rules) is list and len(rules) <= _MAX_RULES and all(isinstance(r, str) for r in rules):
+            mask |= _RULES
+            del rest["matched_rules"]
+            for rule in rules:
+                index = self.ids.get(rule)
+                if index is None:
+                    index = self.ids[rule] = len(self.strings)
+                    self.strings.append(rule)
+                rule_ids.append(index)
+        severity = self._intern(rest, "severity")
+        action = self._intern(rest, "action")
+        source_ip = self._intern(rest, "source_ip")
+        method = self._intern(rest, "method")
+        user_agent = self._intern(rest, "user_agent")
+        payload = b"".join((
+            _RECORD.pack(mask, rid.ljust(16, b"\0"), method, user_agent, status, score, duration, len(rule_ids)),
+            struct.pack(f"<{len(rule_ids)}H", *rule_ids),
+            _dumps(rest) if rest else b"",
+        ))
+        # Colonnes mises à jour en dernier: un événement non sérialisable n'y laisse rien
+        self.records.append(_U32.pack(len(payload)) + payload)
+        self.ts.append(ts)
+        self.severity.append(severity)
+        self.action.append(action)
+        self.source_ip.append(source_ip)
+
+    def finish(self) -> bytes:
+        count = len(self.records)
+        encoded = [s.encode("utf-8", errors="surrogatepass") for s in self.strings]
+        offsets = [0, *accumulate(len(s) for s in encoded)]
+        body = b"".join((
+            _U32.pack(len(encoded)),
+            struct.pack(f"<{len(offsets)}I", *offsets),
+            *encoded,
+            struct.pack(f"<{count}q", *self.ts),
+            struct.pack(f"<{count}H", *self.severity),
+            struct.pack(f"<{count}H", *self.action),
+            struct.pack(f"<{count}H", *self.source_ip),
+            *self.records,
+        ))
+        header = _HEADER.pack(MAGIC, VERSION, count, _HEADER.size + len(body), min(self.ts), max(self.ts))
+        return header + body
+
+
+def encode_events(events: Iterable[Dict[str, Any]]) -> Tuple[bytes, int]:
+    """Événements -> blocs binaires, et nombre d'événements encodés
+    (un événement non sérialisable est ignoré, comme en JSONL).
+    """
+    blocks: List[bytes] = []
+    encoder = _BlockEncoder()
+    encoded = 0
+    for event in events:
+        if encoder.full():
+            blocks.append(encoder.finish())
+            encoder = _BlockEncoder()
+        try:
+            encoder.add(event)
+        except Exception:
+            continue
+        encoded += 1
+    if encoder.records:
+        blocks.append(encoder.finish())
+    return b"".join(blocks), encoded
+
+
+# --- lecture -----------------------------------------------------------------------
+
+
+class BlockHeader(NamedTuple):
+    offset: int
+    count: int
+    size: int
+    ts_min: int
+    ts_max: int
+
+
+def scan_headers(buf: Buffer, offset: int = 0) -> Tuple[List[BlockHeader], int]:
+    """En-têtes des blocs complets à partir de `offset` (sauts de bloc en bloc,
+    sans rien décoder) et position de fin du dernier bloc complet.
+    Un bloc en cours d'écriture arrête le parcours; des octets invalides
+    (écriture interrompue) sont sautés jusqu'au prochain en-tête.
+    """
+    headers: List[BlockHeader] = []
+    end = offset
+    length = len(buf)
+    while offset + _HEADER.size <= length:
+        magic, version, count, size, ts_min, ts_max = _HEADER.unpack_from(buf, offset)
+        stop = offset + size
+        if magic == MAGIC and version == VERSION and size >= _HEADER.size:
+            if stop > length:
+                break
+            if MAGIC.startswith(buf[stop:stop + len(MAGIC)]):
+                headers.append(BlockHeader(offset, count, size, ts_min, ts_max))
+                offset = end = stop
+                continue
+        following = buf.find(MAGIC, offset + 1)
+        if following < 0:
+            break
+        offset = end = following
+    return headers, end
+
+
+class Block:
+    """Index d'un bloc (table des chaînes et colonnes), enregistrements décodés à la demande."""
+
+    __slots__ = ("buf", "header", "strings", "ts", "severity", "action", "source_ip", "_data", "_positions")
+
+    def __init__(self, buf: Buffer, header: BlockHeader) -> None:
+        self.buf = buf
+        self.header = header
+        count = header.count
+        pos = header.offset + _HEADER.size
+        (n_strings,) = _U32.unpack_from(buf, pos)
+        pos += _U32.size
+        offsets = struct.unpack_from(f"<{n_strings + 1}I", buf, pos)
+        pos += 4 * (n_strings + 1)
+        blob = buf[pos:pos + offsets[-1]]
+        pos += offsets[-1]
+        self.strings = [blob[offsets[i]:offsets[i + 1]].decode("utf-8", errors="surrogatepass") for i in range(n_strings)]
+        self.ts = struct.unpack_from(f"<{count}q", buf, pos)
+        pos += 8 * count
+        self.severity = struct.unpack_from(f"<{count}H", buf, pos)
+        pos += 2 * count
+        self.action = struct.unpack_from(f"<{count}H", buf, pos)
+        pos += 2 * count
+        self.source_ip = struct.unpack_from(f"<{count}H", buf, pos)
+        self._data = pos + 2 * count
+        self._positions: Optional[List[int]] = None
+
+    def _string_ids(self, predicate: Any) -> Set[int]:
+        return {i for i, s in enumerate(self.strings) if predicate(s)}
+
+    @property
+    def positions(self) -> List[int]:
+        # Début de chaque enregistrement (seuls les préfixes de longueur sont lus)
+        if self._positions is None:
+            positions = []
+            pos = self._data
+            for _ in range(self.header.count):
+                positions.append(pos)
+                pos += _U32.size + _U32.unpack_from(self.buf, pos)[0]
+            self._positions = positions
+        return self._positions
+
+    def rule_ids(self, i: int) -> Tuple[int, ...]:
+        start = self.positions[i] + _U32.size
+        fields = _RECORD.unpack_from(self.buf, start)
+        if not fields[0] & _RULES:
+            return ()
+        n_rules = fields[7]
+        return struct.unpack_from(f"<{n_rules}H", self.buf, start + _RECORD.size)
+
+    def select(
+        self,
+        severity: str = "",
+        action: str = "",
+        rule: str = "",
+        source_ip: str = "",
+        since_us: Optional[int] = None,
+        until_us: Optional[int] = None,
+    ) -> List[int]:
+        """Indices des enregistrements retenus (mêmes règles que `LogStore`), sans les décoder."""
+        candidates: Iterable[int] = range(self.header.count)
+        for value, column, normalize in (
+            (severity, self.severity, str.lower),
+            (action, self.action, str.upper),
+            (source_ip, self.source_ip, str),
+        ):
+            if value:
+                ids = self._string_ids(lambda s: normalize(s) == value)
+                if not ids:
+                    return []
+                candidates = [i for i in candidates if column[i] in ids]
+        if since_us is not None:
+            candidates = [i for i in candidates if self.ts[i] >= since_us]
+        if until_us is not None:
+            candidates = [i for i in candidates if self.ts[i] <= until_us]
+        if rule:
+            ids = self._string_ids(lambda s: s == rule)
+            if not ids:
+                return []
+            candidates = [i for i in candidates if not ids.isdisjoint(self.rule_ids(i))]
+        return list(candidates)
+
+    def event(self, i: int) -> Dict[str, Any]:
+        buf = self.buf
+        strings = self.strings
+        start = self.positions[i] + _U32.size
+        (length,) = _U32.unpack_from(buf, start - _U32.size)
+        mask, rid, method, user_agent, status, score, duration, n_rules = _RECORD.unpack_from(buf, start)
+        pos = start + _RECORD.size
+        rules = struct.unpack_from(f"<{n_rules}H", buf, pos)
+        extra = buf[pos + 2 * n_rules:start + length]
+        event: Dict[str, Any] = {}
+        if mask & _TS:
+            event["timestamp"] = us_to_iso(self.ts[i])
+        if mask & _RID:
+            event["request_id"] = rid.hex()
+        if self.source_ip[i] != _ABSENT:
+            event["source_ip"] = strings[self.source_ip[i]]
+        if method != _ABSENT:
+            event["method"] = strings[method]
+        if extra:
+            event.update(_loads(extra))
+        if mask & _SCORE:
+            event["score"] = score
+        if self.severity[i] != _ABSENT:
+            event["severity"] = strings[self.severity[i]]
+        if mask & _RULES:
+            event["matched_rules"] = [strings[r] for r in rules]
+        if self.action[i] != _ABSENT:
+            event["action"] = strings[self.action[i]]
+        if mask & (_STATUS | _STATUS_NULL):
+            event["status"] = status if mask & _STATUS else None
+        if user_agent != _ABSENT:
+            event["user_agent"] = strings[user_agent]
+        if mask & (_RT | _RT_NULL):
+            event["response_time_ms"] = duration if mask & _RT else None
+        return event
+
+    def events(self, start: int = 0) -> List[Dict[str, Any]]:
+        return [self.event(i) for i in range(start, self.header.count)]
+
+
+def iter_events(buf: Buffer) -> Iterator[Dict[str, Any]]:
+    """Tous les événements des blocs complets de `buf`, dans l'ordre."""
+    headers, _ = scan_headers(buf)
+    for header in headers:
+        yield from Block(buf, header).events()
+
+
+def iter_stream(f: IO[bytes], chunk_size: int = 1024 * 1024) -> Iterator[Dict[str, Any]]:
+    """Événements d'un flux lu par morceaux (segment compressé, entrée standard)."""
+    pending = b""
+    while True:
+        data = f.read(chunk_size)
+        pending += data
+        headers, end = scan_headers(pending)
+        for header in headers:
+            yield from Block(pending, header).events()
+        pending = pending[end:]
+        if not data:
+            return
+
+
+@contextmanager
+def open_buffer(path: str) -> Iterator[Buffer]:
+    """Contenu d'un fichier de logs: projeté en mémoire (mmap) s'il est en clair,
+    décompressé en mémoire sinon.
+    """
+    f = open_segment(path)
+    try:
+        if not isinstance(f, io.BufferedReader):
+            yield f.read()
+        elif os.fstat(f.fileno()).st_size == 0:
+            yield b""
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                yield buf
+    finally:
+        f.close()
+
+
+def read_events(
+    path: str,
+    limit: int = 0,
+    severity: str = "",
+    action: str = "",
+    rule: str = "",
+    source_ip: str = "",
+    since: str = "",
+    until: str = "",
+) -> List[Dict[str, Any]]:
+    """Les `limit` derniers événements (0 = tous) des segments puis du fichier
+    courant correspondant aux filtres, dans l'ordre chronologique.
+    Les fichiers sont parcourus du plus récent au plus ancien; seuls les
+    enregistrements retenus sont décodés.
+    """
+    since_us = iso_to_us(since) if since else None
+    until_us = iso_to_us(until) if until else None
+    filters = {"severity": severity.lower(), "action": action.upper(), "rule": rule, "source_ip": source_ip}
+    out: List[Dict[str, Any]] = []
+    for file_path in reversed(iter_log_files(path)):
+        try:
+            with open_buffer(file_path) as buf:
+                if sniff(buf[:len(MAGIC)]) is not True:
+                    continue
+                headers, _ = scan_headers(buf)
+                for header in reversed(headers):
+                    if since_us is not None and header.ts_max < since_us:
+                        continue
+                    if until_us is not None and header.ts_min > until_us:
+                        continue
+                    block = Block(buf, header)
+                    for i in reversed(block.select(since_us=since_us, until_us=until_us, **filters)):
+                        out.append(block.event(i))
+                        if limit and len(out) >= limit:
+                            out.reverse()
+                            return out
+        except (OSError, ValueError, struct.error):
+            continue
+        # Les segments plus anciens ne contiennent que des événements antérieurs
+        if since_us is not None and headers and max(h.ts_max for h in headers) < since_us:
+            break
+    out.reverse()
+    return out
+
+
+# --- conversion --------------------------------------------------------------------
+
+
+def _json_line(event: Dict[str, Any]) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(event, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8", errors="replace")
+
+
+def to_jsonl(src: IO[bytes], dst: IO[bytes]) -> int:
+    written = 0
+    for event in iter_stream(src):
+        dst.write(_json_line(event))
+        written += 1
+    return written
+
+
+def from_jsonl(src: IO[bytes], dst: IO[bytes], block_size: int = 256) -> Tuple[int, int]:
+    """JSONL -> blocs de `block_size` événements; retourne (écrits, lignes ignorées)."""
+    written = skipped = 0
+    batch: List[Dict[str, Any]] = []
+
+    def _flush() -> None:
+        nonlocal written, skipped
+        data, encoded = encode_events(batch)
+        dst.write(data)
+        written += encoded
+        skipped += len(batch) - encoded
+        batch.clear()
+
+    for line in src:
+        if not line.strip():
+            continue
+        try:
+            event = orjson.loads(line) if orjson is not None else json.loads(line.decode("utf-8", errors="replace"))
+        except ValueError:
+            skipped += 1
+            continue
+        if not isinstance(event, dict):
+            skipped += 1
+            continue
+        batch.append(event)
+        if len(batch) >= block_size:
+            _flush()
+    if batch:
+        _flush()
+    return written, skipped
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="waf-binlog", description="Convertir le journal du WAF entre JSONL et binaire")
+    parser.add_argument("command", choices=("to-jsonl", "from-jsonl"))
+    parser.add_argument("input", help="fichier source (.gz/.bz2/.xz/.zst acceptés, - = stdin)")
+    parser.add_argument("-o", "--output", default="-", help="fichier destination (défaut: stdout)")
+    parser.add_argument("--block-size", type=int, default=256, help="événements par bloc (from-jsonl)")
+    args = parser.parse_args(argv)
+
+    try:
+        src: IO[bytes] = sys.stdin.buffer if args.input == "-" else open_segment(args.input)
+        dst: IO[bytes] = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    except OSError as exc:
+        print(f"ouverture impossible: {exc}", file=sys.stderr)
+        return 2
+    try:
+        if args.command == "to-jsonl":
+            written, skipped = to_jsonl(src, dst), 0
+        else:
+            written, skipped = from_jsonl(src, dst, max(1, min(args.block_size, _MAX_RECORDS)))
+    finally:
+        if src is not sys.stdin.buffer:
+            src.close()
+        if dst is not sys.stdout.buffer:
+            dst.close()
+    print(f"{written} événements convertis, {skipped} ignorés", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,121 @@
+"""Négociation `Accept-Encoding` et compression des réponses relayées.
+
+gzip et deflate viennent de zlib; br n'est proposé que si le module `brotli`
+est installé. Les compresseurs en flux n'émettent que des morceaux non vides et
+vident leur tampon après chaque morceau amont, pour que le client reçoive la page
+au fil de l'eau (sinon le codeur retient tout jusqu'à remplir son tampon interne).
+"""
+from __future__ import annotations
+
+import zlib
+from functools import lru_cache
+from typing import AsyncIterator, Callable, Dict, Iterator, Optional, Tuple
+
+try:
+    import brotli  # type: ignore
+except Exception:  # pragma: no cover - optional
+    brotli = None  # type: ignore
+
+# Codages produits par le WAF, par ordre de préférence à qualité égale
+SUPPORTED_CODINGS: Tuple[str, ...] = (("br",) if brotli is not None else ()) + ("gzip", "deflate")
+
+_ALIASES = {"x-gzip": "gzip"}
+
+
+@lru_cache(maxsize=256)
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """`Accept-Encoding` -> {codage: qualité} (codages en minuscules, q par défaut 1)."""
+    prefs: Dict[str, float] = {}
+    for item in header.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value.strip())
+                except ValueError:
+                    q = 0.0
+        prefs[_ALIASES.get(coding, coding)] = q
+    return prefs
+
+
+def accepts_encoding(accept_encoding: str, content_encoding: str) -> bool:
+    """Le client accepte-t-il un corps codé `content_encoding` (liste éventuelle) ?
+    Sans `Accept-Encoding`, seul le corps non codé est considéré acceptable.
+    """
+    prefs = parse_accept_encoding(accept_encoding)
+    for coding in content_encoding.split(","):
+        coding = _ALIASES.get(coding.strip().lower(), coding.strip().lower())
+        if coding in ("", "identity"):
+            continue
+        if prefs.get(coding, prefs.get("*", 0.0)) <= 0:
+            return False
+    return True
+
+
+@lru_cache(maxsize=256)
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Meilleur codage supporté accepté par le client (None: pas de compression)."""
+    prefs = parse_accept_encoding(accept_encoding)
+    best: Optional[str] = None
+    best_q = 0.0
+    for coding in SUPPORTED_CODINGS:
+        q = prefs.get(coding, prefs.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def _compressor(
+    coding: str, level: int
+) -> Tuple[Callable[[bytes], bytes], Callable[[], bytes], Callable[[], bytes]]:
+    """(compresser un morceau, vider le tampon, terminer le flux) pour `coding`."""
+    if coding == "br":
+        if brotli is None:
+            raise ValueError("br compression unavailable ('brotli' required)")
+        comp = brotli.Compressor(quality=max(0, min(level, 11)))
+        return comp.process, comp.flush, comp.finish
+    if coding == "gzip":
+        wbits = 16 + zlib.MAX_WBITS
+    elif coding == "deflate":
+        wbits = zlib.MAX_WBITS  # HTTP "deflate" = format zlib (RFC 1950)
+    else:
+        raise ValueError(f"unsupported content coding: {coding}")
+    obj = zlib.compressobj(max(1, min(level, 9)), zlib.DEFLATED, wbits)
+    # Z_SYNC_FLUSH: termine le bloc courant sur une frontière d'octet, décodable tel quel
+    return obj.compress, lambda: obj.flush(zlib.Z_SYNC_FLUSH), obj.flush
+
+
+def compress_body(body: bytes, coding: str, level: int) -> bytes:
+    compress, _, finish = _compressor(coding, level)
+    return compress(body) + finish()
+
+
+def compress_chunks(chunks: Iterator[bytes], coding: str, level: int) -> Iterator[bytes]:
+    compress, sync, finish = _compressor(coding, level)
+    for chunk in chunks:
+        if not chunk:
+            continue
+        out = compress(chunk) + sync()
+        if out:
+            yield out
+    tail = finish()
+    if tail:
+        yield tail
+
+
+async def acompress_chunks(chunks: AsyncIterator[bytes], coding: str, level: int) -> AsyncIterator[bytes]:
+    compress, sync, finish = _compressor(coding, level)
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        out = compress(chunk) + sync()
+        if out:
+            yield out
+    tail = finish()
+    if tail:
+        yield tail
@@ -32,10 +32,172 @@ class Settings:
     # Paths
     # Defaults to a path relative to the install/project directory, not the current working dir
     data_dir: str = os.getenv("WAF_DATA_DIR", str(_BASE_DIR / "data"))
-    logs_file: str = os.getenv("WAF_LOGS_FILE", os.path.join(data_dir, "logs.json"))
+    # Log format: "jsonl" (one JSON object per line) or "binary" (compact blocks
+    # with interned strings and a per-block index, see waf/binlog.py)
+    log_format: str = os.getenv("WAF_LOG_FORMAT", "jsonl").lower()
+    logs_file: str = os.getenv(
+        "WAF_LOGS_FILE", os.path.join(data_dir, "logs.bin" if log_format == "binary" else "logs.json")
+    )
+
+    # Log writer: "async" (background thread, batched writes) or "sync" (one
+    # open/append per event). Overflow policy when the queue is full:
+    # "block" (default, backpressure), "drop" or "sample" (keep 1 event out of
+    # log_sample_rate); dropped counts are written to the log as LOG_DROPPED
+    log_writer: str = os.getenv("WAF_LOG_WRITER", "async").lower()
+    log_queue_size: int = int(os.getenv("WAF_LOG_QUEUE_SIZE", "10000"))
+    log_batch_size: int = int(os.getenv("WAF_LOG_BATCH_SIZE", "256"))
+    log_flush_interval: float = float(os.getenv("WAF_LOG_FLUSH_INTERVAL", "0.5"))
+    log_overflow: str = os.getenv("WAF_LOG_OVERFLOW", "block").lower()
+    log_sample_rate: int = int(os.getenv("WAF_LOG_SAMPLE_RATE", "10"))
+
+    # Log rotation (0 disables a criterion, all off by default): size in bytes
+    # and/or interval in seconds; segments named "timestamp" or "numbered",
+    # compressed with gzip/bz2/xz/zstd (or "none"). Retention is opt-in:
+    # segments are only deleted past keep (count) and/or max age in days
+    log_rotate_bytes: int = int(os.getenv("WAF_LOG_ROTATE_BYTES", "0"))
+    log_rotate_interval: float = float(os.getenv("WAF_LOG_ROTATE_INTERVAL", "0"))
+    log_rotate_naming: str = os.getenv("WAF_LOG_ROTATE_NAMING", "timestamp").lower()
+    log_rotate_compress: str = os.getenv("WAF_LOG_ROTATE_COMPRESS", "gzip").lower()
+    log_rotate_keep: int = int(os.getenv("WAF_LOG_ROTATE_KEEP", "0"))
+    log_rotate_max_age_days: float = float(os.getenv("WAF_LOG_ROTATE_MAX_AGE_DAYS", "0"))
+
+    # Dashboard: events kept in the in-memory log index
+    dashboard_max_events: int = int(os.getenv("WAF_DASHBOARD_MAX_EVENTS", "100000"))
+
+    # In-memory metrics (/metrics, /metrics/summary): sliding window made of
+    # fixed-size buckets, and distinct source IPs tracked per bucket
+    metrics_enabled: bool = os.getenv("WAF_METRICS", "1") == "1"
+    metrics_window_seconds: int = int(os.getenv("WAF_METRICS_WINDOW_SECONDS", "600"))
+    metrics_bucket_seconds: int = int(os.getenv("WAF_METRICS_BUCKET_SECONDS", "10"))
+    metrics_max_ips: int = int(os.getenv("WAF_METRICS_MAX_IPS", "1000"))
+
+    # Client addresses (IPs/CIDRs, comma-separated) allowed to read the proxy's
+    # /metrics, /metrics/summary and detailed /healthz. Empty = nobody: those
+    # metrics paths are relayed to the backend and /healthz stays minimal
+    admin_allow: str = os.getenv("WAF_ADMIN_ALLOW", "")
+
+    # Per-stage timings: also sent back in a Server-Timing header if enabled.
+    # 1 request out of profile_sample_rate (0 = never) gets a detailed analysis
+    # profile: "rules" (time of each regex) or "cprofile"
+    server_timing: bool = os.getenv("WAF_SERVER_TIMING", "0") == "1"
+    profile_sample_rate: int = int(os.getenv("WAF_PROFILE_SAMPLE_RATE", "0"))
+    profile_mode: str = os.getenv("WAF_PROFILE_MODE", "rules").lower()
+
+    # Verdict cache (LRU + TTL) keyed by a hash of the analysis text;
+    # 0 entries disables it, longer texts bypass it
+    verdict_cache_size: int = int(os.getenv("WAF_VERDICT_CACHE_SIZE", "10000"))
+    verdict_cache_ttl: float = float(os.getenv("WAF_VERDICT_CACHE_TTL", "300"))
+    verdict_cache_max_text: int = int(os.getenv("WAF_VERDICT_CACHE_MAX_TEXT", "16384"))
+
+    # ReDoS guard: time budget for a request's rule evaluation (0 = none),
+    # estimated backtracking steps allowed for risky rules (see waf/redos.py),
+    # and verdict once the time budget is exhausted: "open" (default: rules
+    # matched so far plus the analysis_timeout flag) or "closed" (score raised
+    # to threshold_block). Exceeding the step budget always fails closed.
+    analysis_budget_ms: float = float(os.getenv("WAF_ANALYSIS_BUDGET_MS", "500"))
+    regex_step_budget: int = int(os.getenv("WAF_REGEX_STEP_BUDGET", "1000000"))
+    analysis_timeout_verdict: str = os.getenv("WAF_ANALYSIS_TIMEOUT_VERDICT", "open").lower()
+
+    # Per-source-IP tracking (checked before any inspection): token bucket
+    # (requests/s, 0 = no rate limit, and burst) and cumulative anomaly score
+    # decaying with a half-life in seconds; in IPS mode an IP over its rate gets
+    # a 429 and one whose cumulative score reaches threshold_block a 403.
+    # Bounded LRU table, per process ("memory") or shared by workers ("sqlite")
+    ip_tracker: bool = os.getenv("WAF_IP_TRACKER", "0") == "1"
+    ip_rate_limit: float = float(os.getenv("WAF_IP_RATE_LIMIT", "0"))
+    ip_rate_burst: int = int(os.getenv("WAF_IP_RATE_BURST", "20"))
+    ip_score_half_life: float = float(os.getenv("WAF_IP_SCORE_HALF_LIFE", "300"))
+    ip_tracker_max: int = int(os.getenv("WAF_IP_TRACKER_MAX", "100000"))
+    ip_tracker_backend: str = os.getenv("WAF_IP_TRACKER_BACKEND", "memory").lower()
+    ip_tracker_path: str = os.getenv("WAF_IP_TRACKER_PATH", os.path.join(data_dir, "ip_tracker.sqlite3"))
+
+    # Client deny/allow lists checked before anything else (JSON file with
+    # exact IPs, CIDR ranges and User-Agent substrings, reloaded like the rule
+    # pack). Denied clients get a bare 403; one rejection in deny_log_sample is
+    # logged (0 = none). auto_deny_after BLOCK verdicts from one IP within
+    # auto_deny_window seconds deny it for auto_deny_ttl seconds (0 = off)
+    access_lists_file: str = os.getenv("WAF_ACCESS_LISTS_FILE", "")
+    deny_log_sample: int = int(os.getenv("WAF_DENY_LOG_SAMPLE", "100"))
+    auto_deny_after: int = int(os.getenv("WAF_AUTO_DENY_AFTER", "0"))
+    auto_deny_window: float = float(os.getenv("WAF_AUTO_DENY_WINDOW", "60"))
+    auto_deny_ttl: float = float(os.getenv("WAF_AUTO_DENY_TTL", "3600"))
+    auto_deny_max: int = int(os.getenv("WAF_AUTO_DENY_MAX", "10000"))
 
     # Feature toggles
     allow_query_mode_switch: bool = os.getenv("WAF_ALLOW_QUERY_MODE_SWITCH", "1") == "1"
 
+    # Proxy engine: "wsgi" (Flask, one thread per request) or "asgi" (asyncio + httpx.AsyncClient)
+    engine: str = os.getenv("WAF_ENGINE", "wsgi").lower()
+
+    # Prefork runner: number of worker processes sharing the listening socket
+    # (1 = single process), requests before a worker is recycled (0 = never),
+    # and seconds granted to in-flight requests on reload/stop
+    workers: int = int(os.getenv("WAF_WORKERS", "1"))
+    max_requests: int = int(os.getenv("WAF_MAX_REQUESTS", "0"))
+    graceful_timeout: float = float(os.getenv("WAF_GRACEFUL_TIMEOUT", "30"))
+
+    # Rule engine: "legacy" (all regexes), "compiled" (literal prefilter) or
+    # "verify" (both, compare and keep the legacy result)
+    rule_engine: str = os.getenv("WAF_RULE_ENGINE", "legacy").lower()
+
+    # External rule pack (JSON/TOML/YAML, see waf/rulepack.py) replacing the
+    # built-in rules; reloaded when the file changes (checked every
+    # rules_reload_interval seconds, 0 = only on SIGHUP)
+    rules_file: str = os.getenv("WAF_RULES_FILE", "")
+    rules_reload_interval: float = float(os.getenv("WAF_RULES_RELOAD_INTERVAL", "2"))
+
+    # Inspection granularity: "blob" (path, query, body and headers joined and
+    # scanned by every rule) or "fields" (each rule only scans the request
+    # fields it targets, see rules.RULE_FIELDS)
+    inspection_mode: str = os.getenv("WAF_INSPECTION_MODE", "blob").lower()
+
+    # Body inspection: "buffer" (whole body read then scanned) or "stream"
+    # (chunks scanned on a sliding window and forwarded as they arrive)
+    body_inspection: str = os.getenv("WAF_BODY_INSPECTION", "buffer").lower()
+    body_inspect_max_bytes: int = int(os.getenv("WAF_BODY_INSPECT_MAX_BYTES", str(1024 * 1024)))
+    body_chunk_size: int = int(os.getenv("WAF_BODY_CHUNK_SIZE", str(64 * 1024)))
+    # Characters of the previous chunk re-scanned with the next one
+    body_inspect_overlap: int = int(os.getenv("WAF_BODY_INSPECT_OVERLAP", "1024"))
+
+    # Upstream connection pool (shared keep-alive client towards the backend)
+    upstream_max_connections: int = int(os.getenv("WAF_UPSTREAM_MAX_CONNECTIONS", "100"))
+    upstream_max_keepalive: int = int(os.getenv("WAF_UPSTREAM_MAX_KEEPALIVE", "20"))
+    upstream_keepalive_expiry: float = float(os.getenv("WAF_UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+    # 0 = no per-host limit (only upstream_max_connections applies)
+    upstream_max_per_host: int = int(os.getenv("WAF_UPSTREAM_MAX_PER_HOST", "0"))
+    upstream_connect_timeout: float = float(os.getenv("WAF_UPSTREAM_CONNECT_TIMEOUT", "5"))
+    upstream_read_timeout: float = float(os.getenv("WAF_UPSTREAM_READ_TIMEOUT", "15"))
+
+    # Upstream responses: streamed to the client in chunks of response_chunk_size
+    # bytes (HTML/CSS rewritten on the fly); bodies with a known length up to one
+    # chunk, or all of them when streaming is off, are read in one go
+    response_streaming: bool = os.getenv("WAF_RESPONSE_STREAMING", "1") == "1"
+    response_chunk_size: int = int(os.getenv("WAF_RESPONSE_CHUNK_SIZE", str(64 * 1024)))
+
+    # Response compression: compressed upstream bodies that need no rewriting
+    # are relayed as is (streamed, upstream Content-Encoding/Content-Length)
+    # when the client accepts their coding; rewritten HTML/CSS bodies of at
+    # least response_compression_min_size bytes are compressed again with the
+    # best coding the client accepts (gzip, deflate, br if 'brotli' is installed)
+    response_compression: bool = os.getenv("WAF_RESPONSE_COMPRESSION", "1") == "1"
+    response_compression_level: int = int(os.getenv("WAF_RESPONSE_COMPRESSION_LEVEL", "6"))
+    response_compression_min_size: int = int(os.getenv("WAF_RESPONSE_COMPRESSION_MIN_SIZE", "1024"))
+
+    # Upstream response microcache for GET (per process, see waf/response_cache.py):
+    # honours Cache-Control/Expires/Vary, never stores Set-Cookie responses,
+    # freshness capped at response_cache_max_ttl seconds. Stale entries are still
+    # served for response_cache_stale seconds (or stale-while-revalidate) while
+    # one background request revalidates them. Bodies up to
+    # response_cache_max_entry bytes, response_cache_max_bytes in memory; with a
+    # response_cache_dir, entries evicted from memory spill to memory-mapped
+    # files (response_cache_max_disk_bytes in total)
+    response_cache: bool = os.getenv("WAF_RESPONSE_CACHE", "0") == "1"
+    response_cache_max_bytes: int = int(os.getenv("WAF_RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    response_cache_max_entry: int = int(os.getenv("WAF_RESPONSE_CACHE_MAX_ENTRY", str(1024 * 1024)))
+    response_cache_max_ttl: float = float(os.getenv("WAF_RESPONSE_CACHE_MAX_TTL", "600"))
+    response_cache_stale: float = float(os.getenv("WAF_RESPONSE_CACHE_STALE", "30"))
+    response_cache_dir: str = os.getenv("WAF_RESPONSE_CACHE_DIR", "")
+    response_cache_max_disk_bytes: int = int(os.getenv("WAF_RESPONSE_CACHE_MAX_DISK_BYTES", str(512 * 1024 * 1024)))
+
 
 settings = Settings()
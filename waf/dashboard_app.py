@@ -2,28 +2,58 @@ from __future__ import annotations
 
 import json
 import os
-from typing import Any, Dict, List
+import time
+from typing import Any, Dict, Iterator, List
 
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, jsonify, render_template, request, stream_with_context
 
+from .binlog import read_events
 from .config import settings
+from .logstore import LogStore, active_filters, event_matches
+from .metrics import PROMETHEUS_CONTENT_TYPE, new_metrics
+from .rotation import iter_lines, remove_segments
 
+# Flux SSE: délai de reconnexion suggéré au navigateur (ms) et intervalle des keep-alive (s)
+SSE_RETRY_MS = 3000
+SSE_PING_INTERVAL = 15.0
 
-def read_logs(limit: int | None = None) -> List[Dict[str, Any]]:
+
+def read_logs(
+    limit: int | None = None,
+    severity: str = "",
+    action: str = "",
+    rule: str = "",
+    source_ip: str = "",
+    since: str = "",
+    until: str = "",
+) -> List[Dict[str, Any]]:
     path = settings.logs_file
-    if not os.path.exists(path):
-        return []
+    if settings.log_format == "binary":
+        # Fichiers projetés en mémoire: blocs sautés d'après leur index, seuls
+        # les enregistrements retenus sont décodés
+        return read_events(
+            path, limit or 0, severity=severity, action=action, rule=rule, source_ip=source_ip, since=since, until=until
+        )
+    active = active_filters(severity, action, rule, source_ip)
     entries: List[Dict[str, Any]] = []
+    # Segments (rotation) puis fichier courant, dans l'ordre chronologique.
     # Tolérance maximale aux caractères invalides pour ne jamais planter l'API/dashboard
-    with open(path, "r", encoding="utf-8", errors="replace") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                entries.append(json.loads(line))
-            except Exception:
-                continue
+    for line in iter_lines(path):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            event = json.loads(line)
+        except Exception:
+            continue
+        if not isinstance(event, dict):
+            continue
+        ts = str(event.get("timestamp", ""))
+        if (since and ts < since) or (until and ts > until):
+            continue
+        if active and not event_matches(event, active):
+            continue
+        entries.append(event)
     if limit:
         return entries[-limit:]
     return entries
@@ -31,6 +61,14 @@ def read_logs(limit: int | None = None) -> List[Dict[str, Any]]:
 
 def create_dashboard_app() -> Flask:
     app = Flask(__name__, template_folder="templates", static_folder="static")
+    # Index incrémental des logs: chaque appel API ne lit que les nouvelles lignes
+    # Métriques recalculées à partir des logs: agrègent tous les workers du proxy
+    metrics = new_metrics()
+    store = LogStore(
+        settings.logs_file,
+        max_events=settings.dashboard_max_events,
+        on_event=lambda event: metrics.record(event, use_event_time=True),
+    )
 
     @app.route("/")
     def root():
@@ -40,23 +78,98 @@ def create_dashboard_app() -> Flask:
     def dashboard():
         return render_template("dashboard.html")
 
+    def _filters() -> Dict[str, str]:
+        return {
+            "severity": (request.args.get("severity") or "").lower().strip(),
+            "action": (request.args.get("action") or "").upper().strip(),
+            "rule": (request.args.get("rule") or "").strip(),
+            "source_ip": (request.args.get("source_ip") or "").strip(),
+        }
+
     @app.get("/api/logs")
     def api_logs():
         limit = request.args.get("limit", type=int) or 200
-        severity = (request.args.get("severity") or "").lower().strip()
-        rule = (request.args.get("rule") or "").strip()
-        action = (request.args.get("action") or "").upper().strip()
-
-        data = read_logs(limit=None)
-        if severity:
-            data = [e for e in data if (str(e.get("severity", "")).lower() == severity)]
-        if rule:
-            data = [e for e in data if rule in (e.get("matched_rules") or [])]
-        if action:
-            data = [e for e in data if str(e.get("action", "")).upper() == action]
-        if limit:
-            data = data[-limit:]
-        return jsonify({"items": data, "count": len(data)})
+        cursor = request.args.get("since", type=int)
+        filters = _filters()
+
+        if cursor is not None:
+            # Delta: uniquement les événements arrivés depuis `cursor`
+            data, next_cursor = store.since_cursor(cursor, limit=limit, **filters)
+            if cursor > next_cursor:
+                # Curseur inconnu (dashboard redémarré): le client doit tout recharger
+                data, next_cursor = store.query(limit=limit, **filters)
+                return jsonify({"items": data, "count": len(data), "next_cursor": next_cursor, "reset": True})
+            return jsonify({"items": data, "count": len(data), "next_cursor": next_cursor})
+
+        since = (request.args.get("since_ts") or "").strip()
+        until = (request.args.get("until_ts") or "").strip()
+        if (since or until) and settings.log_format == "binary":
+            # Plage de temps: lecture directe des fichiers (tout l'historique,
+            # au-delà des événements gardés en mémoire)
+            store.refresh()
+            data = read_logs(limit, since=since, until=until, **filters)
+            return jsonify({"items": data, "count": len(data), "next_cursor": store.next_seq})
+        data, next_cursor = store.query(limit=limit, since=since, until=until, **filters)
+        return jsonify({"items": data, "count": len(data), "next_cursor": next_cursor})
+
+    @app.get("/api/logs/stream")
+    def api_logs_stream():
+        """Flux Server-Sent Events des nouveaux événements (mêmes filtres que /api/logs).
+        Le curseur de départ vient de l'en-tête `Last-Event-ID` (reconnexion), sinon de `since`.
+        """
+        limit = request.args.get("limit", type=int) or 200
+        filters = _filters()
+        # Reconnexion automatique: le navigateur réutilise la même URL (donc le
+        # `since` d'origine), seul Last-Event-ID reflète ce qu'il a déjà reçu
+        last_id = request.headers.get("Last-Event-ID", "")
+        cursor = int(last_id) if last_id.isdigit() else request.args.get("since", type=int)
+        if cursor is None:
+            store.refresh()
+            cursor = store.next_seq
+
+        def _frame(items: List[Dict[str, Any]], next_cursor: int, reset: bool = False) -> str:
+            payload: Dict[str, Any] = {"items": items, "next_cursor": next_cursor}
+            if reset:
+                payload["reset"] = True
+            return f"id: {next_cursor}\nevent: logs\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+        def generate() -> Iterator[str]:
+            position = cursor
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            last_sent = time.monotonic()
+            while True:
+                items, next_cursor = store.since_cursor(position, limit=limit, **filters)
+                if position > next_cursor:
+                    # Logs effacés ou dashboard redémarré: renvoyer un état complet
+                    items, next_cursor = store.query(limit=limit, **filters)
+                    yield _frame(items, next_cursor, reset=True)
+                    last_sent = time.monotonic()
+                elif items:
+                    yield _frame(items, next_cursor)
+                    last_sent = time.monotonic()
+                position = next_cursor
+                if not store.wait_for(position, timeout=SSE_PING_INTERVAL) and (
+                    time.monotonic() - last_sent >= SSE_PING_INTERVAL
+                ):
+                    # Commentaire SSE: garde la connexion ouverte (proxies, LB)
+                    yield ": ping\n\n"
+                    last_sent = time.monotonic()
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @app.get("/metrics")
+    def prometheus_metrics():
+        store.refresh()
+        return Response(metrics.prometheus(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+    @app.get("/api/metrics")
+    def api_metrics():
+        store.refresh()
+        return jsonify(metrics.summary(top=request.args.get("top", type=int) or 10))
 
     @app.post("/api/logs/clear")
     def api_logs_clear():
@@ -64,6 +177,8 @@ def create_dashboard_app() -> Flask:
         os.makedirs(os.path.dirname(path), exist_ok=True)
         with open(path, "w", encoding="utf-8"):
             pass
+        remove_segments(path)
+        store.reset()
         return jsonify({"status": "ok"})
 
     return app
@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import re
+import threading
+import urllib.parse
+from time import perf_counter
+from typing import Dict, FrozenSet, List, Mapping, Optional, Sequence, Tuple
+
+from .redos import apply_timeout, current_budget
+from .rules import normalize_payload
+from .ruleset import active_rule_pack, rules_generation
+from .timing import current_timer
+
+Field = Tuple[str, str, str]  # (type, nom, valeur brute)
+AnchorGroups = Tuple[Tuple[str, ...], ...]
+PlanEntry = Tuple[str, re.Pattern, int, AnchorGroups]
+
+_POSITIONAL = re.compile(r"\^|\$|\\A|\\Z")
+
+FORM_CONTENT_TYPE = "application/x-www-form-urlencoded"
+
+
+def _split_pairs(raw: str, sep: str) -> List[Tuple[str, str]]:
+    """Découper `a=1&b=2` une seule fois: nom décodé, valeur laissée brute
+    (décodée ensuite par `normalize_payload`, comme dans le mode blob).
+    """
+    pairs = []
+    for part in raw.split(sep):
+        part = part.strip() if sep == ";" else part
+        if not part:
+            continue
+        name, _, value = part.partition("=")
+        try:
+            name = urllib.parse.unquote_plus(name)
+        except Exception:
+            pass
+        pairs.append((name, value))
+    return pairs
+
+
+class RequestFields:
+    """Champs d'une requête (chemin, arguments, formulaire, corps, en-têtes,
+    cookies), découpés une seule fois et réutilisés par toutes les règles.
+    """
+
+    __slots__ = ("fields", "_raw")
+
+    def __init__(
+        self,
+        path: str,
+        query: str,
+        body_text: str,
+        user_agent: str,
+        referer: str,
+        cookie: str,
+        content_type: str = "",
+    ) -> None:
+        fields: List[Field] = [("path", "", path)]
+        fields += [("args", name, value) for name, value in _split_pairs(query, "&")]
+        if body_text:
+            if content_type.split(";", 1)[0].strip().lower() == FORM_CONTENT_TYPE:
+                fields += [("form", name, value) for name, value in _split_pairs(body_text, "&")]
+            else:
+                fields.append(("body", "", body_text))
+        fields.append(("headers", "user-agent", user_agent))
+        fields.append(("headers", "referer", referer))
+        fields += [("cookies", name, value) for name, value in _split_pairs(cookie, ";")]
+        self.fields = fields
+        # Texte brut complet: clé du cache de verdicts
+        self._raw = "\n".join([path, query, content_type, body_text, user_agent, referer, cookie])
+
+    def fingerprint(self) -> str:
+        return self._raw
+
+
+def field_label(kind: str, name: str) -> str:
+    return f"{kind}:{name}" if name else kind
+
+
+class FieldRuleSet:
+    """Règles associées aux champs qu'elles inspectent (`rules.RULE_FIELDS`).
+
+    Pour chaque champ, seules les règles qui le ciblent sont exécutées, sur sa
+    valeur normalisée. Le plan (liste de règles) est mémorisé par type de champ
+    et par nom explicitement cité dans un sélecteur, sa taille reste bornée.
+    Une règle ne matche que si elle matche la valeur d'un champ seul.
+    """
+
+    def __init__(
+        self,
+        patterns: Sequence[Tuple[str, re.Pattern, int]],
+        fields: Mapping[str, Tuple[str, ...]],
+        field_patterns: Mapping[str, re.Pattern],
+        anchors: Mapping[str, AnchorGroups],
+    ) -> None:
+        self._rules: List[Tuple[str, re.Pattern, int, Optional[FrozenSet[str]], AnchorGroups]] = []
+        self._named: Dict[str, set] = {}
+        for name, pattern, score in patterns:
+            selectors = frozenset(fields[name]) if name in fields else None
+            for sel in selectors or ():
+                kind, _, field_name = sel.partition(":")
+                if field_name:
+                    self._named.setdefault(kind, set()).add(field_name)
+            groups = tuple(tuple(g) for g in anchors.get(name, ()))
+            if name in field_patterns:
+                # Le motif de champ n'a plus le préfixe "id=": ancres correspondantes retirées
+                groups = tuple(g for g in groups if not any("=" in lit for lit in g))
+            self._rules.append((name, field_patterns.get(name, pattern), score, selectors, groups))
+        self._plans: Dict[Tuple[str, str], Tuple[PlanEntry, ...]] = {}
+        self._lock = threading.Lock()
+        self._positional = frozenset(p for _, p, _, _, _ in self._rules if _POSITIONAL.search(p.pattern))
+        # Morceaux d'un corps relayé en flux: règles ciblant le corps ou le
+        # formulaire sans nom de champ (un morceau ne se découpe pas en champs)
+        self._stream_plan: Tuple[PlanEntry, ...] = tuple(
+            (rule, pattern, score, groups)
+            for rule, pattern, score, selectors, groups in self._rules
+            if selectors is None or "body" in selectors or "form" in selectors
+        )
+
+    def plan(self, kind: str, name: str) -> Tuple[PlanEntry, ...]:
+        """Règles applicables au champ (kind, name)."""
+        key = (kind, name if name in self._named.get(kind, ()) else "")
+        plan = self._plans.get(key)
+        if plan is None:
+            label = field_label(*key)
+            plan = tuple(
+                (rule, pattern, score, groups)
+                for rule, pattern, score, selectors, groups in self._rules
+                if selectors is None or kind in selectors or label in selectors
+            )
+            with self._lock:
+                self._plans[key] = plan
+        return plan
+
+    def scan(
+        self, fields: Sequence[Field]
+    ) -> Tuple[List[Tuple[str, int]], Dict[str, bool], Dict[str, str]]:
+        """Retourne (matches, flags, champ ayant déclenché chaque règle)."""
+        return self._scan([(kind, name, raw, self.plan(kind, name)) for kind, name, raw in fields])
+
+    def scan_stream_chunk(self, text: str) -> Tuple[List[Tuple[str, int]], Dict[str, bool], Dict[str, str]]:
+        return self._scan([("body", "", text, self._stream_plan)])
+
+    def _scan(
+        self, work: Sequence[Tuple[str, str, str, Tuple[PlanEntry, ...]]]
+    ) -> Tuple[List[Tuple[str, int]], Dict[str, bool], Dict[str, str]]:
+        timer = current_timer()
+        budget = current_budget()
+        flags = {"double_decoded": False, "had_encoding": False}
+        found: Dict[str, str] = {}
+        # Les champs partageant le même plan (ex. tous les cookies) sont
+        # normalisés et analysés ensemble: une passe par plan et non par champ.
+        groups: Dict[int, Tuple[Tuple[PlanEntry, ...], List[Tuple[str, str, str]]]] = {}
+        for kind, name, raw, plan in work:
+            if raw and plan:
+                groups.setdefault(id(plan), (plan, []))[1].append((kind, name, raw))
+        normalize_s = match_s = 0.0
+        for plan, members in groups.values():
+            t0 = perf_counter()
+            # "\n" devient une espace à la normalisation, comme le séparateur du mode blob;
+            # l'espace finale donne la même frontière au dernier champ
+            normalized, group_flags = normalize_payload("\n".join(raw for _, _, raw in members))
+            text = normalized + " "
+            t1 = perf_counter()
+            for k, v in group_flags.items():
+                flags[k] = flags.get(k, False) or v
+            single: Optional[List[str]] = None
+            for rule, pattern, _, anchor_groups in plan:
+                if rule in found:
+                    continue
+                # Pré-filtre par littéraux (cf. rules.RULE_ANCHORS) avant la regex
+                if anchor_groups and not all(any(lit in text for lit in g) for g in anchor_groups):
+                    continue
+                if not budget.allow(pattern, text):
+                    continue
+                if len(members) == 1:
+                    if pattern.search(text):
+                        found[rule] = field_label(members[0][0], members[0][1])
+                    continue
+                # Un motif ancré (^, $) ne se vérifie que champ par champ
+                if pattern not in self._positional and not pattern.search(text):
+                    continue
+                # Attribution (et confirmation: un match à cheval sur deux champs est ignoré)
+                if single is None:
+                    single = [normalize_payload(raw)[0] + " " for _, _, raw in members]
+                for (kind, name, _), field_text in zip(members, single):
+                    if not budget.allow(pattern, field_text):
+                        continue
+                    if pattern.search(field_text):
+                        found[rule] = field_label(kind, name)
+                        break
+            normalize_s += t1 - t0
+            match_s += perf_counter() - t1
+        if timer is not None:
+            timer.add("normalize", normalize_s)
+            timer.add("match", match_s)
+        # Même ordre que rules.match_rules
+        matches = [(rule, score) for rule, _, score, _, _ in self._rules if rule in found]
+        apply_timeout(budget, matches, flags)
+        return matches, flags, found
+
+
+_field_ruleset: Optional[FieldRuleSet] = None
+_field_generation = -1
+_field_lock = threading.Lock()
+
+
+def get_field_ruleset() -> FieldRuleSet:
+    """Jeu de règles par champ, reconstruit après un changement de règles."""
+    global _field_ruleset, _field_generation
+    generation = rules_generation()
+    if _field_ruleset is None or _field_generation != generation:
+        with _field_lock:
+            if _field_ruleset is None or _field_generation != generation:
+                pack = active_rule_pack()
+                _field_ruleset = FieldRuleSet(pack.patterns, pack.fields, pack.field_patterns, pack.anchors)
+                _field_generation = generation
+    return _field_ruleset
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import codecs
+from typing import IO, Dict, Iterator, List, Optional, Tuple, Union
+
+from .fields import RequestFields, get_field_ruleset
+from .scoring import analyze_text, score_from_matches
+
+
+class BodyBlocked(Exception):
+    """Levée pendant l'envoi du corps quand le score dépasse le seuil de blocage (IPS)."""
+
+
+class StreamingInspector:
+    """Inspection du corps par morceaux, à mémoire bornée.
+
+    Le texte "en-têtes" (chemin, query, User-Agent, Referer, Cookie) est analysé
+    à la création. Le corps est ensuite analysé morceau par morceau sur une
+    fenêtre glissante: les `overlap` derniers caractères du morceau précédent
+    sont ré-analysés avec le suivant pour qu'une signature à cheval sur deux
+    morceaux soit trouvée. Au-delà de `max_bytes`, le reste du corps est relayé
+    sans analyse et le flag `body_partially_inspected` est positionné.
+    Si `head` est un `RequestFields` (mode "fields"), les en-têtes sont
+    analysés champ par champ et les morceaux du corps comme champ "body";
+    `matched_fields` indique alors le champ ayant déclenché chaque règle.
+    """
+
+    def __init__(
+        self,
+        head: Union[str, RequestFields],
+        max_bytes: int,
+        overlap: int,
+        block_threshold: Optional[int] = None,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.overlap = overlap
+        self.block_threshold = block_threshold
+        self.inspected_bytes = 0
+        self.partial = False
+        self.blocked = False
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._tail = ""
+        self._matches: Dict[str, int] = {}
+        self._flags: Dict[str, bool] = {"double_decoded": False, "had_encoding": False}
+        self.fields_mode = isinstance(head, RequestFields)
+        self.matched_fields: Dict[str, str] = {}
+        if isinstance(head, RequestFields):
+            self._merge(*get_field_ruleset().scan(head.fields))
+        else:
+            self._scan(head)
+
+    def _merge(
+        self, matches: List[Tuple[str, int]], flags: Dict[str, bool], fields: Optional[Dict[str, str]] = None
+    ) -> None:
+        for k, v in flags.items():
+            self._flags[k] = self._flags.get(k, False) or v
+        for name, score in matches:
+            self._matches.setdefault(name, score)
+        for name, field in (fields or {}).items():
+            self.matched_fields.setdefault(name, field)
+
+    def _scan(self, text: str) -> None:
+        if self.fields_mode:
+            self._merge(*get_field_ruleset().scan_stream_chunk(text))
+        else:
+            self._merge(*analyze_text(text))
+
+    def verdict(self) -> Tuple[int, List[str], Dict[str, bool]]:
+        """Retourne (score, matched_rule_names, flags), comme `compute_score`."""
+        matches = list(self._matches.items())
+        flags = dict(self._flags)
+        if self.partial:
+            flags["body_partially_inspected"] = True
+        return score_from_matches(matches, flags), [name for name, _ in matches], flags
+
+    def feed(self, chunk: bytes) -> None:
+        """Analyser un morceau du corps (ignoré une fois `max_bytes` atteint)."""
+        if not chunk or self.partial:
+            return
+        budget = self.max_bytes - self.inspected_bytes
+        if len(chunk) > budget:
+            chunk = chunk[:max(budget, 0)]
+            self.partial = True
+        self.inspected_bytes += len(chunk)
+        text = self._decoder.decode(chunk, final=self.partial)
+        if text:
+            self._scan(self._tail + text)
+            self._tail = (self._tail + text)[-self.overlap:] if self.overlap > 0 else ""
+        self._check_threshold()
+
+    def _check_threshold(self) -> None:
+        if self.block_threshold is not None and self.verdict()[0] >= self.block_threshold:
+            self.blocked = True
+            raise BodyBlocked()
+
+    def finish(self) -> None:
+        """Fin du corps: analyser ce que le décodeur retenait encore (seuil vérifié
+        comme pour `feed`).
+        """
+        tail = self._decoder.decode(b"", final=True)
+        if tail and not self.partial:
+            self._scan(self._tail + tail)
+            self._check_threshold()
+
+    def iter_body(self, stream: IO[bytes], chunk_size: int) -> Iterator[bytes]:
+        """Lire `stream` par morceaux, les analyser puis les relayer vers l'amont."""
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            self.feed(chunk)
+            yield chunk
+        self.finish()
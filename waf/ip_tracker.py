@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ClientVerdict(NamedTuple):
+    """État d'une IP au début d'une requête.
+
+    limited: plus de jeton disponible (limite de débit atteinte);
+    score: score cumulé (décroissant) des requêtes précédentes;
+    retry_after: secondes avant le prochain jeton.
+    """
+
+    limited: bool
+    score: float
+    retry_after: float
+
+    def over_threshold(self, threshold: float) -> bool:
+        return self.score >= threshold
+
+
+def _refill(tokens: float, refreshed: float, now: float, rate: float, burst: float) -> float:
+    if rate <= 0:
+        return burst
+    return min(burst, tokens + max(0.0, now - refreshed) * rate)
+
+
+def _decay(score: float, scored: float, now: float, half_life: float) -> float:
+    if half_life <= 0:
+        return score
+    if score <= 0:
+        return 0.0
+    return score * 0.5 ** (max(0.0, now - scored) / half_life)
+
+
+class _Limits(NamedTuple):
+    rate: float
+    burst: float
+    half_life: float
+
+
+def _consume(limits: _Limits, tokens: float) -> Tuple[float, bool, float]:
+    """Prendre un jeton: (jetons restants, limité ?, attente avant le prochain)."""
+    if limits.rate <= 0:
+        return tokens, False, 0.0
+    if tokens >= 1.0:
+        return tokens - 1.0, False, 0.0
+    return tokens, True, (1.0 - tokens) / limits.rate
+
+
+class MemoryBackend:
+    """Table LRU bornée, propre au processus: ip -> [jetons, t_jetons, score, t_score]."""
+
+    name = "memory"
+
+    def __init__(self, limits: _Limits, max_entries: int) -> None:
+        self.limits = limits
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._clients: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.evictions = 0
+
+    def _entry(self, ip: str, now: float) -> List[float]:
+        entry = self._clients.get(ip)
+        if entry is None:
+            entry = [self.limits.burst, now, 0.0, now]
+            self._clients[ip] = entry
+            while len(self._clients) > self.max_entries:
+                self._clients.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._clients.move_to_end(ip)
+        return entry
+
+    def hit(self, ip: str, now: float) -> ClientVerdict:
+        with self._lock:
+            entry = self._entry(ip, now)
+            tokens = _refill(entry[0], entry[1], now, self.limits.rate, self.limits.burst)
+            entry[0], limited, retry = _consume(self.limits, tokens)
+            entry[1] = now
+            entry[2] = _decay(entry[2], entry[3], now, self.limits.half_life)
+            entry[3] = now
+            return ClientVerdict(limited, entry[2], retry)
+
+    def add_score(self, ip: str, score: float, now: float) -> float:
+        with self._lock:
+            entry = self._entry(ip, now)
+            entry[2] = _decay(entry[2], entry[3], now, self.limits.half_life) + score
+            entry[3] = now
+            return entry[2]
+
+    def size(self) -> int:
+        return len(self._clients)
+
+
+class SqliteBackend:
+    """Table partagée par les workers d'une même machine (fichier SQLite en WAL).
+
+    Chaque opération est une transaction `BEGIN IMMEDIATE` (sérialisée entre
+    processus); les entrées les plus anciennes sont purgées périodiquement
+    au-delà de `max_entries`. En cas d'erreur SQLite la requête passe (fail-open).
+    """
+
+    name = "sqlite"
+    _EVICT_EVERY = 1000
+
+    def __init__(self, limits: _Limits, max_entries: int, path: str) -> None:
+        self.limits = limits
+        self.max_entries = max_entries
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.errors = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS clients (ip TEXT PRIMARY KEY, tokens REAL, refreshed REAL,"
+            " score REAL, scored REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS clients_refreshed ON clients(refreshed)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # état éphémère: pas de fsync
+            self._local.conn = conn
+        return conn
+
+    def _update(self, ip: str, now: float, score_delta: Optional[float]) -> Tuple[float, bool, float]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, refreshed, score, scored FROM clients WHERE ip = ?", (ip,)).fetchone()
+            tokens, refreshed, score, scored = row if row else (self.limits.burst, now, 0.0, now)
+            score = _decay(score, scored, now, self.limits.half_life)
+            limited, retry = False, 0.0
+            if score_delta is None:
+                tokens = _refill(tokens, refreshed, now, self.limits.rate, self.limits.burst)
+                tokens, limited, retry = _consume(self.limits, tokens)
+                refreshed = now
+            else:
+                score += score_delta
+            conn.execute(
+                "INSERT OR REPLACE INTO clients (ip, tokens, refreshed, score, scored) VALUES (?, ?, ?, ?, ?)",
+                (ip, tokens, refreshed, score, now),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % self._EVICT_EVERY == 0
+        if evict:
+            self._evict(conn)
+        return score, limited, retry
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        cur = conn.execute(
+            "DELETE FROM clients WHERE ip IN (SELECT ip FROM clients ORDER BY refreshed ASC"
+            " LIMIT max(0, (SELECT COUNT(*) FROM clients) - ?))",
+            (self.max_entries,),
+        )
+        self.evictions += max(cur.rowcount, 0)
+
+    def _failed(self, exc: Exception) -> None:
+        self.errors += 1
+        if self.errors == 1 or self.errors % 1000 == 0:
+            logger.warning("ip tracker sqlite error (%d so far), failing open: %s", self.errors, exc)
+
+    def hit(self, ip: str, now: float) -> ClientVerdict:
+        try:
+            score, limited, retry = self._update(ip, now, None)
+        except sqlite3.Error as exc:
+            self._failed(exc)
+            return ClientVerdict(False, 0.0, 0.0)
+        return ClientVerdict(limited, score, retry)
+
+    def add_score(self, ip: str, score: float, now: float) -> float:
+        try:
+            return self._update(ip, now, score)[0]
+        except sqlite3.Error as exc:
+            self._failed(exc)
+            return 0.0
+
+    def size(self) -> int:
+        try:
+            return int(self._conn().execute("SELECT COUNT(*) FROM clients").fetchone()[0])
+        except sqlite3.Error:
+            return -1
+
+
+class IpTracker:
+    """Suivi par IP source: limite de débit (seau à jetons) et score d'anomalie
+    cumulé, à décroissance exponentielle (demi-vie `half_life` secondes).
+    """
+
+    def __init__(self, backend: Any) -> None:
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "rate_limited": 0, "score_blocked": 0}
+
+    @staticmethod
+    def _now() -> float:
+        # Horloge murale: comparable entre processus (backend sqlite)
+        return time.time()
+
+    def check(self, ip: str) -> ClientVerdict:
+        """Compter une requête de `ip` (consomme un jeton) et retourner son état."""
+        verdict = self.backend.hit(ip, self._now())
+        with self._lock:
+            self._counters["requests"] += 1
+            if verdict.limited:
+                self._counters["rate_limited"] += 1
+        return verdict
+
+    def record(self, ip: str, score: int) -> None:
+        """Ajouter le score d'une requête analysée au score cumulé de `ip`."""
+        if score > 0:
+            self.backend.add_score(ip, float(score), self._now())
+
+    def count_blocked(self) -> None:
+        with self._lock:
+            self._counters["score_blocked"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            "enabled": True,
+            "backend": self.backend.name,
+            "tracked": self.backend.size(),
+            "max_entries": self.backend.max_entries,
+            "evictions": self.backend.evictions,
+            **counters,
+        }
+
+
+_tracker: Optional[IpTracker] = None
+_tracker_lock = threading.Lock()
+
+
+def get_ip_tracker() -> Optional[IpTracker]:
+    """Tracker du processus, ou None si `WAF_IP_TRACKER` est désactivé."""
+    global _tracker
+    if not settings.ip_tracker:
+        return None
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                limits = _Limits(settings.ip_rate_limit, float(max(settings.ip_rate_burst, 1)), settings.ip_score_half_life)
+                if settings.ip_tracker_backend == "sqlite":
+                    backend: Any = SqliteBackend(limits, settings.ip_tracker_max, settings.ip_tracker_path)
+                else:
+                    backend = MemoryBackend(limits, settings.ip_tracker_max)
+                _tracker = IpTracker(backend)
+    return _tracker
+
+
+def ip_tracker_stats() -> Dict[str, Any]:
+    tracker = get_ip_tracker()
+    return tracker.stats() if tracker is not None else {"enabled": False}
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
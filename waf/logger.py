@@ -1,18 +1,24 @@
 from __future__ import annotations
 
+import atexit
 import json
 import os
+import queue
+import threading
 import time
 import uuid
 from datetime import datetime, timezone
-from typing import Any, Dict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 try:
     import orjson  # type: ignore
 except Exception:  # pragma: no cover - optional
     orjson = None  # type: ignore
 
+from .binlog import encode_events
 from .config import settings
+from .metrics import record_event
+from .rotation import RotatingAppender, RotationPolicy
 
 
 def _json_dumps(obj: Any) -> str:
@@ -21,6 +27,25 @@ def _json_dumps(obj: Any) -> str:
     return json.dumps(obj, ensure_ascii=False)
 
 
+def _json_line_bytes(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8", errors="replace")
+
+
+def _encode_events(events: Iterable[Dict[str, Any]]) -> Tuple[bytes, int]:
+    """Sérialiser selon `log_format`; retourne les octets et le nombre d'événements encodés."""
+    if settings.log_format == "binary":
+        return encode_events(events)
+    lines = []
+    for event in events:
+        try:
+            lines.append(_json_line_bytes(event))
+        except Exception:
+            continue
+    return b"".join(lines), len(lines)
+
+
 def ensure_data_dir():
     os.makedirs(os.path.dirname(settings.logs_file), exist_ok=True)
 
@@ -33,12 +58,251 @@ def utc_now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+def rotation_policy() -> RotationPolicy:
+    return RotationPolicy(
+        max_bytes=settings.log_rotate_bytes,
+        interval=settings.log_rotate_interval,
+        naming=settings.log_rotate_naming,
+        compress=settings.log_rotate_compress,
+        keep=settings.log_rotate_keep,
+        max_age=settings.log_rotate_max_age_days * 86400,
+    )
+
+
+def append_lines(path: str, data: bytes) -> None:
+    """Ajout atomique de lignes complètes, sûr entre plusieurs processus
+    (O_APPEND + une écriture sous verrou flock, rotation comprise).
+    """
+    appender = RotatingAppender(path, rotation_policy())
+    try:
+        appender.append(data)
+    finally:
+        appender.close()
+
+
+class BatchLogWriter:
+    """Écriture des logs en arrière-plan, par lots.
+
+    Les événements passent par une file bornée; un thread dédié les sérialise
+    (JSONL via orjson si disponible, ou un bloc binaire par lot selon
+    `log_format`) et les écrit par lots (taille `batch_size` ou après
+    `flush_interval` secondes) sur un descripteur ouvert une seule fois
+    (rouvert après rotation, cf. `waf/rotation.py`).
+    Politique quand la file est pleine (`overflow`):
+    - "block": l'appelant attend qu'une place se libère;
+    - "drop": l'événement est abandonné (compteur `dropped`);
+    - "sample": un événement sur `sample_rate` attend une place, les autres sont abandonnés.
+    Les abandons sont aussi signalés dans le journal lui-même: le lot suivant
+    porte un événement `LOG_DROPPED` avec le nombre d'événements perdus.
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        path: str,
+        max_queue: int = 10000,
+        batch_size: int = 256,
+        flush_interval: float = 0.5,
+        overflow: str = "block",
+        sample_rate: int = 10,
+    ) -> None:
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.sample_rate = max(1, sample_rate)
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, max_queue))
+        self._lock = threading.Lock()
+        self._appender = RotatingAppender(path, rotation_policy())
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._overflow_seen = 0
+        self._counters = {"queued": 0, "written": 0, "dropped": 0, "batches": 0, "errors": 0}
+        self._dropped_reported = 0
+
+    def _incr(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[key] += n
+
+    def _ensure_started(self) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="waf-log-writer", daemon=True)
+                    self._thread.start()
+
+    def submit(self, event: Dict[str, Any]) -> bool:
+        """Mettre un événement en file; retourne False s'il a été abandonné."""
+        if self._closed:
+            self._incr("dropped")
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            if self.overflow == "block":
+                self._queue.put(event)
+            elif self.overflow == "sample":
+                with self._lock:
+                    self._overflow_seen += 1
+                    keep = self._overflow_seen % self.sample_rate == 0
+                if not keep:
+                    self._incr("dropped")
+                    return False
+                self._queue.put(event)
+            else:
+                self._incr("dropped")
+                return False
+        self._incr("queued")
+        return True
+
+    def full(self) -> bool:
+        return self._queue.full()
+
+    def _drop_notice(self) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            dropped = self._counters["dropped"] - self._dropped_reported
+            self._dropped_reported = self._counters["dropped"]
+        if not dropped:
+            return None
+        return {
+            "timestamp": utc_now_iso(),
+            "score": 0,
+            "severity": "none",
+            "matched_rules": [],
+            "flags": {},
+            "action": "LOG_DROPPED",
+            "dropped": dropped,
+            "overflow": self.overflow,
+        }
+
+    def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        notice = self._drop_notice()
+        if notice is not None:
+            batch = [*batch, notice]
+        data, encoded = _encode_events(batch)
+        if encoded < len(batch):
+            self._incr("errors", len(batch) - encoded)
+        if not encoded:
+            return
+        try:
+            self._appender.append(data)
+            self._incr("written", encoded)
+            self._incr("batches")
+        except Exception:
+            # En dernier recours, on perd le lot plutôt que de bloquer le proxy
+            self._incr("errors")
+            self._incr("dropped", encoded)
+            self._appender.close()
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch: List[Any] = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is self._STOP:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    # Demande de flush: écrire ce qui précède puis signaler
+                    self._write_batch(batch)
+                    batch = []
+                    item.set()
+                else:
+                    batch.append(item)
+                if stopping or len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            self._write_batch(batch)
+        self._appender.close()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Attendre l'écriture de tous les événements déjà en file."""
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Vider la file puis arrêter le thread (appelé à l'arrêt du processus)."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            **counters,
+            "pending": self._queue.qsize(),
+            "overflow": self.overflow,
+            "rotations": self._appender.rotations,
+        }
+
+
+_writer: Optional[BatchLogWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_log_writer() -> BatchLogWriter:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = BatchLogWriter(
+                    settings.logs_file,
+                    max_queue=settings.log_queue_size,
+                    batch_size=settings.log_batch_size,
+                    flush_interval=settings.log_flush_interval,
+                    overflow=settings.log_overflow,
+                    sample_rate=settings.log_sample_rate,
+                )
+    return _writer
+
+
+def log_writer_stats() -> Dict[str, Any]:
+    if settings.log_writer != "async":
+        return {"writer": "sync"}
+    return {"writer": "async", **get_log_writer().stats()}
+
+
+def close_log_writer() -> None:
+    """Flush final des logs en file (arrêt du processus)."""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
+
+
+atexit.register(close_log_writer)
+
+
 def append_log(event: Dict[str, Any]) -> None:
+    record_event(event)
     try:
+        if settings.log_writer == "async":
+            get_log_writer().submit(event)
+            return
         ensure_data_dir()
-        line = _json_dumps(event)
-        with open(settings.logs_file, "a", encoding="utf-8", errors="replace") as f:
-            f.write(line + "\n")
+        data, encoded = _encode_events([event])
+        if encoded:
+            append_lines(settings.logs_file, data)
     except Exception:
         # En dernier recours, on ignore l'erreur d'écriture pour ne pas casser la réponse WAF
         pass
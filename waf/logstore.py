@@ -0,0 +1,404 @@
+from __future__ import annotations
+
+import bisect
+import json
+import mmap
+import os
+import threading
+import time
+from typing import IO, Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import orjson  # type: ignore
+except Exception:  # pragma: no cover - optional
+    orjson = None  # type: ignore
+
+from .binlog import MAGIC, Block, scan_headers, sniff
+from .rotation import list_segments, open_segment
+
+
+def _loads(line: bytes) -> Optional[Dict[str, Any]]:
+    try:
+        obj = orjson.loads(line) if orjson is not None else json.loads(line.decode("utf-8", errors="replace"))
+    except Exception:
+        return None
+    return obj if isinstance(obj, dict) else None
+
+
+def active_filters(severity: str, action: str, rule: str, source_ip: str) -> Dict[str, str]:
+    """Filtres non vides, normalisés comme dans l'index (sévérité en minuscules, action en majuscules)."""
+    filters = {
+        "severity": severity.lower(),
+        "action": action.upper(),
+        "rule": rule,
+        "source_ip": source_ip,
+    }
+    return {name: value for name, value in filters.items() if value}
+
+
+def event_matches(event: Dict[str, Any], active: Dict[str, str]) -> bool:
+    """Vrai si l'événement satisfait tous les filtres produits par `active_filters`."""
+    for name, value in active.items():
+        if name == "severity" and str(event.get("severity", "")).lower() != value:
+            return False
+        if name == "action" and str(event.get("action", "")).upper() != value:
+            return False
+        if name == "rule" and value not in (event.get("matched_rules") or []):
+            return False
+        if name == "source_ip" and str(event.get("source_ip", "")) != value:
+            return False
+    return True
+
+
+class LogStore:
+    """Index en mémoire des événements, alimenté en suivant `logs.json`.
+
+    `refresh()` lit uniquement les octets ajoutés depuis le dernier offset
+    (et termine l'ancien fichier après une rotation). Les événements sont
+    numérotés (seq croissant) et indexés par timestamp, severity, action, règle et
+    source_ip; une requête filtrée parcourt l'index le plus sélectif depuis la
+    fin, son coût dépend donc du résultat et non de l'historique.
+    Au-delà de `max_events`, les plus anciens sont oubliés.
+    Chaque fichier est lu en JSONL ou au format binaire (`waf/binlog.py`) selon
+    son début; en binaire, le fichier courant est projeté en mémoire et seuls
+    les blocs complets sont ingérés.
+    `on_event`, si fourni, est appelé pour chaque événement ingéré (métriques).
+    """
+
+    _INDEXED = ("severity", "action", "rule", "source_ip")
+
+    def __init__(
+        self,
+        path: str,
+        max_events: int = 100000,
+        tail_interval: float = 0.25,
+        on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> None:
+        self.path = path
+        self.on_event = on_event
+        self.max_events = max(1, max_events)
+        self.tail_interval = tail_interval
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._tailer: Optional[threading.Thread] = None
+        self._file: Optional[IO[bytes]] = None
+        self._ino: Optional[int] = None
+        self._offset = 0
+        self._pending = b""
+        self._binary: Optional[bool] = None
+        self._loaded = False
+        self._events: List[Dict[str, Any]] = []
+        self._first_seq = 0
+        self._reset_index()
+
+    def _reset_index(self) -> None:
+        # Les numéros de séquence restent croissants même après un reset
+        self._first_seq = self.next_seq
+        self._events = []
+        self._index: Dict[str, Dict[str, List[int]]] = {name: {} for name in self._INDEXED}
+        # Index temporel, deux listes croissantes même si plusieurs workers
+        # écrivent légèrement dans le désordre: plus grand timestamp jusqu'à
+        # chaque événement (borne `since`) et plus petit à partir de lui (borne `until`)
+        self._ts_high: List[str] = []
+        self._ts_low: List[str] = []
+
+    @property
+    def next_seq(self) -> int:
+        return self._first_seq + len(self._events)
+
+    # --- Ingestion ---
+
+    def _add(self, event: Dict[str, Any]) -> None:
+        seq = self.next_seq
+        self._events.append(event)
+        ts = str(event.get("timestamp", ""))
+        self._ts_high.append(max(self._ts_high[-1], ts) if self._ts_high else ts)
+        low = self._ts_low
+        low.append(ts)
+        # Seule la fin de la liste est à corriger (quelques entrées en pratique)
+        j = len(low) - 2
+        while j >= 0 and low[j] > ts:
+            low[j] = ts
+            j -= 1
+        keys = {
+            "severity": [str(event.get("severity", "")).lower()],
+            "action": [str(event.get("action", "")).upper()],
+            "rule": list(dict.fromkeys(event.get("matched_rules") or [])),
+            "source_ip": [str(event.get("source_ip", ""))],
+        }
+        for name, values in keys.items():
+            index = self._index[name]
+            for value in values:
+                index.setdefault(value, []).append(seq)
+
+    def _trim(self) -> None:
+        # Élaguer par paquets (10 %) pour amortir le coût de mise à jour des index
+        excess = len(self._events) - self.max_events
+        if excess <= 0:
+            return
+        excess = max(excess, self.max_events // 10)
+        del self._events[:excess]
+        del self._ts_high[:excess]
+        del self._ts_low[:excess]
+        self._first_seq += excess
+        for index in self._index.values():
+            for value in list(index):
+                seqs = index[value]
+                cut = bisect.bisect_left(seqs, self._first_seq)
+                if cut >= len(seqs):
+                    del index[value]
+                elif cut:
+                    del seqs[:cut]
+
+    def _ingest_bytes(self, data: bytes) -> None:
+        data = self._pending + data
+        lines = data.split(b"\n")
+        # La dernière ligne peut être incomplète (écriture en cours)
+        self._pending = lines.pop()
+        for line in lines:
+            if not line.strip():
+                continue
+            event = _loads(line)
+            if event is not None:
+                self._add(event)
+                if self.on_event is not None:
+                    self.on_event(event)
+        self._trim()
+
+    def _ingest_blocks(self, buf: Any, offset: int = 0, keep: Optional[int] = None) -> int:
+        """Ingérer les blocs binaires complets à partir de `offset` (au plus les
+        `keep` derniers événements, `max_events` par défaut); retourne la fin du
+        dernier bloc complet.
+        """
+        headers, end = scan_headers(buf, offset)
+        # Inutile de décoder ce que _trim oublierait aussitôt
+        skip = max(0, sum(h.count for h in headers) - (self.max_events if keep is None else keep))
+        for header in headers:
+            if skip >= header.count:
+                skip -= header.count
+                continue
+            try:
+                events = Block(buf, header).events(skip)
+            except Exception:
+                events = []
+            skip = 0
+            for event in events:
+                self._add(event)
+                if self.on_event is not None:
+                    self.on_event(event)
+        self._trim()
+        return end
+
+    def _close_file(self) -> None:
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+        self._file = None
+        self._ino = None
+        self._offset = 0
+        self._pending = b""
+        self._binary = None
+
+    def _initial_load(self) -> None:
+        # Segments les plus récents d'abord, jusqu'à max_events événements
+        chunks: List[Tuple[bytes, bool, int]] = []
+        total = 0
+        for seg in reversed(list_segments(self.path)):
+            try:
+                with open_segment(seg) as f:
+                    data = f.read()
+            except OSError:
+                continue
+            binary = sniff(data[:len(MAGIC)]) is True
+            room = self.max_events - total
+            chunks.append((data, binary, room))
+            total += sum(h.count for h in scan_headers(data)[0]) if binary else data.count(b"\n")
+            if total >= self.max_events:
+                break
+        for data, binary, room in reversed(chunks):
+            self._pending = b""
+            if binary:
+                self._ingest_blocks(data, keep=room)
+            else:
+                self._ingest_bytes(data if data.endswith(b"\n") else data + b"\n")
+
+    def refresh(self) -> None:
+        """Ingérer les lignes ajoutées depuis le dernier appel."""
+        with self._lock:
+            self._refresh_locked()
+
+    def _refresh_locked(self) -> None:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            st = None
+        if self._file is None:
+            if st is None:
+                return
+            if not self._loaded:
+                self._initial_load()
+            self._loaded = True
+            self._file = open(self.path, "rb")
+            self._ino = os.fstat(self._file.fileno()).st_ino
+            self._offset = 0
+            self._pending = b""
+        assert self._file is not None
+        # Fichier tronqué (Clear logs): repartir de zéro
+        if st is not None and st.st_ino == self._ino and st.st_size < self._offset:
+            self._close_file()
+            self._reset_index()
+            self._refresh_locked()
+            return
+        self._read_new()
+        if st is None or st.st_ino != self._ino:
+            # Rotation: l'ancien fichier est entièrement lu, on passe au nouveau
+            if self._pending:
+                self._ingest_bytes(b"\n")
+            self._close_file()
+            if st is not None:
+                self._file = open(self.path, "rb")
+                self._ino = os.fstat(self._file.fileno()).st_ino
+                self._read_new()
+
+    def _read_new(self) -> None:
+        assert self._file is not None
+        if self._binary is None:
+            self._binary = sniff(os.pread(self._file.fileno(), len(MAGIC), 0))
+            if self._binary is None:
+                return
+        if self._binary:
+            size = os.fstat(self._file.fileno()).st_size
+            if size > self._offset:
+                with mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                    self._offset = self._ingest_blocks(buf, self._offset)
+            return
+        self._file.seek(self._offset)
+        while True:
+            data = self._file.read(1024 * 1024)
+            if not data:
+                break
+            self._offset += len(data)
+            self._ingest_bytes(data)
+
+    def reset(self) -> None:
+        """Oublier tous les événements (après Clear logs)."""
+        with self._lock:
+            self._close_file()
+            self._reset_index()
+            self._loaded = True
+
+    # --- Requêtes ---
+
+    def _smallest_index(self, active: Dict[str, str]) -> List[int]:
+        candidates = [self._index[name].get(value, []) for name, value in active.items()]
+        return min(candidates, key=len)
+
+    def query(
+        self,
+        limit: int = 200,
+        severity: str = "",
+        action: str = "",
+        rule: str = "",
+        source_ip: str = "",
+        since: str = "",
+        until: str = "",
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """Les `limit` derniers événements correspondant aux filtres, dans l'ordre chronologique,
+        et le curseur (seq) à passer à `since_cursor` pour obtenir la suite.
+        `since`/`until` filtrent sur le timestamp ISO: la plage de seq est trouvée
+        par dichotomie, le coût ne dépend pas de l'ancienneté de la fenêtre.
+        """
+        self.refresh()
+        active = active_filters(severity, action, rule, source_ip)
+        with self._lock:
+            # Bornes de seq de la plage [since, until] par dichotomie sur l'index temporel
+            lo = self._first_seq + (bisect.bisect_left(self._ts_high, since) if since else 0)
+            hi = self._first_seq + (bisect.bisect_right(self._ts_low, until) if until else len(self._events))
+            if active:
+                index = self._smallest_index(active)
+                seqs: Any = reversed(index[bisect.bisect_left(index, lo):bisect.bisect_left(index, hi)])
+            else:
+                seqs = range(hi - 1, lo - 1, -1)
+            out: List[Dict[str, Any]] = []
+            for seq in seqs:
+                event = self._events[seq - self._first_seq]
+                ts = str(event.get("timestamp", ""))
+                if (until and ts > until) or (since and ts < since):
+                    continue
+                if active and not event_matches(event, active):
+                    continue
+                out.append(event)
+                if limit and len(out) >= limit:
+                    break
+            cursor = self.next_seq
+        out.reverse()
+        return out, cursor
+
+    def since_cursor(
+        self,
+        cursor: int,
+        limit: int = 0,
+        severity: str = "",
+        action: str = "",
+        rule: str = "",
+        source_ip: str = "",
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """Événements de seq >= `cursor` correspondant aux filtres (au plus les `limit`
+        plus récents) et le curseur suivant.
+        """
+        self.refresh()
+        active = active_filters(severity, action, rule, source_ip)
+        with self._lock:
+            start = max(cursor, self._first_seq)
+            if active:
+                index = self._smallest_index(active)
+                seqs: Any = index[bisect.bisect_left(index, start):]
+            else:
+                seqs = range(start, self.next_seq)
+            out = [
+                self._events[seq - self._first_seq]
+                for seq in seqs
+                if not active or event_matches(self._events[seq - self._first_seq], active)
+            ]
+            next_cursor = self.next_seq
+        if limit and len(out) > limit:
+            out = out[-limit:]
+        return out, next_cursor
+
+    def wait_for(self, cursor: int, timeout: float) -> bool:
+        """Attendre (au plus `timeout` s) que des événements de seq >= `cursor` arrivent.
+        Un seul thread de suivi lit le fichier pour tous les abonnés (SSE).
+        """
+        self._ensure_tailer()
+        with self._changed:
+            return self._changed.wait_for(lambda: self.next_seq > cursor, timeout)
+
+    def _ensure_tailer(self) -> None:
+        if self._tailer is None:
+            with self._lock:
+                if self._tailer is None:
+                    self._tailer = threading.Thread(target=self._tail_loop, name="waf-log-tailer", daemon=True)
+                    self._tailer.start()
+
+    def _tail_loop(self) -> None:
+        while True:
+            before = self.next_seq
+            try:
+                self.refresh()
+            except Exception:
+                pass
+            if self.next_seq != before:
+                with self._changed:
+                    self._changed.notify_all()
+            time.sleep(self.tail_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "events": len(self._events),
+                "first_seq": self._first_seq,
+                "next_seq": self.next_seq,
+                "offset": self._offset,
+            }
@@ -0,0 +1,306 @@
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .config import settings
+
+# Bornes supérieures des histogrammes (le dernier seau est +Inf)
+SCORE_BUCKETS: Tuple[float, ...] = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20)
+LATENCY_BUCKETS_MS: Tuple[float, ...] = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+QUANTILES: Tuple[float, ...] = (0.5, 0.9, 0.95, 0.99)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Histogram:
+    """Histogramme à seaux fixes (mémoire constante)."""
+
+    __slots__ = ("bounds", "counts", "total", "count")
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def merge(self, other: "_Histogram") -> None:
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.total += other.total
+        self.count += other.count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimation par interpolation linéaire dans le seau concerné."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                if i >= len(self.bounds):
+                    return float(self.bounds[-1])
+                return lower + (self.bounds[i] - lower) * (rank - seen) / n
+            seen += n
+        return float(self.bounds[-1])
+
+
+class _Bucket:
+    """Agrégats d'une tranche de `bucket_seconds` secondes."""
+
+    __slots__ = ("start", "requests", "actions", "statuses", "severities", "rules", "ips", "scores", "latency")
+
+    def __init__(self) -> None:
+        self.reset(-1)
+
+    def reset(self, start: int) -> None:
+        self.start = start
+        self.requests = 0
+        self.actions: Counter = Counter()
+        self.statuses: Counter = Counter()
+        self.severities: Counter = Counter()
+        self.rules: Counter = Counter()
+        self.ips: Counter = Counter()
+        self.scores = _Histogram(SCORE_BUCKETS)
+        self.latency = _Histogram(LATENCY_BUCKETS_MS)
+
+
+def _event_time(event: Dict[str, Any]) -> Optional[float]:
+    try:
+        return datetime.fromisoformat(str(event["timestamp"])).timestamp()
+    except Exception:
+        return None
+
+
+class Metrics:
+    """Compteurs et histogrammes agrégés au fil des événements.
+
+    - Totaux cumulés depuis le démarrage (compteurs Prometheus).
+    - Fenêtre glissante de `window_seconds` découpée en seaux de
+      `bucket_seconds` dans un tableau circulaire: un seau trop ancien est
+      réutilisé, la mémoire reste donc constante. Le nombre d'IP distinctes
+      suivies par seau est borné par `max_ips` (au-delà: "other").
+    """
+
+    def __init__(self, window_seconds: int = 600, bucket_seconds: int = 10, max_ips: int = 1000) -> None:
+        self.bucket_seconds = max(1, bucket_seconds)
+        self.window_seconds = max(self.bucket_seconds, window_seconds)
+        self.max_ips = max(1, max_ips)
+        self._lock = threading.Lock()
+        self._ring = [_Bucket() for _ in range(self.window_seconds // self.bucket_seconds)]
+        self._started = time.time()
+        self._requests: Counter = Counter()  # (action, status)
+        self._severities: Counter = Counter()
+        self._rules: Counter = Counter()
+        self._scores = _Histogram(SCORE_BUCKETS)
+        self._latency = _Histogram(LATENCY_BUCKETS_MS)
+
+    def record(self, event: Dict[str, Any], use_event_time: bool = False) -> None:
+        """Comptabiliser un événement (même format que les lignes de logs)."""
+        now = time.time()
+        ts = (_event_time(event) or now) if use_event_time else now
+        action = str(event.get("action") or "")
+        status = "" if event.get("status") is None else str(event.get("status"))
+        severity = str(event.get("severity") or "").lower()
+        rules = list(dict.fromkeys(event.get("matched_rules") or []))
+        ip = str(event.get("source_ip") or "")
+        score = event.get("score")
+        latency = event.get("response_time_ms")
+        slot = int(ts // self.bucket_seconds)
+        in_window = ts >= now - self.window_seconds
+        with self._lock:
+            self._requests[(action, status)] += 1
+            self._severities[severity] += 1
+            for rule in rules:
+                self._rules[rule] += 1
+            if isinstance(score, (int, float)):
+                self._scores.observe(score)
+            if isinstance(latency, (int, float)):
+                self._latency.observe(latency)
+            if not in_window:
+                return
+            bucket = self._ring[slot % len(self._ring)]
+            if bucket.start != slot:
+                if bucket.start > slot:
+                    return  # seau déjà réutilisé par une tranche plus récente
+                bucket.reset(slot)
+            bucket.requests += 1
+            bucket.actions[action] += 1
+            bucket.statuses[status] += 1
+            bucket.severities[severity] += 1
+            for rule in rules:
+                bucket.rules[rule] += 1
+            if ip in bucket.ips or len(bucket.ips) < self.max_ips:
+                bucket.ips[ip] += 1
+            else:
+                bucket.ips["other"] += 1
+            if isinstance(score, (int, float)):
+                bucket.scores.observe(score)
+            if isinstance(latency, (int, float)):
+                bucket.latency.observe(latency)
+
+    def _window(self) -> Tuple[List[_Bucket], _Bucket]:
+        # Seaux encore dans la fenêtre, du plus ancien au plus récent, et leur somme
+        oldest = int((time.time() - self.window_seconds) // self.bucket_seconds) + 1
+        live = sorted((b for b in self._ring if b.start >= oldest), key=lambda b: b.start)
+        total = _Bucket()
+        for b in live:
+            total.requests += b.requests
+            total.actions.update(b.actions)
+            total.statuses.update(b.statuses)
+            total.severities.update(b.severities)
+            total.rules.update(b.rules)
+            total.ips.update(b.ips)
+            total.scores.merge(b.scores)
+            total.latency.merge(b.latency)
+        return live, total
+
+    def summary(self, top: int = 10) -> Dict[str, Any]:
+        """Résumé JSON (totaux + fenêtre glissante) pour le dashboard."""
+        with self._lock:
+            live, window = self._window()
+            requests = sum(self._requests.values())
+            by_action: Counter = Counter()
+            for (action, _), n in self._requests.items():
+                by_action[action] += n
+            return {
+                "started": self._started,
+                "window_seconds": self.window_seconds,
+                "bucket_seconds": self.bucket_seconds,
+                "totals": {
+                    "requests": requests,
+                    "by_action": dict(by_action),
+                    "by_severity": dict(self._severities),
+                    "rules": dict(self._rules.most_common(top)),
+                },
+                "window": {
+                    "requests": window.requests,
+                    "by_action": dict(window.actions),
+                    "by_status": dict(window.statuses),
+                    "by_severity": dict(window.severities),
+                    "rules": dict(window.rules.most_common(top)),
+                    "top_ips": [{"ip": ip, "count": n} for ip, n in window.ips.most_common(top)],
+                    "score_histogram": _histogram_dict(window.scores),
+                    "latency_ms": {f"p{int(q * 100)}": window.latency.quantile(q) for q in QUANTILES},
+                    "timeline": [
+                        {
+                            "start": b.start * self.bucket_seconds,
+                            "requests": b.requests,
+                            "blocked": b.actions.get("BLOCK", 0),
+                        }
+                        for b in live
+                    ],
+                },
+            }
+
+    def prometheus(self, top: int = 10) -> str:
+        """Exposition au format texte Prometheus."""
+        lines: List[str] = []
+        with self._lock:
+            _, window = self._window()
+            lines += [
+                "# HELP waf_requests_total Requests seen by the WAF by action and upstream status.",
+                "# TYPE waf_requests_total counter",
+            ]
+            for (action, status), n in sorted(self._requests.items()):
+                lines.append(f"waf_requests_total{{action={_label(action)},status={_label(status)}}} {n}")
+            lines += [
+                "# HELP waf_requests_by_severity_total Requests by severity.",
+                "# TYPE waf_requests_by_severity_total counter",
+            ]
+            for severity, n in sorted(self._severities.items()):
+                lines.append(f"waf_requests_by_severity_total{{severity={_label(severity)}}} {n}")
+            lines += [
+                "# HELP waf_rule_hits_total Requests matched by each rule.",
+                "# TYPE waf_rule_hits_total counter",
+            ]
+            for rule, n in sorted(self._rules.items()):
+                lines.append(f"waf_rule_hits_total{{rule={_label(rule)}}} {n}")
+            lines += _prom_histogram("waf_request_score", "Risk score per request.", self._scores, 1.0)
+            lines += _prom_histogram(
+                "waf_response_time_seconds", "Time to answer the client.", self._latency, 0.001
+            )
+            lines += [
+                f"# HELP waf_window_requests Requests in the last {self.window_seconds}s by action.",
+                "# TYPE waf_window_requests gauge",
+            ]
+            for action, n in sorted(window.actions.items()):
+                lines.append(f"waf_window_requests{{action={_label(action)}}} {n}")
+            lines += [
+                f"# HELP waf_window_response_time_ms Response time quantiles over the last {self.window_seconds}s.",
+                "# TYPE waf_window_response_time_ms gauge",
+            ]
+            for q in QUANTILES:
+                value = window.latency.quantile(q)
+                if value is not None:
+                    lines.append(f'waf_window_response_time_ms{{quantile="{q}"}} {value:g}')
+            lines += [
+                f"# HELP waf_window_top_source_ip_requests Top source IPs over the last {self.window_seconds}s.",
+                "# TYPE waf_window_top_source_ip_requests gauge",
+            ]
+            for ip, n in window.ips.most_common(top):
+                lines.append(f"waf_window_top_source_ip_requests{{source_ip={_label(ip)}}} {n}")
+        return "\n".join(lines) + "\n"
+
+
+def _label(value: str) -> str:
+    escaped = value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def _histogram_dict(hist: _Histogram) -> Dict[str, int]:
+    labels = [f"<={b:g}" for b in hist.bounds] + [f">{hist.bounds[-1]:g}"]
+    return dict(zip(labels, hist.counts))
+
+
+def _prom_histogram(name: str, help_text: str, hist: _Histogram, scale: float) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    cumulative = 0
+    for bound, n in zip(hist.bounds, hist.counts):
+        cumulative += n
+        lines.append(f'{name}_bucket{{le="{bound * scale:g}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{le="+Inf"}} {hist.count}')
+    lines.append(f"{name}_sum {hist.total * scale:g}")
+    lines.append(f"{name}_count {hist.count}")
+    return lines
+
+
+def new_metrics() -> Metrics:
+    return Metrics(
+        window_seconds=settings.metrics_window_seconds,
+        bucket_seconds=settings.metrics_bucket_seconds,
+        max_ips=settings.metrics_max_ips,
+    )
+
+
+_metrics: Optional[Metrics] = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """Agrégats du processus courant (alimentés par `append_log`)."""
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = new_metrics()
+    return _metrics
+
+
+def record_event(event: Dict[str, Any]) -> None:
+    if not settings.metrics_enabled:
+        return
+    try:
+        get_metrics().record(event)
+    except Exception:
+        # Les métriques ne doivent jamais casser la réponse WAF
+        pass
@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .config import settings
+
+
+def create_listen_socket(host: str, port: int, backlog: int = 1024) -> socket.socket:
+    """Socket d'écoute partagé, hérité par tous les workers."""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class PreforkMaster:
+    """Processus maître: N workers acceptent sur le même socket.
+
+    - SIGHUP: rechargement gracieux (nouvelle génération de workers lancée,
+      puis l'ancienne est drainée via SIGTERM). Les workers sont des
+      interpréteurs neufs, le code mis à jour est donc pris en compte.
+    - SIGTERM/SIGINT: arrêt propre, les requêtes en cours sont terminées
+      dans la limite de `graceful_timeout`, puis SIGKILL.
+    - Un worker qui se termine (recyclage après `max_requests` ou crash) est
+      relancé automatiquement.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        engine: str,
+        max_requests: int,
+        graceful_timeout: float,
+        host: str,
+        port: int,
+    ) -> None:
+        self.workers = max(1, workers)
+        self.engine = engine
+        self.max_requests = max_requests
+        self.graceful_timeout = graceful_timeout
+        self.host = host
+        self.port = port
+        self._sock: Optional[socket.socket] = None
+        self._procs: List[subprocess.Popen] = []
+        self._draining: List[Tuple[subprocess.Popen, float]] = []
+        self._signals: List[int] = []
+        self._stopping = False
+
+    def _spawn(self) -> subprocess.Popen:
+        assert self._sock is not None
+        fd = self._sock.fileno()
+        cmd = [
+            sys.executable, "-m", "waf.run_waf",
+            "--engine", self.engine,
+            "--worker-fd", str(fd),
+            "--max-requests", str(self.max_requests),
+        ]
+        return subprocess.Popen(cmd, pass_fds=(fd,))
+
+    def _on_signal(self, signum: int, frame: Any) -> None:
+        self._signals.append(signum)
+
+    def _drain(self, procs: Iterable[subprocess.Popen]) -> None:
+        deadline = time.monotonic() + self.graceful_timeout
+        for p in procs:
+            if p.poll() is None:
+                try:
+                    p.send_signal(signal.SIGTERM)
+                except Exception:
+                    pass
+            self._draining.append((p, deadline))
+
+    def _reap_draining(self) -> None:
+        remaining: List[Tuple[subprocess.Popen, float]] = []
+        now = time.monotonic()
+        for p, deadline in self._draining:
+            if p.poll() is not None:
+                continue
+            if now >= deadline:
+                p.kill()
+                p.wait()
+                continue
+            remaining.append((p, deadline))
+        self._draining = remaining
+
+    def _handle_signals(self) -> None:
+        while self._signals:
+            signum = self._signals.pop(0)
+            if signum == signal.SIGHUP and not self._stopping:
+                old = self._procs
+                self._procs = [self._spawn() for _ in range(self.workers)]
+                self._drain(old)
+            elif signum in (signal.SIGTERM, signal.SIGINT):
+                self._stopping = True
+                self._drain(self._procs)
+                self._procs = []
+
+    def run(self) -> None:
+        self._sock = create_listen_socket(self.host, self.port)
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._on_signal)
+        self._procs = [self._spawn() for _ in range(self.workers)]
+        try:
+            while not (self._stopping and not self._draining):
+                self._handle_signals()
+                if not self._stopping:
+                    # Relancer les workers terminés (recyclage ou crash)
+                    self._procs = [p if p.poll() is None else self._spawn() for p in self._procs]
+                self._reap_draining()
+                time.sleep(0.2)
+        finally:
+            for p in self._procs + [p for p, _ in self._draining]:
+                if p.poll() is None:
+                    p.kill()
+            self._sock.close()
+
+
+class _RequestCounter:
+    """Middleware WSGI: déclenche l'arrêt du worker après `limit` requêtes."""
+
+    def __init__(self, app: Callable, limit: int, on_limit: Callable[[], None]) -> None:
+        self.app = app
+        self.limit = limit
+        self.on_limit = on_limit
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ: Dict[str, Any], start_response: Callable) -> Any:
+        with self._lock:
+            self.count += 1
+            reached = self.count == self.limit
+        if reached:
+            self.on_limit()
+        return self.app(environ, start_response)
+
+
+def run_worker(fd: int, engine: str, max_requests: int) -> None:
+    """Boucle d'un worker sur le socket hérité `fd`."""
+    if engine == "asgi":
+        import uvicorn  # type: ignore
+
+        from .asgi_proxy import create_asgi_app
+
+        # uvicorn gère lui-même SIGTERM (drain) et le recyclage
+        config = uvicorn.Config(
+            create_asgi_app(),
+            fd=fd,
+            lifespan="on",
+            log_level="warning",
+            limit_max_requests=max_requests or None,
+            timeout_graceful_shutdown=int(settings.graceful_timeout) or None,
+        )
+        uvicorn.Server(config).run()
+        return
+
+    from werkzeug.serving import make_server
+
+    from .logger import close_log_writer
+    from .proxy import create_app_with_error_handler
+    from .upstream import close_upstream_pool
+
+    app: Callable = create_app_with_error_handler()
+    server_holder: Dict[str, Any] = {}
+
+    def _stop() -> None:
+        # shutdown() attend la fin de serve_forever: à appeler hors du thread serveur
+        threading.Thread(target=server_holder["server"].shutdown, daemon=True).start()
+
+    if max_requests > 0:
+        app = _RequestCounter(app, max_requests, _stop)
+    server = make_server(settings.host, settings.port, app, threaded=True, fd=fd)
+    # Attendre les threads de requêtes en cours à la fermeture (drain)
+    server.daemon_threads = False
+    server.block_on_close = True
+    server_holder["server"] = server
+    signal.signal(signal.SIGTERM, lambda signum, frame: _stop())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        close_upstream_pool()
+        close_log_writer()
@@ -1,15 +1,41 @@
 from __future__ import annotations
 
 import posixpath
+import threading
 import urllib.parse
-from typing import Dict, Tuple, Any
+from time import perf_counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import httpx
 from flask import Flask, request, Response, make_response
 
 from .config import settings
-from .logger import append_log, new_request_id, utc_now_iso, time_ms
-from .scoring import compute_score, severity_from_score
+from .fields import RequestFields
+from .compress import accepts_encoding, compress_body, compress_chunks, negotiate_encoding
+from .access_lists import (
+    DENY_BODY,
+    DENY_HEADERS,
+    access_lists_stats,
+    admin_client,
+    check_client,
+    denial_event,
+    init_access_lists,
+    note_block,
+    should_log_denial,
+)
+from .inspection import StreamingInspector
+from .response_cache import CacheLookup, get_response_cache, read_limited, response_cache_stats
+from .rewrite import RewriteContext, backend_url, rewrite_context
+from .ip_tracker import ClientVerdict, get_ip_tracker, ip_tracker_stats, retry_after_header
+from .logger import append_log, log_writer_stats, new_request_id, utc_now_iso, time_ms
+from .metrics import PROMETHEUS_CONTENT_TYPE, get_metrics
+from .redos import start_budget
+from .rulepack import init_rule_pack, rule_pack_status
+from .scoring import analysis_text, compute_field_score, compute_score, severity_from_score
+from .ruleset import rules_version, verify_stats
+from .timing import StageTimer, current_timer, start_timer
+from .verdict_cache import verdict_cache_stats
+from .upstream import get_upstream_pool, upstream_pool_stats
 
 
 def _build_target_url(incoming_path: str, incoming_query: str) -> str:
@@ -18,9 +44,8 @@ def _build_target_url(incoming_path: str, incoming_query: str) -> str:
     client appelle déjà un chemin qui commence par cette base, on n'ajoute pas
     le préfixe une deuxième fois.
     """
-    base = settings.backend_base_url
-    parts = urllib.parse.urlparse(base)
-    base_path = parts.path or "/"
+    backend = backend_url(settings.backend_base_url)  # analysée une fois par processus
+    base_path = backend.path
 
     # Normaliser
     inc_path = incoming_path or "/"
@@ -35,40 +60,157 @@ def _build_target_url(incoming_path: str, incoming_query: str) -> str:
     else:
         joined_path = "/" + inc_path.lstrip("/")
 
-    new_parts = parts._replace(path=joined_path, query=incoming_query)
-    return urllib.parse.urlunparse(new_parts)
+    return urllib.parse.urlunparse(
+        (backend.scheme, backend.netloc, joined_path, backend.params, incoming_query, backend.fragment)
+    )
 
 
-def _collect_text_for_analysis() -> str:
+def _collect_text_for_analysis(include_body: bool = True) -> str:
     # path + query + body + selected headers
     path = request.path or "/"
     qs = request.query_string.decode("utf-8", errors="ignore")
-    try:
-        body_text = request.get_data(cache=True, as_text=True)
-    except Exception:
-        body_text = ""
+    body_text = ""
+    if include_body:
+        try:
+            body_text = request.get_data(cache=True, as_text=True)
+        except Exception:
+            body_text = ""
     ua = request.headers.get("User-Agent", "")
     referer = request.headers.get("Referer", "")
     cookie = request.headers.get("Cookie", "")
-    return "\n".join([path, qs, body_text or "", ua, referer, cookie])
+    return analysis_text(path, qs, body_text, ua, referer, cookie)
 
 
-def _filtered_request_headers(target_url: str) -> Dict[str, str]:
-    # Filter hop-by-hop headers and set Host of backend
-    hop_by_hop = {
-        "connection",
-        "keep-alive",
-        "proxy-authenticate",
-        "proxy-authorization",
-        "te",
-        "trailers",
-        "transfer-encoding",
-        "upgrade",
+def _request_fields(include_body: bool = True) -> RequestFields:
+    # Mêmes éléments que _collect_text_for_analysis, découpés en champs
+    body_text = ""
+    if include_body:
+        try:
+            body_text = request.get_data(cache=True, as_text=True)
+        except Exception:
+            body_text = ""
+    return RequestFields(
+        request.path or "/",
+        request.query_string.decode("utf-8", errors="ignore"),
+        body_text,
+        request.headers.get("User-Agent", ""),
+        request.headers.get("Referer", ""),
+        request.headers.get("Cookie", ""),
+        request.headers.get("Content-Type", ""),
+    )
+
+
+def _fields_info(matched_fields: Dict[str, str]) -> Dict[str, Any]:
+    """Champ ayant déclenché chaque règle (mode "fields" uniquement)."""
+    return {"matched_fields": matched_fields} if matched_fields else {}
+
+
+def _log_with_timings(event: Dict[str, Any], timer: StageTimer) -> None:
+    """Journaliser l'événement avec ses durées par étape (et le profil échantillonné).
+    La durée de l'étape `log` elle-même n'apparaît que dans Server-Timing.
+    """
+    event.setdefault("rules_version", rules_version())
+    tracker = get_ip_tracker()
+    if tracker is not None:
+        # Score de la requête ajouté au score cumulé de son IP
+        tracker.record(event["source_ip"], event["score"])
+    if event["action"] == "BLOCK":
+        note_block(event["source_ip"])
+    event["timings"] = timer.as_dict()
+    event.update(timer.details)
+    t0 = perf_counter()
+    append_log(event)
+    timer.mark("log", t0)
+
+
+def _server_timing_headers(timer: Optional[StageTimer]) -> Dict[str, str]:
+    if timer is None or not settings.server_timing:
+        return {}
+    return {"Server-Timing": timer.server_timing()}
+
+
+def _client_info(client: ClientVerdict) -> Dict[str, Any]:
+    """Champ `client` des événements: score cumulé de l'IP et dépassements."""
+    info: Dict[str, Any] = {"ip_score": round(client.score, 2)}
+    if client.limited:
+        info["rate_limited"] = True
+    if client.over_threshold(settings.threshold_block):
+        info["ip_score_exceeded"] = True
+    return info
+
+
+def _client_gate(client: ClientVerdict, mode: str) -> Optional[Tuple[str, int]]:
+    """(action, statut) si la requête est refusée avant toute analyse (mode IPS).
+    `mode` est le mode configuré: le client ne doit pas pouvoir lever ce refus
+    avec `?waf_mode=IDS`.
+    """
+    if mode != "IPS":
+        return None
+    if client.over_threshold(settings.threshold_block):
+        return "BLOCK", 403
+    if client.limited:
+        return "RATE_LIMIT", 429
+    return None
+
+
+def _client_rejection(action: str, client: ClientVerdict, rid: str) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """Corps et en-têtes de la réponse courte d'une IP refusée."""
+    headers = _waf_headers(0, "none", action, rid)
+    if action == "RATE_LIMIT":
+        headers["Retry-After"] = retry_after_header(client.retry_after)
+        return {"error": "Too Many Requests", "action": action, "request_id": rid}, headers
+    body = {
+        "error": "Blocked by WAF",
+        "action": action,
+        "reason": "ip_score",
+        "ip_score": round(client.score, 2),
+        "request_id": rid,
     }
+    return body, headers
+
+
+def _has_request_body() -> bool:
+    if request.content_length:
+        return True
+    return "chunked" in request.headers.get("Transfer-Encoding", "").lower()
+
+
+def _waf_headers(score: int, severity: str, action: str, rid: str) -> Dict[str, str]:
+    return {
+        "X-WAF-Score": str(score),
+        "X-WAF-Severity": severity,
+        "X-WAF-Action": action,
+        "X-Request-ID": rid,
+    }
+
+
+_HOP_BY_HOP = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailers",
+    "transfer-encoding",
+    "upgrade",
+}
+
+# En-têtes de réponse amont non recopiés (hop-by-hop + longueur/encodage recalculés)
+_EXCLUDED_RESPONSE_HEADERS = _HOP_BY_HOP | {"content-length", "content-encoding"}
+
+
+def _upstream_request_headers(
+    items: Iterable[Tuple[str, str]],
+    target_url: str,
+    remote_addr: str,
+    scheme: str,
+    waf_host: str,
+) -> Dict[str, str]:
+    # Filter hop-by-hop headers and set Host of backend
     headers: Dict[str, str] = {}
-    for k, v in request.headers.items():
+    for k, v in items:
         lk = k.lower()
-        if lk in hop_by_hop:
+        if lk in _HOP_BY_HOP:
             continue
         if lk == "host":
             continue
@@ -77,103 +219,216 @@ def _filtered_request_headers(target_url: str) -> Dict[str, str]:
     host = urllib.parse.urlparse(target_url).netloc
     headers["Host"] = host
     # Add X-Forwarded-* headers
-    headers.setdefault("X-Forwarded-For", request.remote_addr or "unknown")
-    headers.setdefault("X-Forwarded-Proto", request.scheme)
-    headers.setdefault("X-Forwarded-Host", request.host)
+    headers.setdefault("X-Forwarded-For", remote_addr or "unknown")
+    headers.setdefault("X-Forwarded-Proto", scheme)
+    headers.setdefault("X-Forwarded-Host", waf_host)
     return headers
 
 
-def _filtered_response(resp: httpx.Response, waf_headers: Dict[str, str]) -> Response:
-    # Build Flask response with filtered headers (strip hop-by-hop and content-length)
-    excluded = {
-        "content-length",
-        "content-encoding",
-        "transfer-encoding",
-        "connection",
-        "keep-alive",
-        "proxy-authenticate",
-        "proxy-authorization",
-        "te",
-        "trailers",
-        "upgrade",
-    }
+# Préconditions du client retirées d'une requête de revalidation du microcache
+_CONDITIONAL_HEADERS = {"if-match", "if-none-match", "if-modified-since", "if-unmodified-since", "if-range"}
+
+
+def _revalidation_headers(headers: Dict[str, str], validators: Dict[str, str]) -> Dict[str, str]:
+    kept = {k: v for k, v in headers.items() if k.lower() not in _CONDITIONAL_HEADERS}
+    return {**kept, **validators}
+
+
+def _revalidate(lookup: CacheLookup, target_url: str, headers: Dict[str, str]) -> None:
+    """Revalider une entrée périmée du microcache dans un thread (déjà servie au client)."""
+    cache = get_response_cache()
+    if cache is None:
+        return
+
+    def run() -> None:
+        try:
+            resp = get_upstream_pool().request("GET", target_url, headers=headers, stream=True)
+            try:
+                body = read_limited(resp.iter_raw(), cache.max_entry)
+            finally:
+                resp.close()
+            cache.revalidated(lookup, resp.status_code, list(resp.headers.raw), body)
+        except Exception:
+            cache.revalidated(lookup, 0, None, None)
+
+    threading.Thread(target=run, name="waf-cache-revalidate", daemon=True).start()
+
+
+def _filtered_request_headers(target_url: str) -> Dict[str, str]:
+    return _upstream_request_headers(
+        request.headers.items(), target_url, request.remote_addr or "unknown", request.scheme, request.host
+    )
+
+
+def _rewrites_body(resp: httpx.Response) -> bool:
     # On peut être amené à réécrire le corps (HTML) pour garder le client derrière le WAF.
-    will_rewrite_body = False
     content_type = resp.headers.get("Content-Type", "")
-    if "text/html" in content_type or "text/css" in content_type:
-        will_rewrite_body = True
+    return "text/html" in content_type or "text/css" in content_type
+
+
+def _rewrite_context(waf_scheme: str, waf_host: str) -> RewriteContext:
+    return rewrite_context(settings.backend_base_url, waf_scheme, waf_host)
+
+
+def _buffered_response(resp: httpx.Response) -> bool:
+    """Lire le corps d'un bloc ? Oui si le streaming est désactivé ou pour un
+    corps court de longueur connue (envoyé avec son Content-Length exact).
+    """
+    if not settings.response_streaming:
+        return True
+    length = resp.headers.get("Content-Length", "")
+    return length.isdigit() and int(length) <= settings.response_chunk_size
+
+
+def _passthrough(resp: httpx.Response, accept_encoding: str) -> bool:
+    """Corps compressé amont relayé tel quel ? Oui s'il n'est pas réécrit et que
+    le client accepte son codage (sinon httpx le décompresse).
+    """
+    coding = resp.headers.get("Content-Encoding", "")
+    if not coding or coding.strip().lower() == "identity" or _rewrites_body(resp):
+        return False
+    return accepts_encoding(accept_encoding, coding)
+
 
+def _response_coding(resp: httpx.Response, method: str, accept_encoding: str, size: Optional[int]) -> Optional[str]:
+    """Codage de recompression d'un corps réécrit (None: envoyé non compressé).
+    `size` est la taille du corps si elle est connue.
+    """
+    if not settings.response_compression or method == "HEAD":
+        return None
+    if resp.status_code < 200 or resp.status_code in (204, 304):
+        return None
+    if size is not None and size < settings.response_compression_min_size:
+        return None
+    return negotiate_encoding(accept_encoding)
+
+
+def _add_coding_headers(headers: List[Tuple[str, str]], coding: str) -> None:
+    headers.append(("Content-Encoding", coding))
+    # Le corps dépend désormais de l'Accept-Encoding du client (caches)
+    for i, (k, v) in enumerate(headers):
+        if k.lower() == "vary":
+            if v.strip() != "*" and "accept-encoding" not in v.lower():
+                headers[i] = (k, f"{v}, Accept-Encoding")
+            return
+    headers.append(("Vary", "Accept-Encoding"))
+
+
+def _streamed_response_headers(
+    resp: httpx.Response, ctx: RewriteContext, method: str, accept_encoding: str
+) -> Tuple[List[Tuple[str, str]], bool, Optional[str]]:
+    """En-têtes d'une réponse relayée en flux.
+    Retourne (headers, passthrough, coding): `passthrough` = octets amont
+    bruts (`iter_raw`), `coding` = recompression du corps réécrit.
+    """
+    headers = _rewrite_response_headers(resp, ctx)
+    if _passthrough(resp, accept_encoding):
+        headers.append(("Content-Encoding", resp.headers["Content-Encoding"]))
+        length = resp.headers.get("Content-Length", "")
+        if length.isdigit():
+            headers.append(("Content-Length", length))
+        return headers, True, None
+    coding = None
+    if _rewrites_body(resp):
+        # Longueur amont = taille du corps seulement s'il n'est pas compressé
+        length = resp.headers.get("Content-Length", "")
+        size = int(length) if length.isdigit() and not resp.headers.get("Content-Encoding") else None
+        coding = _response_coding(resp, method, accept_encoding, size)
+        if coding is not None:
+            _add_coding_headers(headers, coding)
+    return headers, False, coding
+
+
+def _stream_body(chunks: Iterator[bytes], resp: httpx.Response) -> Iterator[bytes]:
+    try:
+        yield from chunks
+    finally:
+        resp.close()
+
+
+def _rewrite_upstream_response(
+    resp: httpx.Response, waf_scheme: str, waf_host: str, method: str = "GET", accept_encoding: str = ""
+) -> Tuple[bytes, List[Tuple[str, str]], bool]:
+    """Réécrire corps et en-têtes amont pour garder le client derrière le WAF,
+    puis recompresser le corps réécrit selon `accept_encoding`.
+    Retourne (body_bytes, headers, body_rewritten); indépendant du framework.
+    Le corps doit avoir été lu (`resp.read()`, décompressé par httpx).
+    """
+    ctx = _rewrite_context(waf_scheme, waf_host)
+    will_rewrite_body = _rewrites_body(resp)
     body_bytes = resp.content
     if will_rewrite_body:
         try:
-            backend_parts = urllib.parse.urlparse(settings.backend_base_url)
-            backend_origin = f"{backend_parts.scheme}://{backend_parts.netloc}"
-            waf_origin = f"{request.scheme}://{request.host}"
-            txt = resp.text  # utilise l'encodage détecté par httpx
-            # Réécrit les URLs absolues et schéma-relatives vers le backend
-            txt = txt.replace(backend_origin, waf_origin)
-            txt = txt.replace(f"//{backend_parts.netloc}", f"//{request.host}")
-            # Ré-encode en conservant l'encodage amont si possible
-            enc = resp.encoding or "utf-8"
-            body_bytes = txt.encode(enc, errors="replace")
+            # Encodage annoncé par l'amont (défaut httpx: utf-8), conservé en sortie
+            body_bytes = ctx.rewrite_body(body_bytes, resp.encoding or "utf-8")
         except Exception:
             # En cas de problème, on renvoie le corps original
             body_bytes = resp.content
+    headers = _rewrite_response_headers(resp, ctx)
+    if will_rewrite_body:
+        coding = _response_coding(resp, method, accept_encoding, len(body_bytes))
+        if coding is not None:
+            body_bytes = compress_body(body_bytes, coding, settings.response_compression_level)
+            _add_coding_headers(headers, coding)
+    return body_bytes, headers, will_rewrite_body
+
 
-    response = make_response(body_bytes, resp.status_code)
+def _rewrite_response_headers(resp: httpx.Response, ctx: RewriteContext) -> List[Tuple[str, str]]:
+    headers: List[Tuple[str, str]] = []
     # Copie des en-têtes retour amont (sauf hop-by-hop)
     for k, v in resp.headers.items():
         lk = k.lower()
-        if lk in excluded:
+        if lk in _EXCLUDED_RESPONSE_HEADERS:
             continue
         # Réécriture éventuelle du Domain des cookies pour rester sur l'hôte du WAF
         if lk == "set-cookie":
-            try:
-                backend_parts = urllib.parse.urlparse(settings.backend_base_url)
-                backend_host = backend_parts.hostname or ""
-                waf_host_only = request.host.split(":")[0]
-                if backend_host and backend_host in v:
-                    v = v.replace(f"Domain={backend_host}", f"Domain={waf_host_only}")
-            except Exception:
-                pass
+            v = ctx.rewrite_set_cookie(v)
+        # Réécriture éventuelle de Location pour éviter de sortir du WAF
+        elif lk == "location":
+            v = ctx.rewrite_location(v)
+        headers.append((k, v))
+    return headers
+
+
+def _filtered_response(resp: httpx.Response, waf_headers: Dict[str, str]) -> Response:
+    # Build Flask response with filtered headers (strip hop-by-hop and content-length)
+    will_rewrite_body = False
+    accept_encoding = request.headers.get("Accept-Encoding", "")
+    if _buffered_response(resp) and not _passthrough(resp, accept_encoding):
+        try:
+            resp.read()
+        finally:
+            resp.close()
+        body_bytes, headers, will_rewrite_body = _rewrite_upstream_response(
+            resp, request.scheme, request.host, request.method, accept_encoding
+        )
+        response = make_response(body_bytes, resp.status_code)
+    else:
+        # Relais en flux: le corps n'est jamais entièrement en mémoire
+        ctx = _rewrite_context(request.scheme, request.host)
+        headers, passthrough, coding = _streamed_response_headers(resp, ctx, request.method, accept_encoding)
+        chunks: Iterator[bytes]
+        if passthrough:
+            # Octets compressés amont relayés sans décompression
+            chunks = resp.iter_raw(settings.response_chunk_size)
+        else:
+            chunks = resp.iter_bytes(settings.response_chunk_size)
+            if _rewrites_body(resp):
+                chunks = ctx.rewrite_chunks(chunks, resp.encoding or "utf-8")
+                if coding is not None:
+                    chunks = compress_chunks(chunks, coding, settings.response_compression_level)
+        response = Response(_stream_body(chunks, resp), resp.status_code)
+        # Client parti avant le premier morceau: le générateur n'a jamais démarré
+        response.call_on_close(resp.close)
+    for k, v in headers:
         # Préserver les multiples Set-Cookie en utilisant add()
-        if lk == "set-cookie":
+        if k.lower() == "set-cookie":
             response.headers.add(k, v)
         else:
             response.headers[k] = v
 
-    # Réécriture éventuelle de Location pour éviter de sortir du WAF
-    loc = resp.headers.get("Location")
-    if loc:
-        try:
-            backend_parts = urllib.parse.urlparse(settings.backend_base_url)
-            target = urllib.parse.urlparse(loc)
-            # Si Location est absolue et pointe vers l'hôte backend (avec ou sans port par défaut), on réécrit
-            if target.scheme and target.netloc:
-                backend_host = backend_parts.hostname or ""
-                backend_netlocs = {backend_parts.netloc, backend_host}
-                # Ajouter netloc avec port par défaut selon le schéma
-                if backend_parts.scheme in ("http", "https") and backend_host:
-                    default_port = 80 if backend_parts.scheme == "http" else 443
-                    backend_netlocs.add(f"{backend_host}:{default_port}")
-                if target.netloc in backend_netlocs:
-                    # Conserver le chemin/query de la Location, remplacer schéma/hôte par ceux du WAF
-                    new_loc = urllib.parse.urlunparse(
-                        (
-                            request.scheme,
-                            request.host,  # inclut le port du WAF
-                            target.path,
-                            target.params,
-                            target.query,
-                            target.fragment,
-                        )
-                    )
-                    response.headers["Location"] = new_loc
-        except Exception:
-            # En cas de doute, on laisse Location telle quelle
-            pass
-
-    # Ajuster Content-Length si nous avons réécrit le corps (sinon laisser Werkzeug calculer)
+    # Ajuster Content-Length si nous avons réécrit le corps (sinon laisser Werkzeug
+    # calculer; en flux: longueur amont si relais brut, sinon transfert par morceaux)
     if will_rewrite_body:
         try:
             response.headers["Content-Length"] = str(len(body_bytes))
@@ -186,12 +441,34 @@ def _filtered_response(resp: httpx.Response, waf_headers: Dict[str, str]) -> Res
     return response
 
 
+# Métriques du processus (avec plusieurs workers: celles du worker qui répond)
+ADMIN_METRICS_PATHS = ("/metrics", "/metrics/summary")
+
+
 def create_app() -> Flask:
     app = Flask(__name__)
+    # Pack de règles externe éventuel (rechargé à chaud); règles à risque signalées
+    init_rule_pack()
+    init_access_lists()
 
     @app.route("/healthz", methods=["GET"])  # simple health endpoint
     def healthz():
-        return {"status": "ok", "mode": settings.mode}
+        status = {"status": "ok", "mode": settings.mode}
+        # Détails internes réservés aux adresses d'administration
+        if not admin_client(request.remote_addr or ""):
+            return status
+        return {
+            **status,
+            "engine": "wsgi",
+            "rule_engine": {"engine": settings.rule_engine, **verify_stats()},
+            "rule_pack": rule_pack_status(),
+            "upstream_pool": upstream_pool_stats(),
+            "log_writer": log_writer_stats(),
+            "verdict_cache": verdict_cache_stats(),
+            "ip_tracker": ip_tracker_stats(),
+            "access_lists": access_lists_stats(),
+            "response_cache": response_cache_stats(),
+        }
 
     @app.route("/", defaults={"path": ""}, methods=[
         "GET", "POST", "PUT", "DELETE", "PATCH", "HEAD", "OPTIONS"
@@ -200,9 +477,27 @@ def create_app() -> Flask:
         "GET", "POST", "PUT", "DELETE", "PATCH", "HEAD", "OPTIONS"
     ])
     def proxy(path: str):  # type: ignore[override]
+        source_ip = request.remote_addr or "unknown"
+        # Listes d'accès: refus immédiat, sans analyse ni événement complet
+        denied = check_client(source_ip, request.headers.get("User-Agent", ""))
+        if denied is not None:
+            if should_log_denial():
+                append_log(denial_event(
+                    denied, source_ip, request.method, request.url, request.headers.get("User-Agent", "")
+                ))
+            return Response(DENY_BODY, 403, headers=list(DENY_HEADERS))
+
+        # Agrégats de ce processus, pour les adresses d'administration seulement
+        # (pour les autres clients, ces chemins sont relayés au backend)
+        if request.method == "GET" and request.path in ADMIN_METRICS_PATHS and admin_client(source_ip):
+            if request.path == "/metrics":
+                return Response(get_metrics().prometheus(), content_type=PROMETHEUS_CONTENT_TYPE)
+            return get_metrics().summary()
+
         started = time_ms()
+        timer = start_timer()
+        start_budget()
         rid = new_request_id()
-        source_ip = request.remote_addr or "unknown"
         method = request.method
 
         # Allow mode override via query param for demo if enabled
@@ -212,13 +507,76 @@ def create_app() -> Flask:
             if qmode and qmode.upper() in {"IDS", "IPS"}:
                 mode = qmode.upper()
 
+        # Suivi par IP, avant toute lecture du corps ou analyse
+        tracker = get_ip_tracker()
+        if tracker is not None:
+            client = tracker.check(source_ip)
+            timer.details["client"] = _client_info(client)
+            gate = _client_gate(client, settings.mode)
+            if gate is not None:
+                action, status = gate
+                if action == "BLOCK":
+                    tracker.count_blocked()
+                _log_with_timings({
+                    "timestamp": utc_now_iso(),
+                    "request_id": rid,
+                    "source_ip": source_ip,
+                    "method": method,
+                    "url": request.url,
+                    "backend_url": _build_target_url(path, request.query_string.decode("utf-8", errors="ignore")),
+                    "score": 0,
+                    "severity": "none",
+                    "matched_rules": [],
+                    "flags": {},
+                    "action": action,
+                    "status": status,
+                    "user_agent": request.headers.get("User-Agent", ""),
+                    "response_time_ms": time_ms() - started,
+                }, timer)
+                body, headers = _client_rejection(action, client, rid)
+                resp = make_response(body, status)
+                for k, v in {**headers, **_server_timing_headers(timer)}.items():
+                    resp.headers[k] = v
+                return resp
+
         # Compute score (robuste: aucune exception ne doit casser la requête)
+        inspector = None
+        fields_mode = settings.inspection_mode == "fields"
+        matched_fields: Dict[str, str] = {}
         try:
-            text = _collect_text_for_analysis()
-            score, matched_rules, flags = compute_score(text)
+            if settings.body_inspection == "stream" and _has_request_body():
+                # Le corps sera analysé pendant son envoi vers l'amont
+                t0 = perf_counter()
+                head: Any = (
+                    _request_fields(include_body=False) if fields_mode
+                    else _collect_text_for_analysis(include_body=False)
+                )
+                timer.mark("collect", t0)
+                inspector = StreamingInspector(
+                    head,
+                    max_bytes=settings.body_inspect_max_bytes,
+                    overlap=settings.body_inspect_overlap,
+                    block_threshold=settings.threshold_block if mode == "IPS" else None,
+                )
+                score, matched_rules, flags = inspector.verdict()
+                matched_fields = inspector.matched_fields
+                # Pour l'errorhandler: le flux du corps ne pourra pas être relu
+                request.environ["waf.inspector"] = inspector
+            elif fields_mode:
+                t0 = perf_counter()
+                fields = _request_fields()
+                timer.mark("collect", t0)
+                score, matched_rules, flags, matched_fields = compute_field_score(fields)
+            else:
+                t0 = perf_counter()
+                text = _collect_text_for_analysis()
+                timer.mark("collect", t0)
+                score, matched_rules, flags = compute_score(text)
         except Exception as e:
             # En cas d'erreur d'analyse, on marque score=0 mais on continue et on loguera l'erreur
+            inspector = None
             score, matched_rules, flags = 0, [], {"analysis_error": True}
+            matched_fields = {}
         severity = severity_from_score(score)
 
         # Action resolution
@@ -229,16 +587,11 @@ def create_app() -> Flask:
         duration_ms = None
         status_code = 403 if action == "BLOCK" else None
         target_url = _build_target_url(path, request.query_string.decode("utf-8", errors="ignore"))
-        waf_hdrs = {
-            "X-WAF-Score": str(score),
-            "X-WAF-Severity": severity,
-            "X-WAF-Action": action,
-            "X-Request-ID": rid,
-        }
+        waf_hdrs = _waf_headers(score, severity, action, rid)
 
-        if action == "BLOCK":
+        def _blocked(score: int, severity: str, matched_rules: List[str], flags: Dict[str, bool]) -> Response:
             duration_ms = time_ms() - started
-            append_log({
+            _log_with_timings({
                 "timestamp": utc_now_iso(),
                 "request_id": rid,
                 "source_ip": source_ip,
@@ -248,34 +601,68 @@ def create_app() -> Flask:
                 "score": score,
                 "severity": severity,
                 "matched_rules": matched_rules,
+                **_fields_info(matched_fields),
                 "flags": flags,
-                "action": action,
+                "action": "BLOCK",
                 "status": 403,
                 "user_agent": request.headers.get("User-Agent", ""),
                 "response_time_ms": duration_ms,
-            })
+            }, timer)
             body = {
                 "error": "Blocked by WAF",
-                "action": action,
+                "action": "BLOCK",
                 "score": score,
                 "severity": severity,
                 "rules": matched_rules,
                 "request_id": rid,
             }
             resp = make_response(body, 403)
-            for k, v in waf_hdrs.items():
+            for k, v in {**_waf_headers(score, severity, "BLOCK", rid), **_server_timing_headers(timer)}.items():
                 resp.headers[k] = v
             return resp
 
+        if action == "BLOCK":
+            return _blocked(score, severity, matched_rules, flags)
+
+        # Microcache des réponses amont (requête analysée et journalisée comme les autres)
+        cache = get_response_cache()
+        cached = None
+        if cache is not None and inspector is None:
+            cached = cache.lookup(method, target_url, request.headers.get, _has_request_body())
+
         # Forward to backend
         try:
-            req_body = request.get_data(cache=True)  # bytes
+            if inspector is not None:
+                # Relais morceau par morceau, analysé au passage (mémoire bornée)
+                req_body = inspector.iter_body(request.stream, settings.body_chunk_size)
+            else:
+                req_body = request.get_data(cache=True)  # bytes
             headers = _filtered_request_headers(target_url)
-            with httpx.Client(follow_redirects=False, timeout=15.0, verify=False) as client:
-                upstream_resp = client.request(method, target_url, headers=headers, content=req_body)
+            if cached is not None and cached.response is not None:
+                upstream_resp = cached.response
+                flags = {**flags, "cache_hit": True}
+                if cached.revalidate is not None:
+                    _revalidate(cached, target_url, _revalidation_headers(headers, cached.revalidate))
+            else:
+                t0 = perf_counter()
+                try:
+                    upstream_resp = get_upstream_pool().request(
+                        method, target_url, headers=headers, content=req_body, stream=True
+                    )
+                finally:
+                    timer.mark("upstream", t0)
+                if cache is not None and cached is not None:
+                    # Réponse mémorisée pendant son relais si elle est cacheable
+                    upstream_resp = cache.tee(cached, upstream_resp, request.headers.get)
         except Exception as e:  # Capture toute erreur (httpx, encodage, etc.)
+            if inspector is not None:
+                score, matched_rules, flags = inspector.verdict()
+                severity = severity_from_score(score)
+                if inspector.blocked:
+                    return _blocked(score, severity, matched_rules, flags)
+                waf_hdrs = _waf_headers(score, severity, action, rid)
             duration_ms = time_ms() - started
-            append_log({
+            _log_with_timings({
                 "timestamp": utc_now_iso(),
                 "request_id": rid,
                 "source_ip": source_ip,
@@ -285,23 +672,32 @@ def create_app() -> Flask:
                 "score": score,
                 "severity": severity,
                 "matched_rules": matched_rules,
+                **_fields_info(matched_fields),
                 "flags": {**(flags or {}), "proxy_error": True},
                 "action": "ERROR",
                 "status": 502,
                 "error": str(e),
                 "user_agent": request.headers.get("User-Agent", ""),
                 "response_time_ms": duration_ms,
-            })
+            }, timer)
             resp = make_response({"error": "Bad Gateway", "details": str(e)}, 502)
-            for k, v in waf_hdrs.items():
+            for k, v in {**waf_hdrs, **_server_timing_headers(timer)}.items():
                 resp.headers[k] = v
             return resp
 
+        if inspector is not None:
+            # Verdict final (en-têtes + corps inspecté)
+            score, matched_rules, flags = inspector.verdict()
+            severity = severity_from_score(score)
+            waf_hdrs = _waf_headers(score, severity, action, rid)
+
         duration_ms = time_ms() - started
+        t0 = perf_counter()
         response = _filtered_response(upstream_resp, waf_hdrs)
+        timer.mark("rewrite", t0)
 
         # Log event
-        append_log({
+        _log_with_timings({
             "timestamp": utc_now_iso(),
             "request_id": rid,
             "source_ip": source_ip,
@@ -311,12 +707,15 @@ def create_app() -> Flask:
             "score": score,
             "severity": severity,
             "matched_rules": matched_rules,
+            **_fields_info(matched_fields),
             "flags": flags,
             "action": action,
             "status": upstream_resp.status_code,
             "user_agent": request.headers.get("User-Agent", ""),
             "response_time_ms": duration_ms,
-        })
+        }, timer)
+        for k, v in _server_timing_headers(timer).items():
+            response.headers[k] = v
         return response
 
     return app
@@ -333,22 +732,24 @@ def create_app_with_error_handler() -> Flask:
         # Try to salvage as much context as possible and always log the event
         rid = new_request_id()
         try:
-            text = _collect_text_for_analysis()
-            score, matched_rules, flags = compute_score(text)
+            inspector = request.environ.get("waf.inspector")
+            if inspector is not None:
+                # Corps déjà (en partie) consommé: verdict de l'inspection en flux
+                score, matched_rules, flags = inspector.verdict()
+            else:
+                # En mode "stream", le corps a pu être lu en partie: analyse sans le corps
+                include_body = settings.body_inspection != "stream"
+                text = _collect_text_for_analysis(include_body=include_body)
+                score, matched_rules, flags = compute_score(text)
         except Exception:
             score, matched_rules, flags = 0, [], {"analysis_error": True}
         severity = severity_from_score(score)
-        waf_hdrs = {
-            "X-WAF-Score": str(score),
-            "X-WAF-Severity": severity,
-            "X-WAF-Action": "ERROR",
-            "X-Request-ID": rid,
-        }
+        waf_hdrs = _waf_headers(score, severity, "ERROR", rid)
         try:
             target_url = _build_target_url(request.path or "/", request.query_string.decode("utf-8", errors="ignore"))
         except Exception:
             target_url = ""
-        append_log({
+        event = {
             "timestamp": utc_now_iso(),
             "request_id": rid,
             "source_ip": getattr(request, 'remote_addr', None) or "unknown",
@@ -359,16 +760,22 @@ def create_app_with_error_handler() -> Flask:
             "severity": severity,
             "matched_rules": matched_rules,
             "flags": {**(flags or {}), "unhandled_exception": True},
+            "rules_version": rules_version(),
             "action": "ERROR",
             "status": 500,
             "user_agent": request.headers.get("User-Agent", "") if hasattr(request, 'headers') else "",
             "response_time_ms": None,
-        })
+        }
+        timer = current_timer()
+        if timer is not None:
+            _log_with_timings(event, timer)
+        else:
+            append_log(event)
         resp = make_response({
             "error": "Internal Server Error",
             "request_id": rid,
         }, 500)
-        for k, v in waf_hdrs.items():
+        for k, v in {**waf_hdrs, **_server_timing_headers(timer)}.items():
             resp.headers[k] = v
         return resp
 
@@ -0,0 +1,306 @@
+"""Garde anti-ReDoS: budget d'analyse par requête et détection des motifs à risque.
+
+Le moteur `re` ne peut pas être interrompu au milieu d'une recherche. Le budget
+est donc vérifié avant chaque règle:
+
+- budget de temps (`WAF_ANALYSIS_BUDGET_MS`) pour l'ensemble des règles d'une requête;
+- budget de pas (`WAF_REGEX_STEP_BUDGET`) pour les règles à risque: leur coût de
+  retour arrière est estimé en temps linéaire *avant* d'exécuter la regex, qui
+  n'est pas lancée si l'estimation dépasse ce qui reste du budget.
+
+Une règle à risque dont l'estimation dépasse le budget de pas restant est
+sautée, les autres règles continuent d'être évaluées; le verdict est alors
+toujours "closed" (score au seuil de blocage), car l'estimation dépend
+entièrement du texte envoyé par le client. Une fois le budget de temps épuisé,
+les règles restantes ne sont plus exécutées et le verdict suit
+`WAF_ANALYSIS_TIMEOUT_VERDICT` ("open" par défaut: le budget de temps dépend de
+la charge de l'hôte). Dans les deux cas le flag `analysis_timeout` est positionné.
+
+    python -m waf.redos    # liste des règles à risque
+"""
+from __future__ import annotations
+
+import logging
+import re
+import threading
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from .config import settings
+
+try:  # Python >= 3.11
+    import re._constants as _c  # type: ignore
+    import re._parser as _parser  # type: ignore
+except ImportError:  # pragma: no cover - anciens Python
+    import sre_constants as _c  # type: ignore
+    import sre_parse as _parser  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# Pseudo-règle ajoutée en mode "closed" (ou budget de pas dépassé)
+TIMEOUT_RULE = "ANALYSIS_TIMEOUT"
+
+_REPEATS = (_c.MAX_REPEAT, _c.MIN_REPEAT)
+_CATEGORIES = {
+    _c.CATEGORY_DIGIT: r"\d",
+    _c.CATEGORY_NOT_DIGIT: r"\D",
+    _c.CATEGORY_SPACE: r"\s",
+    _c.CATEGORY_NOT_SPACE: r"\S",
+    _c.CATEGORY_WORD: r"\w",
+    _c.CATEGORY_NOT_WORD: r"\W",
+}
+
+
+class PatternRisk(NamedTuple):
+    """Structure à risque d'un motif.
+
+    kind: "polynomial" (répétition non bornée d'une classe de caractères suivie
+    d'autres éléments, dont les départs possibles se chevauchent) ou
+    "exponential" (répétitions non bornées imbriquées).
+    """
+
+    kind: str
+    detail: str
+    lead: str = ""
+    run: Optional[re.Pattern] = None
+
+    def estimate(self, text: str, limit: int) -> int:
+        """Pas de retour arrière estimés pour `text` (calcul interrompu au-delà de `limit`).
+
+        Chaque départ possible (occurrence du littéral qui précède la répétition)
+        parcourt la suite de caractères de la classe répétée puis revient en
+        arrière sur toute sa longueur: le coût est la somme de ces longueurs.
+        """
+        if self.run is None:
+            return 0  # non estimable (imbrication): seul le budget de temps s'applique
+        steps = 0
+        if not self.lead:
+            # Départ à chaque position: n(n+1)/2 par suite maximale de la classe
+            for m in self.run.finditer(text):
+                n = m.end() - m.start()
+                steps += n * (n + 1) // 2
+                if steps > limit:
+                    break
+            return steps
+        haystack = text.lower() if self.run.flags & re.IGNORECASE else text
+        pos = haystack.find(self.lead)
+        while pos >= 0:
+            start = pos + len(self.lead)
+            m = self.run.match(text, start)
+            steps += (m.end() - start if m else 0) + 1
+            if steps > limit:
+                break
+            pos = haystack.find(self.lead, pos + 1)
+        return steps
+
+
+def _char_class(item: Tuple[Any, Any]) -> Optional[str]:
+    """Source regex d'un élément ne consommant qu'un caractère, sinon None."""
+    op, av = item
+    if op is _c.ANY:
+        return r"[\s\S]"
+    if op is _c.LITERAL:
+        return re.escape(chr(av))
+    if op is _c.NOT_LITERAL:
+        return "[^" + re.escape(chr(av)) + "]"
+    if op is _c.IN:
+        negate = ""
+        parts = []
+        for sub_op, sub_av in av:
+            if sub_op is _c.NEGATE:
+                negate = "^"
+            elif sub_op is _c.LITERAL:
+                parts.append(re.escape(chr(sub_av)))
+            elif sub_op is _c.RANGE:
+                parts.append(re.escape(chr(sub_av[0])) + "-" + re.escape(chr(sub_av[1])))
+            elif sub_op is _c.CATEGORY and sub_av in _CATEGORIES:
+                parts.append(_CATEGORIES[sub_av])
+            else:
+                return None
+        return "[" + negate + "".join(parts) + "]"
+    return None
+
+
+def _has_unbounded(items: Iterable[Tuple[Any, Any]]) -> bool:
+    for op, av in items:
+        if op in _REPEATS and (av[1] == _c.MAXREPEAT or _has_unbounded(av[2])):
+            return True
+        if op is _c.SUBPATTERN and _has_unbounded(av[-1]):
+            return True
+        if op is _c.BRANCH and any(_has_unbounded(branch) for branch in av[1]):
+            return True
+    return False
+
+
+def _nested(items: Iterable[Tuple[Any, Any]]) -> Optional[str]:
+    for op, av in items:
+        if op in _REPEATS:
+            if av[1] == _c.MAXREPEAT and _has_unbounded(av[2]):
+                return "nested unbounded repeats"
+            found = _nested(av[2])
+        elif op is _c.SUBPATTERN:
+            found = _nested(av[-1])
+        elif op is _c.BRANCH:
+            found = next((f for f in (_nested(b) for b in av[1]) if f), None)
+        else:
+            continue
+        if found:
+            return found
+    return None
+
+
+def analyze_pattern(pattern: re.Pattern) -> Optional[PatternRisk]:
+    """Détecter une structure de retour arrière coûteuse dans `pattern` (None si sûr)."""
+    try:
+        parsed = _parser.parse(pattern.pattern, pattern.flags)
+    except Exception:  # pragma: no cover - motif déjà compilé, donc valide
+        return None
+    nested = _nested(parsed)
+    if nested:
+        return PatternRisk("exponential", nested)
+    items = list(parsed)
+    if items and items[0][0] is _c.AT and (
+        items[0][1] is _c.AT_BEGINNING_STRING
+        or (items[0][1] is _c.AT_BEGINNING and not pattern.flags & re.MULTILINE)
+    ):
+        return None  # ancré en début de texte: un seul départ possible
+    for i, (op, av) in enumerate(items):
+        if op not in _REPEATS or av[1] != _c.MAXREPEAT or len(av[2]) != 1:
+            continue
+        cls = _char_class(av[2][0])
+        if cls is None:
+            continue
+        # Rien d'obligatoire après la répétition: pas de retour arrière
+        if _parser.SubPattern(parsed.state, items[i + 1:]).getwidth()[0] == 0:
+            continue
+        lead = ""
+        for prev_op, prev_av in reversed(items[:i]):
+            if prev_op is not _c.LITERAL:
+                break
+            lead = chr(prev_av) + lead
+        run = re.compile(cls + "+" if not lead else cls + "*", pattern.flags & re.IGNORECASE)
+        # Les départs ne se chevauchent que si le littéral peut faire partie de la suite
+        if lead and not run.fullmatch(lead):
+            continue
+        return PatternRisk("polynomial", f"{cls}{'*' if av[0] == 0 else '+'} followed by more items", lead, run)
+    return None
+
+
+_risks: Dict[re.Pattern, Optional[PatternRisk]] = {}
+_risks_lock = threading.Lock()
+
+
+def pattern_risk(pattern: re.Pattern) -> Optional[PatternRisk]:
+    """`analyze_pattern` mémorisé par motif compilé."""
+    try:
+        return _risks[pattern]
+    except KeyError:
+        risk = analyze_pattern(pattern)
+        with _risks_lock:
+            _risks[pattern] = risk
+        return risk
+
+
+def clear_pattern_risks() -> None:
+    """Oublier les analyses mémorisées (motifs d'un pack de règles remplacé)."""
+    with _risks_lock:
+        _risks.clear()
+
+
+def check_rules(patterns: Sequence[Tuple[str, re.Pattern, int]]) -> Dict[str, PatternRisk]:
+    """Règles à risque d'un jeu de règles, signalées dans les logs."""
+    risky = {}
+    for name, pattern, _ in patterns:
+        risk = pattern_risk(pattern)
+        if risk is not None:
+            risky[name] = risk
+            logger.warning("rule %s: %s backtracking risk (%s): %r", name, risk.kind, risk.detail, pattern.pattern)
+    return risky
+
+
+class AnalysisBudget:
+    """Budget d'évaluation des règles d'une requête (temps et pas de retour arrière).
+
+    `exhausted`: budget de temps écoulé, plus aucune règle n'est exécutée.
+    `over_steps`: au moins une règle à risque a été sautée (estimation trop élevée).
+    """
+
+    __slots__ = ("deadline", "steps_left", "exhausted", "over_steps")
+
+    def __init__(self, seconds: float, steps: int) -> None:
+        self.deadline = perf_counter() + seconds if seconds > 0 else None
+        self.steps_left = steps if steps > 0 else None
+        self.exhausted = False
+        self.over_steps = False
+
+    @property
+    def truncated(self) -> bool:
+        """Des règles n'ont pas été exécutées (résultat partiel)."""
+        return self.exhausted or self.over_steps
+
+    def allow(self, pattern: re.Pattern, text: str) -> bool:
+        """Peut-on exécuter `pattern` sur `text` ? Sinon la règle est sautée
+        (les suivantes peuvent encore l'être, sauf budget de temps écoulé).
+        """
+        if self.exhausted:
+            return False
+        if self.deadline is not None and perf_counter() > self.deadline:
+            self.exhausted = True
+            return False
+        if self.steps_left is not None:
+            risk = pattern_risk(pattern)
+            if risk is not None:
+                steps = risk.estimate(text, self.steps_left)
+                if steps > self.steps_left:
+                    self.over_steps = True
+                    return False
+                self.steps_left -= steps
+        return True
+
+
+_current: ContextVar[Optional[AnalysisBudget]] = ContextVar("waf_analysis_budget", default=None)
+
+
+def new_budget() -> AnalysisBudget:
+    return AnalysisBudget(settings.analysis_budget_ms / 1000.0, settings.regex_step_budget)
+
+
+def start_budget() -> AnalysisBudget:
+    """Nouveau budget pour la requête courante (thread ou tâche asyncio)."""
+    budget = new_budget()
+    _current.set(budget)
+    return budget
+
+
+def current_budget() -> AnalysisBudget:
+    """Budget de la requête courante, ou un budget neuf hors requête."""
+    return _current.get() or new_budget()
+
+
+def apply_timeout(budget: AnalysisBudget, matches: List[Tuple[str, int]], flags: Dict[str, bool]) -> None:
+    """Flag `analysis_timeout` et, en mode "closed" ou si une règle a été sautée
+    faute de pas, score au seuil de blocage.
+    """
+    if not budget.truncated:
+        return
+    flags["analysis_timeout"] = True
+    closed = budget.over_steps or settings.analysis_timeout_verdict == "closed"
+    if closed and all(name != TIMEOUT_RULE for name, _ in matches):
+        matches.append((TIMEOUT_RULE, settings.threshold_block))
+
+
+def main() -> None:
+    from .rules import ALL_PATTERNS, FIELD_PATTERNS
+
+    patterns = list(ALL_PATTERNS) + [(f"{name} (fields)", p, 0) for name, p in FIELD_PATTERNS.items()]
+    risky = {name: pattern_risk(p) for name, p, _ in patterns}
+    for name, risk in risky.items():
+        if risk is not None:
+            print(f"{name:<36} {risk.kind:<12} {risk.detail}")
+    if not any(risky.values()):
+        print("aucune règle à risque")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,490 @@
+"""Rejeu hors ligne d'un corpus de requêtes: scoring sans trafic amont.
+
+    python -m waf.replay data/logs.json access.log.gz dump.http \\
+        [--threshold 9] [--compare-rules new.json] [--compare-threshold 12] [-o report.json]
+
+Formats d'entrée (détectés sur la première ligne, ou `--format`):
+
+- `jsonl`: événements au format de `logs.json` (`url`, `user_agent`, et si
+  présents `body`, `referer`, `cookie`);
+- `binary`: les mêmes événements au format binaire du journal (`waf/binlog.py`);
+- `http`: requêtes HTTP brutes concaténées (ligne de requête, en-têtes,
+  corps selon `Content-Length` ou `chunked`);
+- `access`: logs d'accès Apache/Nginx (format "combined" ou "common").
+
+Chaque requête est reconstituée en texte d'analyse comme dans le proxy, puis
+évaluée comme `compute_score` (normalisation, règles sous budget de pas,
+score) contre une configuration (pack de règles, seuil de blocage) et,
+optionnellement, une seconde pour comparer les verdicts. Les entrées sont lues
+en flux et réparties par lots entre processus, avec un nombre borné de lots en
+cours: la mémoire ne dépend pas de la taille du corpus. Le budget de temps du
+proxy n'est pas appliqué: seul le budget de pas borne l'analyse, pour que les
+verdicts ne dépendent ni de la charge de la machine ni de `-j`.
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import os
+import re
+import sys
+import time
+import urllib.parse
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from .binlog import MAGIC, iter_stream
+from .config import settings
+from .redos import TIMEOUT_RULE, AnalysisBudget, apply_timeout
+from .rotation import open_segment
+from .rulepack import RulePackError, load_rule_pack
+from .rules import normalize_payload
+from .ruleset import CompiledRuleSet, RulePack, builtin_rule_pack
+from .scoring import analysis_text, score_from_matches
+
+FORMATS = ("jsonl", "binary", "http", "access")
+
+# Lot envoyé à un processus: nombre de requêtes et taille cumulée (caractères) maximales
+_CHUNK_MAX_CHARS = 4 * 1024 * 1024
+_REQUEST_LINE = re.compile(rb"^[A-Z]+ \S+ HTTP/\d(?:\.\d)?\r?\n?$")
+_ACCESS_LINE = re.compile(
+    r'^\S+ \S+ \S+ \[[^\]]*\] "(?P<method>[A-Z]+) (?P<target>\S+)(?: [^"]*)?" \d{3} \S+'
+    r'(?: "(?P<referer>(?:[^"\\]|\\.)*)" "(?P<ua>(?:[^"\\]|\\.)*)")?'
+)
+
+
+# --- lecture des corpus ------------------------------------------------------------
+
+
+def _target_text(target: str, body: str, ua: str, referer: str, cookie: str) -> str:
+    """Texte d'analyse d'une cible (URL absolue ou chemin + query), comme le proxy."""
+    parts = urllib.parse.urlsplit(target)
+    # Le proxy analyse le chemin décodé (request.path) et la query brute
+    path = urllib.parse.unquote(parts.path) or "/"
+    return analysis_text(path, parts.query, body, ua, referer, cookie)
+
+
+def _event_text(event: Dict[str, Any]) -> str:
+    return _target_text(
+        event.get("url") or "/",
+        event.get("body") or "",
+        event.get("user_agent") or "",
+        event.get("referer") or "",
+        event.get("cookie") or "",
+    )
+
+
+def iter_jsonl(lines: Iterable[str]) -> Iterator[Optional[str]]:
+    """Événements `logs.json` -> textes d'analyse (None: ligne invalide)."""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield _event_text(json.loads(line))
+        except (ValueError, AttributeError, TypeError):
+            yield None
+
+
+def iter_binary(f: IO[bytes]) -> Iterator[Optional[str]]:
+    """Événements du journal binaire -> textes d'analyse."""
+    for event in iter_stream(f):
+        try:
+            yield _event_text(event)
+        except (ValueError, AttributeError, TypeError):
+            yield None
+
+
+def _unescape(value: Optional[str]) -> str:
+    if not value or value == "-":
+        return ""
+    return value.replace('\\"', '"').replace("\\\\", "\\")
+
+
+def iter_access_log(lines: Iterable[str]) -> Iterator[Optional[str]]:
+    """Lignes de log d'accès (combined/common) -> textes d'analyse."""
+    for line in lines:
+        if not line.strip():
+            continue
+        m = _ACCESS_LINE.match(line)
+        if m is None:
+            yield None
+            continue
+        yield _target_text(m.group("target"), "", _unescape(m.group("ua")), _unescape(m.group("referer")), "")
+
+
+def _read_chunked(f: IO[bytes], limit: int) -> bytes:
+    parts: List[bytes] = []
+    size = 0
+    while True:
+        line = f.readline()
+        if not line:
+            break
+        try:
+            length = int(line.split(b";", 1)[0].strip() or b"0", 16)
+        except ValueError:
+            break
+        if length == 0:
+            # Trailers éventuels jusqu'à la ligne vide
+            while f.readline().strip():
+                pass
+            break
+        data = f.read(length)
+        f.readline()
+        if size < limit:
+            parts.append(data[: limit - size])
+            size += len(data)
+    return b"".join(parts)
+
+
+def iter_http(f: IO[bytes]) -> Iterator[Optional[str]]:
+    """Requêtes HTTP/1.x brutes concaténées -> textes d'analyse.
+    Corps tronqué à `body_inspect_max_bytes`, comme l'inspection en flux.
+    """
+    limit = settings.body_inspect_max_bytes
+    while True:
+        line = f.readline()
+        if not line:
+            return
+        if not line.strip():
+            continue
+        if not _REQUEST_LINE.match(line):
+            yield None
+            continue
+        target = line.split(b" ")[1].decode("latin-1")
+        headers: Dict[str, str] = {}
+        while True:
+            header = f.readline()
+            if not header.strip():
+                break
+            name, _, value = header.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            body = _read_chunked(f, limit)
+        else:
+            length = headers.get("content-length", "0").strip()
+            remaining = int(length) if length.isdigit() else 0
+            body = f.read(min(remaining, limit))
+            if remaining > len(body):
+                f.read(remaining - len(body))
+        yield _target_text(
+            target,
+            body.decode("utf-8", errors="replace"),
+            headers.get("user-agent", ""),
+            headers.get("referer", ""),
+            headers.get("cookie", ""),
+        )
+
+
+def _detect_format(first: bytes) -> str:
+    if first.startswith(MAGIC):
+        return "binary"
+    stripped = first.lstrip()
+    if stripped.startswith(b"{"):
+        return "jsonl"
+    if _REQUEST_LINE.match(stripped.split(b"\n", 1)[0] + b"\n"):
+        return "http"
+    return "access"
+
+
+def iter_corpus(path: str, fmt: str = "auto") -> Iterator[Optional[str]]:
+    """Textes d'analyse d'un fichier (compressé ou non, "-" = entrée standard)."""
+    raw: IO[bytes] = sys.stdin.buffer if path == "-" else open_segment(path)
+    try:
+        f = io.BufferedReader(raw) if not isinstance(raw, io.BufferedReader) else raw  # type: ignore[arg-type]
+        if fmt == "auto":
+            fmt = _detect_format(f.peek(4096)[:4096])
+        if fmt == "http":
+            yield from iter_http(f)
+            return
+        if fmt == "binary":
+            yield from iter_binary(f)
+            return
+        text = io.TextIOWrapper(f, encoding="utf-8", errors="replace", newline="")
+        yield from (iter_jsonl(text) if fmt == "jsonl" else iter_access_log(text))
+    finally:
+        if path != "-":
+            raw.close()
+
+
+def iter_chunks(
+    texts: Iterable[Optional[str]], size: int, max_chars: int = _CHUNK_MAX_CHARS
+) -> Iterator[Tuple[int, List[Optional[str]]]]:
+    """Lots (numéro du premier enregistrement, textes) bornés en nombre et en taille."""
+    chunk: List[Optional[str]] = []
+    chars = 0
+    start = 0
+    for index, text in enumerate(texts):
+        chunk.append(text)
+        chars += len(text) if text else 0
+        if len(chunk) >= size or chars >= max_chars:
+            yield start, chunk
+            start, chunk, chars = index + 1, [], 0
+    if chunk:
+        yield start, chunk
+
+
+# --- scoring (processus de travail) --------------------------------------------
+
+
+class ReplayConfig:
+    """Configuration évaluée: pack de règles (fichier ou intégré) et seuil de blocage."""
+
+    __slots__ = ("rules_file", "threshold", "label")
+
+    def __init__(self, rules_file: str, threshold: int) -> None:
+        self.rules_file = rules_file
+        self.threshold = threshold
+        self.label = f"{rules_file or 'builtin'} (seuil {threshold})"
+
+    def load(self) -> RulePack:
+        return load_rule_pack(self.rules_file) if self.rules_file else builtin_rule_pack()
+
+
+# Jeux de règles compilés du processus: [(ruleset, seuil)], un par configuration
+_worker_configs: List[Tuple[CompiledRuleSet, int]] = []
+
+
+def _init_worker(configs: Sequence[Tuple[str, int]]) -> None:
+    compiled: Dict[str, CompiledRuleSet] = {}
+    _worker_configs.clear()
+    for rules_file, threshold in configs:
+        if rules_file not in compiled:
+            pack = ReplayConfig(rules_file, threshold).load()
+            compiled[rules_file] = CompiledRuleSet(pack.patterns, pack.anchors)
+        _worker_configs.append((compiled[rules_file], threshold))
+
+
+def score_text(raw_text: str, ruleset: CompiledRuleSet, threshold: int) -> Tuple[int, List[str], Dict[str, bool]]:
+    """Équivalent de `compute_score` pour un jeu de règles donné (sans cache ni minutage)."""
+    budget = AnalysisBudget(0, settings.regex_step_budget)  # pas seulement: verdict reproductible
+    normalized, flags = normalize_payload(raw_text)
+    matches = ruleset.match(normalized, budget)
+    apply_timeout(budget, matches, flags)
+    # Verdict "closed" au seuil de la configuration évaluée
+    matches = [(name, threshold if name == TIMEOUT_RULE else score) for name, score in matches]
+    return score_from_matches(matches, flags), [name for name, _ in matches], flags
+
+
+def _verdict(score: int, threshold: int) -> str:
+    return "BLOCK" if score >= threshold else "ALLOW"
+
+
+def _score_chunk(start: int, texts: List[Optional[str]], max_examples: int) -> Dict[str, Any]:
+    """Statistiques partielles d'un lot (fusionnées par `ReplayReport.merge`)."""
+    configs = _worker_configs
+    rules: List[Counter] = [Counter() for _ in configs]
+    scores: List[Counter] = [Counter() for _ in configs]
+    verdicts: List[Counter] = [Counter() for _ in configs]
+    timeouts = [0] * len(configs)
+    changes: Counter = Counter()
+    examples: List[Dict[str, Any]] = []
+    invalid = 0
+    # Même pack pour deux configurations (seuils différents): une seule analyse
+    memo: Dict[int, Tuple[int, List[str], Dict[str, bool]]] = {}
+    for offset, text in enumerate(texts):
+        if text is None:
+            invalid += 1
+            continue
+        memo.clear()
+        results = []
+        for i, (ruleset, threshold) in enumerate(configs):
+            result = memo.get(id(ruleset))
+            if result is None or result[2].get("analysis_timeout"):
+                result = memo[id(ruleset)] = score_text(text, ruleset, threshold)
+            score, matched, flags = result
+            rules[i].update(matched)
+            scores[i][score] += 1
+            verdict = _verdict(score, threshold)
+            verdicts[i][verdict] += 1
+            timeouts[i] += bool(flags.get("analysis_timeout"))
+            results.append((score, matched, verdict))
+        if len(results) == 2 and results[0][2] != results[1][2]:
+            changes[f"{results[0][2]}->{results[1][2]}"] += 1
+            if len(examples) < max_examples:
+                examples.append({
+                    "record": start + offset,
+                    "scores": [r[0] for r in results],
+                    "rules": [r[1] for r in results],
+                    "text": text[:300],
+                })
+    return {
+        "records": len(texts),
+        "invalid": invalid,
+        "rules": rules,
+        "scores": scores,
+        "verdicts": verdicts,
+        "timeouts": timeouts,
+        "changes": changes,
+        "examples": examples,
+    }
+
+
+# --- agrégation et rapport -------------------------------------------------------
+
+
+class ReplayReport:
+    """Agrégats du rejeu: taille bornée par le nombre de règles et de scores distincts."""
+
+    def __init__(self, configs: Sequence[ReplayConfig], max_examples: int) -> None:
+        self.configs = list(configs)
+        self.max_examples = max_examples
+        n = len(self.configs)
+        self.records = 0
+        self.invalid = 0
+        self.rules: List[Counter] = [Counter() for _ in range(n)]
+        self.scores: List[Counter] = [Counter() for _ in range(n)]
+        self.verdicts: List[Counter] = [Counter() for _ in range(n)]
+        self.timeouts = [0] * n
+        self.changes: Counter = Counter()
+        self.examples: List[Dict[str, Any]] = []
+        self.seconds = 0.0
+
+    def merge(self, part: Dict[str, Any]) -> None:
+        self.records += part["records"]
+        self.invalid += part["invalid"]
+        for i in range(len(self.configs)):
+            self.rules[i].update(part["rules"][i])
+            self.scores[i].update(part["scores"][i])
+            self.verdicts[i].update(part["verdicts"][i])
+            self.timeouts[i] += part["timeouts"][i]
+        self.changes.update(part["changes"])
+        # Lots terminés dans le désordre: on garde les premiers enregistrements
+        self.examples = sorted(self.examples + part["examples"], key=lambda e: e["record"])[: self.max_examples]
+
+    def to_dict(self) -> Dict[str, Any]:
+        scored = self.records - self.invalid
+        return {
+            "records": self.records,
+            "invalid": self.invalid,
+            "seconds": round(self.seconds, 3),
+            "records_per_s": round(self.records / self.seconds, 1) if self.seconds else None,
+            "configs": [
+                {
+                    "rules_file": cfg.rules_file or "builtin",
+                    "threshold": cfg.threshold,
+                    "verdicts": dict(self.verdicts[i]),
+                    "block_ratio": round(self.verdicts[i]["BLOCK"] / scored, 6) if scored else None,
+                    "analysis_timeouts": self.timeouts[i],
+                    "rule_hits": dict(self.rules[i].most_common()),
+                    "score_histogram": {str(s): c for s, c in sorted(self.scores[i].items())},
+                }
+                for i, cfg in enumerate(self.configs)
+            ],
+            "verdict_changes": dict(self.changes),
+            "examples": self.examples,
+        }
+
+    def format(self) -> str:
+        n = len(self.configs)
+        lines = [
+            f"{self.records} requêtes ({self.invalid} illisibles) en {self.seconds:.1f} s"
+            + (f" ({self.records / self.seconds:.0f}/s)" if self.seconds else ""),
+        ]
+        for i, cfg in enumerate(self.configs):
+            lines.append(
+                f"config {'AB'[i]}: {cfg.label}: BLOCK {self.verdicts[i]['BLOCK']}, "
+                f"ALLOW {self.verdicts[i]['ALLOW']}, budget épuisé {self.timeouts[i]}"
+            )
+        if n == 2:
+            changed = ", ".join(f"{k} {v}" for k, v in sorted(self.changes.items())) or "aucun"
+            lines.append(f"verdicts modifiés: {changed}")
+        names = sorted(set().union(*self.rules), key=lambda r: (-self.rules[0][r], r))
+        lines += ["", f"{'règle':<36}" + "".join(f"{'AB'[i]:>10}" for i in range(n)) + (f"{'diff':>10}" if n == 2 else "")]
+        for name in names:
+            counts = [self.rules[i][name] for i in range(n)]
+            row = f"{name:<36}" + "".join(f"{c:>10}" for c in counts)
+            if n == 2:
+                row += f"{counts[1] - counts[0]:>+10}"
+            lines.append(row)
+        lines += ["", f"{'score':<8}" + "".join(f"{'AB'[i]:>10}" for i in range(n))]
+        for score in sorted(set().union(*self.scores)):
+            lines.append(f"{score:<8}" + "".join(f"{self.scores[i][score]:>10}" for i in range(n)))
+        for ex in self.examples:
+            lines.append("")
+            lines.append(f"#{ex['record']} scores {ex['scores']} règles A {ex['rules'][0]} B {ex['rules'][1]}")
+            lines.append("  " + ex["text"].replace("\n", " | ")[:200])
+        return "\n".join(lines)
+
+
+def replay(
+    paths: Sequence[str],
+    configs: Sequence[ReplayConfig],
+    fmt: str = "auto",
+    jobs: int = 1,
+    chunk_size: int = 2000,
+    max_examples: int = 10,
+) -> ReplayReport:
+    """Scorer tous les fichiers `paths` contre `configs` (une ou deux)."""
+    report = ReplayReport(configs, max_examples)
+    initargs = ([(cfg.rules_file, cfg.threshold) for cfg in configs],)
+    texts = (text for path in paths for text in iter_corpus(path, fmt))
+    chunks = iter_chunks(texts, chunk_size)
+    started = time.perf_counter()
+    if jobs <= 1:
+        _init_worker(*initargs)
+        for start, chunk in chunks:
+            report.merge(_score_chunk(start, chunk, max_examples))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=initargs) as pool:
+            pending: Set[Future] = set()
+            for start, chunk in chunks:
+                # Lecture en avance bornée: au plus deux lots en attente par processus
+                if len(pending) >= jobs * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        report.merge(future.result())
+                pending.add(pool.submit(_score_chunk, start, chunk, max_examples))
+            for future in pending:
+                report.merge(future.result())
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="waf-replay", description="Rejouer un corpus de requêtes hors ligne (scoring, sans backend)"
+    )
+    parser.add_argument("paths", nargs="+", help="fichiers JSONL/journal binaire/HTTP brut/log d'accès (.gz/.bz2/.xz/.zst, - = stdin)")
+    parser.add_argument("--format", choices=("auto",) + FORMATS, default="auto", help="format des entrées (défaut: détecté)")
+    parser.add_argument("--rules", default=settings.rules_file, help="pack de règles (défaut: WAF_RULES_FILE ou intégré)")
+    parser.add_argument("--threshold", type=int, default=settings.threshold_block, help="seuil de blocage (WAF_THRESHOLD_BLOCK)")
+    parser.add_argument("--compare-rules", help="second pack de règles à comparer")
+    parser.add_argument("--compare-threshold", type=int, help="second seuil de blocage à comparer")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 1, help="processus de scoring (1 = sans pool)")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="requêtes par lot envoyé à un processus")
+    parser.add_argument("--examples", type=int, default=10, help="exemples de verdicts modifiés conservés")
+    parser.add_argument("-o", "--output", help="rapport JSON")
+    args = parser.parse_args(argv)
+
+    configs = [ReplayConfig(args.rules or "", args.threshold)]
+    if args.compare_rules is not None or args.compare_threshold is not None:
+        configs.append(ReplayConfig(
+            args.compare_rules if args.compare_rules is not None else configs[0].rules_file,
+            args.compare_threshold if args.compare_threshold is not None else args.threshold,
+        ))
+    # Packs validés avant de lancer les processus
+    for cfg in configs:
+        try:
+            cfg.load()
+        except RulePackError as exc:
+            print(f"pack de règles invalide: {exc}", file=sys.stderr)
+            return 2
+
+    try:
+        report = replay(args.paths, configs, args.format, max(1, args.jobs), max(1, args.chunk_size), args.examples)
+    except OSError as exc:
+        print(f"lecture impossible: {exc}", file=sys.stderr)
+        return 2
+    print(report.format())
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report.to_dict(), f, indent=2, ensure_ascii=False)
+        print(f"rapport écrit dans {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,579 @@
+"""Microcache des réponses amont aux requêtes GET (par processus).
+
+La réponse brute du backend (statut, en-têtes, corps encore compressé) est
+mémorisée pendant qu'elle est relayée au client, puis rejouée à travers le
+même chemin que les réponses amont (réécriture, compression). Les règles
+HTTP de base sont respectées: `Cache-Control`, `Expires`, `Vary`, jamais de
+réponse avec `Set-Cookie`; fraîcheur heuristique (10 % de l'âge de
+`Last-Modified`) plafonnée à `max_ttl`. Une entrée périmée est encore servie
+pendant sa fenêtre `stale-while-revalidate`, le temps d'une revalidation
+unique en arrière-plan (requête conditionnelle `If-None-Match` /
+`If-Modified-Since`).
+
+Les corps sont bornés en mémoire (LRU sur `max_bytes`); avec un répertoire
+de débordement, les entrées évincées de la mémoire sont écrites dans des
+fichiers projetés en mémoire (`mmap`, fichier supprimé dès la projection)
+dans la limite de `max_disk_bytes`. Un corps projeté est relayé par tranches,
+sans copie intégrale; la projection est libérée quand ni le cache ni une
+réponse en cours ne la référencent plus.
+"""
+from __future__ import annotations
+
+import mmap
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import httpx
+
+from .config import settings
+
+# Statuts mémorisables par défaut (RFC 9110 §15.1), hors réponses partielles
+_CACHEABLE_STATUS = frozenset({200, 203, 300, 301, 308, 404, 410})
+# Requête avec l'un de ces en-têtes: cache ignoré (réponse propre au client)
+_BYPASS_REQUEST_HEADERS = ("authorization", "range")
+# En-têtes conservés dans un 304 généré depuis le cache (RFC 9110 §15.4.5)
+_NOT_MODIFIED_HEADERS = frozenset({"cache-control", "content-location", "date", "etag", "expires", "vary"})
+# Longueur et âge recalculés, transfert propre à la connexion amont
+_UNSTORED_HEADERS = frozenset({b"age", b"content-length", b"transfer-encoding"})
+
+Header = Callable[[str], Optional[str]]
+RawHeaders = List[Tuple[bytes, bytes]]
+CacheKey = Tuple[str, Tuple[str, ...]]
+
+
+def _directives(values: Iterable[str]) -> Dict[str, str]:
+    """`Cache-Control` (éventuellement répété) -> {directive: argument}."""
+    out: Dict[str, str] = {}
+    for value in values:
+        for item in value.split(","):
+            name, _, arg = item.partition("=")
+            name = name.strip().lower()
+            if name:
+                out[name] = arg.strip().strip('"')
+    return out
+
+
+def _seconds(value: Optional[str]) -> Optional[float]:
+    if value is None or not value.strip().isdigit():
+        return None
+    return float(value.strip())
+
+
+def _http_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def _header_values(raw: RawHeaders, name: bytes) -> List[str]:
+    return [v.decode("latin-1") for k, v in raw if k.lower() == name]
+
+
+def _header(raw: RawHeaders, name: bytes) -> Optional[str]:
+    values = _header_values(raw, name)
+    return values[0] if values else None
+
+
+def _vary_names(raw: RawHeaders) -> Optional[Tuple[str, ...]]:
+    """Noms d'en-têtes de `Vary`, triés (None pour `Vary: *`)."""
+    names = set()
+    for value in _header_values(raw, b"vary"):
+        for name in value.split(","):
+            name = name.strip().lower()
+            if name == "*":
+                return None
+            if name:
+                names.add(name)
+    return tuple(sorted(names))
+
+
+def _variant(names: Tuple[str, ...], header: Header) -> Tuple[str, ...]:
+    return tuple((header(name) or "").strip() for name in names)
+
+
+def _etag_matches(if_none_match: str, etag: Optional[str]) -> bool:
+    # Comparaison faible (RFC 9110 §13.1.2)
+    if etag is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tag = etag.strip()
+    tag = tag[2:] if tag.startswith("W/") else tag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        candidate = candidate[2:] if candidate.startswith("W/") else candidate
+        if candidate == tag:
+            return True
+    return False
+
+
+class CachedResponse:
+    """Réponse amont mémorisée; corps en mémoire ou projeté depuis un fichier."""
+
+    __slots__ = (
+        "key", "status", "headers", "vary", "size", "stored_at", "initial_age",
+        "fresh_for", "stale_for", "_body", "_map",
+    )
+
+    def __init__(
+        self, key: CacheKey, status: int, headers: RawHeaders, vary: Tuple[str, ...], body: bytes,
+        freshness: Tuple[float, float, float],
+    ) -> None:
+        self.key = key
+        self.status = status
+        self.headers = headers
+        self.vary = vary
+        self.size = len(body)
+        self._body: Optional[bytes] = body
+        self._map: Optional[mmap.mmap] = None
+        self.stored_at = time.monotonic()
+        self.initial_age, self.fresh_for, self.stale_for = freshness
+
+    def age(self, now: float) -> float:
+        return self.initial_age + max(0.0, now - self.stored_at)
+
+    def body(self) -> bytes:
+        # `spill` projette avant de libérer `_body`: lire `_body` d'abord
+        body = self._body
+        if body is not None:
+            return body
+        return self._map[:] if self._map is not None else b""
+
+    def stream(self) -> httpx.SyncByteStream:
+        body = self._body
+        if body is not None or self._map is None:
+            return httpx.ByteStream(body or b"")
+        return _MappedStream(self._map)
+
+    def spill(self, directory: str) -> None:
+        """Déplacer le corps dans un fichier projeté en mémoire."""
+        fd, path = tempfile.mkstemp(prefix="resp-", dir=directory)
+        try:
+            with os.fdopen(fd, "w+b") as f:
+                f.write(self._body or b"")
+                f.flush()
+                self._map = mmap.mmap(f.fileno(), self.size, access=mmap.ACCESS_READ)
+        finally:
+            # La projection survit à la suppression du fichier (rien à nettoyer au redémarrage)
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        self._body = None
+
+    def not_modified(self, header: Header) -> bool:
+        """Requête conditionnelle du client satisfaite par cette entrée ?"""
+        if self.status != 200:
+            return False
+        inm = header("If-None-Match")
+        if inm:
+            return _etag_matches(inm, _header(self.headers, b"etag"))
+        since = _http_date(header("If-Modified-Since"))
+        modified = _http_date(_header(self.headers, b"last-modified"))
+        return since is not None and modified is not None and modified <= since
+
+    def response(self, now: float, not_modified: bool = False) -> httpx.Response:
+        """Réponse httpx équivalente à la réponse amont (corps brut non lu)."""
+        if not_modified:
+            headers = [(k, v) for k, v in self.headers if k.lower().decode("latin-1") in _NOT_MODIFIED_HEADERS]
+            status, stream = 304, httpx.ByteStream(b"")
+        else:
+            headers = list(self.headers)
+            status, stream = self.status, self.stream()
+            headers.append((b"Content-Length", str(self.size).encode("ascii")))
+        headers.append((b"Age", str(int(self.age(now))).encode("ascii")))
+        return httpx.Response(status, headers=headers, stream=stream)
+
+
+class _MappedStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """Corps projeté relayé par tranches de `CHUNK` octets (jamais copié en entier).
+    La référence à la projection la garde ouverte jusqu'à la fin de la réponse.
+    """
+
+    CHUNK = 64 * 1024
+
+    def __init__(self, data: mmap.mmap) -> None:
+        self._data = data
+
+    def __iter__(self) -> Iterator[bytes]:
+        for start in range(0, len(self._data), self.CHUNK):
+            yield self._data[start:start + self.CHUNK]
+
+    async def __aiter__(self):  # type: ignore[override]
+        for chunk in self:
+            yield chunk
+
+
+class CacheLookup(NamedTuple):
+    """Résultat de `ResponseCache.lookup` pour une requête cacheable.
+    `response` est la réponse servie depuis le cache (None: aller à l'amont),
+    `revalidate` les en-têtes conditionnels si une revalidation doit partir.
+    """
+
+    url: str
+    store: bool
+    response: Optional[httpx.Response]
+    stale: bool
+    revalidate: Optional[Dict[str, str]]
+    key: Optional[CacheKey]
+
+
+class _TeeStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """Flux amont relayé tel quel dont les octets bruts sont aussi mémorisés;
+    `on_complete(body)` n'est appelé que si le flux a été lu jusqu'au bout.
+    """
+
+    def __init__(self, stream: Any, max_bytes: int, on_complete: Callable[[bytes], None]) -> None:
+        self._stream = stream
+        self._max_bytes = max_bytes
+        self._on_complete = on_complete
+        self._parts: Optional[List[bytes]] = []
+        self._size = 0
+
+    def _keep(self, chunk: bytes) -> None:
+        if self._parts is None:
+            return
+        self._size += len(chunk)
+        if self._size > self._max_bytes:
+            self._parts = None  # trop gros: relayé sans être mémorisé
+        else:
+            self._parts.append(chunk)
+
+    def _complete(self) -> None:
+        if self._parts is not None:
+            body, self._parts = b"".join(self._parts), None
+            self._on_complete(body)
+
+    def __iter__(self) -> Iterator[bytes]:
+        for chunk in self._stream:
+            self._keep(chunk)
+            yield chunk
+        self._complete()
+
+    async def __aiter__(self):  # type: ignore[override]
+        async for chunk in self._stream:
+            self._keep(chunk)
+            yield chunk
+        self._complete()
+
+    def close(self) -> None:
+        self._stream.close()
+
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+
+
+class ResponseCache:
+    """Cache LRU des réponses amont, borné en octets (mémoire puis disque)."""
+
+    def __init__(
+        self,
+        max_bytes: int,
+        max_entry: int,
+        max_ttl: float,
+        stale: float,
+        spill_dir: str = "",
+        max_disk_bytes: int = 0,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.max_entry = max_entry
+        self.max_ttl = max_ttl
+        self.stale = stale
+        self.spill_dir = spill_dir
+        self.max_disk_bytes = max_disk_bytes if spill_dir else 0
+        if self.max_disk_bytes:
+            os.makedirs(spill_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[CacheKey, CachedResponse]" = OrderedDict()
+        self._disk: "OrderedDict[CacheKey, CachedResponse]" = OrderedDict()
+        self._vary: Dict[str, Tuple[str, ...]] = {}  # URL -> noms de Vary de sa dernière réponse
+        self._revalidating: set = set()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._counters = {
+            "hits": 0, "stale_hits": 0, "not_modified": 0, "misses": 0, "bypassed": 0, "stores": 0,
+            "uncacheable": 0, "evictions": 0, "spills": 0, "revalidations": 0, "revalidation_errors": 0,
+        }
+
+    # --- politique -----------------------------------------------------------------
+
+    def _freshness(self, status: int, raw: RawHeaders) -> Optional[Tuple[float, float, float]]:
+        """(âge initial, durée de fraîcheur restante, fenêtre périmée) ou None si non mémorisable."""
+        if status not in _CACHEABLE_STATUS or _header(raw, b"set-cookie") is not None:
+            return None
+        cc = _directives(_header_values(raw, b"cache-control"))
+        if "no-store" in cc or "private" in cc or "no-cache" in cc:
+            return None
+        age = _seconds(_header(raw, b"age")) or 0.0
+        lifetime = _seconds(cc.get("s-maxage")) if "s-maxage" in cc else _seconds(cc.get("max-age"))
+        if lifetime is None:
+            date = _http_date(_header(raw, b"date")) or time.time()
+            expires_header = _header(raw, b"expires")
+            if expires_header is not None:
+                expires = _http_date(expires_header)
+                lifetime = max(0.0, expires - date) if expires is not None else 0.0
+            else:
+                modified = _http_date(_header(raw, b"last-modified"))
+                if modified is None:
+                    return None
+                lifetime = max(0.0, (date - modified) * 0.1)
+        fresh_for = min(lifetime, self.max_ttl) - age
+        if fresh_for <= 0:
+            return None
+        if "must-revalidate" in cc or "proxy-revalidate" in cc:
+            stale = 0.0
+        else:
+            swr = _seconds(cc.get("stale-while-revalidate"))
+            stale = swr if swr is not None else self.stale
+        return age, fresh_for, stale
+
+    def _request_policy(self, method: str, header: Header, has_body: bool) -> Tuple[bool, bool]:
+        """(chercher en cache, mémoriser la réponse) pour cette requête."""
+        if method != "GET" or has_body or any(header(name) for name in _BYPASS_REQUEST_HEADERS):
+            return False, False
+        cc = _directives([header("Cache-Control") or ""])
+        if "no-store" in cc:
+            return False, False
+        no_cache = "no-cache" in cc or cc.get("max-age") == "0" or "no-cache" in (header("Pragma") or "").lower()
+        return not no_cache, True
+
+    # --- entrées -------------------------------------------------------------------------
+
+    def _find(self, key: CacheKey) -> Optional[CachedResponse]:
+        for table in (self._memory, self._disk):
+            entry = table.get(key)
+            if entry is not None:
+                table.move_to_end(key)
+                return entry
+        return None
+
+    def _remove(self, key: CacheKey) -> None:
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= entry.size
+        else:
+            entry = self._disk.pop(key, None)
+            if entry is None:
+                return
+            self._disk_bytes -= entry.size
+
+    def _insert(self, entry: CachedResponse) -> None:
+        self._remove(entry.key)
+        self._memory[entry.key] = entry
+        self._memory_bytes += entry.size
+        while self._memory_bytes > self.max_bytes and self._memory:
+            _, old = self._memory.popitem(last=False)
+            self._memory_bytes -= old.size
+            if self.max_disk_bytes and 0 < old.size <= self.max_disk_bytes:
+                try:
+                    old.spill(self.spill_dir)
+                except (OSError, ValueError):
+                    self._counters["evictions"] += 1
+                    continue
+                self._disk[old.key] = old
+                self._disk_bytes += old.size
+                self._counters["spills"] += 1
+            else:
+                self._counters["evictions"] += 1
+        while self._disk_bytes > self.max_disk_bytes and self._disk:
+            _, old = self._disk.popitem(last=False)
+            self._disk_bytes -= old.size
+            self._counters["evictions"] += 1
+
+    def _store(self, url: str, status: int, raw: RawHeaders, body: bytes, header: Header) -> bool:
+        freshness = self._freshness(status, raw)
+        vary = _vary_names(raw)
+        if freshness is None or vary is None or len(body) > self.max_entry:
+            with self._lock:
+                self._counters["uncacheable"] += 1
+            return False
+        headers = [(k, v) for k, v in raw if k.lower() not in _UNSTORED_HEADERS]
+        entry = CachedResponse((url, _variant(vary, header)), status, headers, vary, body, freshness)
+        with self._lock:
+            self._vary[url] = vary
+            self._insert(entry)
+            self._counters["stores"] += 1
+        return True
+
+    # --- API requête ----------------------------------------------------------------
+
+    def lookup(self, method: str, url: str, header: Header, has_body: bool = False) -> Optional[CacheLookup]:
+        """Chercher la réponse en cache pour `url` (None: requête non cacheable)."""
+        use, store = self._request_policy(method, header, has_body)
+        if not store:
+            with self._lock:
+                self._counters["bypassed"] += 1
+            return None
+        now = time.monotonic()
+        with self._lock:
+            vary = self._vary.get(url)
+            entry = self._find((url, _variant(vary, header))) if use and vary is not None else None
+            if entry is not None:
+                age = now - entry.stored_at
+                if age > entry.fresh_for + entry.stale_for:
+                    self._remove(entry.key)
+                    entry = None
+            if entry is None:
+                self._counters["misses"] += 1
+                return CacheLookup(url, store, None, False, None, None)
+            stale = now - entry.stored_at > entry.fresh_for
+            revalidate = None
+            if stale:
+                self._counters["stale_hits"] += 1
+                if entry.key not in self._revalidating:
+                    self._revalidating.add(entry.key)
+                    self._counters["revalidations"] += 1
+                    revalidate = {}
+                    etag = _header(entry.headers, b"etag")
+                    modified = _header(entry.headers, b"last-modified")
+                    if etag is not None:
+                        revalidate["If-None-Match"] = etag
+                    if modified is not None:
+                        revalidate["If-Modified-Since"] = modified
+            else:
+                self._counters["hits"] += 1
+            not_modified = entry.not_modified(header)
+            if not_modified:
+                self._counters["not_modified"] += 1
+            response = entry.response(now, not_modified)
+        return CacheLookup(url, store, response, stale, revalidate, entry.key)
+
+    def tee(self, lookup: CacheLookup, resp: httpx.Response, header: Header) -> httpx.Response:
+        """Mémoriser `resp` pendant son relais si elle est cacheable (flux remplacé)."""
+        raw = list(resp.headers.raw)
+        length = resp.headers.get("Content-Length", "")
+        if (
+            not lookup.store
+            or self._freshness(resp.status_code, raw) is None
+            or _vary_names(raw) is None
+            or (length.isdigit() and int(length) > self.max_entry)
+        ):
+            with self._lock:
+                self._counters["uncacheable"] += 1
+            return resp
+        # Valeurs des en-têtes de Vary relevées maintenant (hors contexte de requête à la fin du flux)
+        names = _vary_names(raw) or ()
+        values = dict(zip(names, _variant(names, header)))
+
+        def complete(body: bytes) -> None:
+            if not length.isdigit() or int(length) == len(body):
+                self._store(lookup.url, resp.status_code, raw, body, values.get)
+
+        resp.stream = _TeeStream(resp.stream, self.max_entry, complete)
+        return resp
+
+    def revalidated(
+        self, lookup: CacheLookup, status: int, raw: Optional[RawHeaders], body: Optional[bytes]
+    ) -> None:
+        """Résultat de la revalidation d'une entrée périmée (raw None: échec)."""
+        key = lookup.key
+        try:
+            if key is None:
+                return
+            with self._lock:
+                entry = self._find(key)
+            if raw is None or entry is None:
+                if raw is None:
+                    with self._lock:
+                        self._counters["revalidation_errors"] += 1
+                return
+            values = dict(zip(entry.vary, key[1]))
+            if status == 304:
+                # En-têtes de la réponse 304 substitués aux anciens, corps conservé
+                updated = {k.lower() for k, _ in raw if k.lower() not in _UNSTORED_HEADERS}
+                headers = [(k, v) for k, v in entry.headers if k.lower() not in updated]
+                headers += [(k, v) for k, v in raw if k.lower() in updated]
+                if not self._store(lookup.url, entry.status, headers, entry.body(), values.get):
+                    with self._lock:
+                        self._remove(key)
+            elif body is None or not self._store(lookup.url, status, raw, body, values.get):
+                if status < 500:
+                    with self._lock:
+                        self._remove(key)
+        finally:
+            with self._lock:
+                self._revalidating.discard(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._memory) + list(self._disk):
+                self._remove(key)
+            self._vary.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            sizes = {
+                "entries": len(self._memory) + len(self._disk),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
+        lookups = counters["hits"] + counters["stale_hits"] + counters["misses"]
+        return {
+            "enabled": True,
+            **sizes,
+            "max_bytes": self.max_bytes,
+            "max_disk_bytes": self.max_disk_bytes,
+            "hit_ratio": round((counters["hits"] + counters["stale_hits"]) / lookups, 4) if lookups else None,
+            **counters,
+        }
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Cache du processus, ou None s'il est désactivé."""
+    global _cache
+    if not settings.response_cache:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(
+                    max_bytes=settings.response_cache_max_bytes,
+                    max_entry=settings.response_cache_max_entry,
+                    max_ttl=settings.response_cache_max_ttl,
+                    stale=settings.response_cache_stale,
+                    spill_dir=settings.response_cache_dir,
+                    max_disk_bytes=settings.response_cache_max_disk_bytes,
+                )
+    return _cache
+
+
+def response_cache_stats() -> Dict[str, Any]:
+    cache = get_response_cache()
+    return cache.stats() if cache is not None else {"enabled": False}
+
+
+def read_limited(chunks: Iterable[bytes], limit: int) -> Optional[bytes]:
+    """Corps brut complet, ou None s'il dépasse `limit` octets."""
+    parts: List[bytes] = []
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        if size > limit:
+            return None
+        parts.append(chunk)
+    return b"".join(parts)
+
+
+async def aread_limited(chunks: AsyncIterator[bytes], limit: int) -> Optional[bytes]:
+    parts: List[bytes] = []
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > limit:
+            return None
+        parts.append(chunk)
+    return b"".join(parts)
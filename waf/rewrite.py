@@ -0,0 +1,320 @@
+"""Réécriture des réponses amont pour garder le client derrière le WAF.
+
+- `backend_url`: URL du backend analysée une seule fois par processus;
+- `rewrite_context`: substitutions (corps, Location, Set-Cookie) calculées une
+  fois par couple (schéma, Host) du WAF;
+- corps HTML/CSS réécrits en un seul passage, morceau par morceau, sans charger
+  la réponse entière. Un remplacement à cheval sur deux morceaux est détecté en
+  gardant en réserve la fin du texte déjà reçu (longueur du plus long motif - 1).
+  Avec un encodage compatible ASCII (UTF-8, Latin-1, cp1252...), les motifs
+  (ASCII) sont cherchés directement dans les octets: ni décodage ni ré-encodage.
+"""
+from __future__ import annotations
+
+import codecs
+import re
+import urllib.parse
+from functools import lru_cache
+from typing import (
+    AnyStr,
+    AsyncIterator,
+    Dict,
+    FrozenSet,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+# Encodages où un octet ASCII est toujours un caractère ASCII (jamais la fin
+# d'une séquence multi-octets): une recherche sur les octets y est exacte
+_ASCII_COMPATIBLE = re.compile(r"^(ascii|utf-8(-sig)?|iso8859-\d+|cp125\d|cp437|cp850|koi8-[ru]|mac-roman)$")
+
+
+def _subsumed(old: AnyStr, new: AnyStr, table: Dict[AnyStr, AnyStr]) -> bool:
+    """La règle old -> new est-elle un préfixe commun ajouté à une autre règle
+    (ex. "http://h" -> "http://w" face à "//h" -> "//w") ? Elle est alors sans effet.
+    """
+    for other_old, other_new in table.items():
+        if other_old == old or not old.endswith(other_old) or not new.endswith(other_new):
+            continue
+        prefix = old[: len(old) - len(other_old)]
+        # ... et l'autre motif ne peut pas commencer dans ce préfixe
+        if prefix == new[: len(new) - len(other_new)] and old.find(other_old) == len(prefix):
+            return True
+    return False
+
+
+def _self_overlapping(old: AnyStr) -> bool:
+    return any(old[i:] == old[: len(old) - i] for i in range(1, len(old)))
+
+
+def _suffix_family(table: Dict[AnyStr, AnyStr]) -> Optional[Tuple[AnyStr, AnyStr, Tuple[Tuple[AnyStr, AnyStr], ...]]]:
+    """(cœur, remplacement, ((préfixe, remplacement), ...)) si tous les motifs sont
+    `préfixe + cœur` (le plus court motif), sinon None. Le cœur ne doit ni se
+    chevaucher lui-même ni apparaître dans un préfixe.
+    """
+    core = min(table, key=len)
+    if _self_overlapping(core):
+        return None
+    prefixes = []
+    for old, new in table.items():
+        if old == core:
+            continue
+        if not old.endswith(core) or old.find(core) != len(old) - len(core):
+            return None
+        prefixes.append((old[: len(old) - len(core)], new))
+    prefixes.sort(key=lambda item: -len(item[0]))
+    return core, table[core], tuple(prefixes)
+
+
+class StreamReplacer(Generic[AnyStr]):
+    """Remplacements littéraux en un seul passage (le plus long motif d'abord),
+    sur `str` ou `bytes`, applicables à un texte découpé en morceaux arbitraires.
+
+    Cas des URLs du backend: tous les motifs finissent par le même cœur
+    ("//hôte:port"). Le texte est alors découpé sur ce cœur par `split` (recherche
+    en C) et seul le préfixe qui précède chaque occurrence est examiné; les
+    autres jeux de motifs passent par une regex d'alternatives.
+    """
+
+    __slots__ = ("_regex", "_table", "_family", "_split", "_hold", "_pending")
+
+    def __init__(self, replacements: Dict[AnyStr, AnyStr], empty: AnyStr) -> None:
+        table = {old: new for old, new in replacements.items() if old}
+        table = {old: new for old, new in table.items() if not _subsumed(old, new, table)}
+        olds = sorted(table, key=lambda old: (-len(old), old))
+        self._table = table
+        self._family = _suffix_family(table) if table else None
+        self._split = None
+        if self._family is not None and len(self._family[2]) == 1:
+            core = self._family[0]
+            old = self._family[2][0][0] + core
+            # Un seul préfixe: découpage direct sur le motif long puis sur le cœur,
+            # si une occurrence du cœur ne peut pas déborder sur le motif long
+            if not _self_overlapping(old) and not any(core.endswith(old[:j]) for j in range(1, len(core))):
+                self._split = (old, table[old])
+        self._regex = None
+        if self._family is None and olds:
+            sep = "|" if isinstance(empty, str) else b"|"
+            self._regex = re.compile(sep.join(re.escape(old) for old in olds))  # type: ignore[arg-type]
+        self._hold = max((len(old) for old in olds), default=1) - 1
+        self._pending: AnyStr = empty
+
+    def replace(self, text: AnyStr) -> AnyStr:
+        """Texte complet en une fois."""
+        if self._family is not None:
+            core, core_new, prefixes = self._family
+            if not prefixes:
+                return text.replace(core, core_new)
+            if self._split is not None:
+                old, new = self._split
+                return new.join([part.replace(core, core_new) for part in text.split(old)])
+            parts = text.split(core)
+            out: List[AnyStr] = []
+            for part in parts[:-1]:
+                for prefix, new in prefixes:
+                    if part.endswith(prefix):
+                        out.append(part[: len(part) - len(prefix)])
+                        out.append(new)
+                        break
+                else:
+                    out.append(part)
+                    out.append(core_new)
+            out.append(parts[-1])
+            return text[:0].join(out)
+        if self._regex is None:
+            return text
+        return self._regex.sub(lambda m: self._table[m.group(0)], text)
+
+    def feed(self, chunk: AnyStr) -> AnyStr:
+        """Ajouter un morceau; retourne la partie du texte déjà définitive."""
+        if self._family is None and self._regex is None:
+            return chunk
+        buf = self._pending + chunk
+        # Un motif qui commence avant `limit` tient entièrement dans `buf`
+        limit = len(buf) - self._hold
+        if self._family is not None:
+            # Coupure après la dernière occurrence complète du cœur, ou à `limit`:
+            # aucun motif ne commence entre les deux (son cœur serait dans `buf`)
+            core = self._family[0]
+            k = buf.rfind(core)
+            cut = max(k + len(core) if k >= 0 else 0, limit)
+            self._pending = buf[cut:]
+            return self.replace(buf[:cut])
+        out: List[AnyStr] = []
+        pos = 0
+        for m in self._regex.finditer(buf):
+            if m.start() >= limit:
+                break
+            out.append(buf[pos:m.start()])
+            out.append(self._table[m.group(0)])
+            pos = m.end()
+        cut = max(pos, limit)
+        out.append(buf[pos:cut])
+        self._pending = buf[cut:]
+        return buf[:0].join(out)
+
+    def flush(self) -> AnyStr:
+        """Fin du flux: remplacer et rendre le texte en réserve."""
+        rest, self._pending = self._pending, self._pending[:0]
+        return self.replace(rest)
+
+
+class BackendURL(NamedTuple):
+    scheme: str
+    netloc: str
+    hostname: str
+    path: str  # chemin de base ("/" à la racine)
+    params: str
+    fragment: str
+    origin: str
+    # Formes de l'hôte reconnues dans un en-tête Location (avec/sans port par défaut)
+    netlocs: FrozenSet[str]
+
+
+@lru_cache(maxsize=8)
+def backend_url(base: str) -> BackendURL:
+    parts = urllib.parse.urlparse(base)
+    hostname = parts.hostname or ""
+    netlocs = {parts.netloc, hostname}
+    if parts.scheme in ("http", "https") and hostname:
+        default_port = 80 if parts.scheme == "http" else 443
+        netlocs.add(f"{hostname}:{default_port}")
+    return BackendURL(
+        parts.scheme,
+        parts.netloc,
+        hostname,
+        parts.path or "/",
+        parts.params,
+        parts.fragment,
+        f"{parts.scheme}://{parts.netloc}",
+        frozenset(netlocs),
+    )
+
+
+def _codec(encoding: str) -> str:
+    try:
+        return codecs.lookup(encoding).name
+    except LookupError:
+        return "utf-8"
+
+
+class RewriteContext:
+    """Substitutions précalculées pour un couple (schéma, Host) du WAF."""
+
+    __slots__ = ("backend", "waf_scheme", "waf_host", "replacements", "byte_replacements", "cookie_domain")
+
+    def __init__(self, backend: BackendURL, waf_scheme: str, waf_host: str) -> None:
+        self.backend = backend
+        self.waf_scheme = waf_scheme
+        self.waf_host = waf_host
+        # URLs absolues et schéma-relatives vers le backend
+        self.replacements: Dict[str, str] = {
+            backend.origin: f"{waf_scheme}://{waf_host}",
+            f"//{backend.netloc}": f"//{waf_host}",
+        }
+        try:
+            self.byte_replacements: Optional[Dict[bytes, bytes]] = {
+                old.encode("ascii"): new.encode("ascii") for old, new in self.replacements.items()
+            }
+        except UnicodeEncodeError:
+            self.byte_replacements = None  # Host non ASCII: passage par le texte décodé
+        self.cookie_domain = (
+            (f"Domain={backend.hostname}", f"Domain={waf_host.split(':')[0]}") if backend.hostname else None
+        )
+
+    def _bytes_mode(self, codec: str) -> bool:
+        return self.byte_replacements is not None and _ASCII_COMPATIBLE.match(codec) is not None
+
+    def rewrite_chunks(self, chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+        """Corps réécrit morceau par morceau. Hors encodage compatible ASCII:
+        décodage puis ré-encodage incrémentaux (erreurs "replace", comme
+        `httpx.Response.text`).
+        """
+        codec = _codec(encoding)
+        if self._bytes_mode(codec):
+            breplacer: StreamReplacer[bytes] = StreamReplacer(self.byte_replacements, b"")  # type: ignore[arg-type]
+            for chunk in chunks:
+                out = breplacer.feed(chunk)
+                if out:
+                    yield out
+            out = breplacer.flush()
+            if out:
+                yield out
+            return
+        replacer: StreamReplacer[str] = StreamReplacer(self.replacements, "")
+        decoder = codecs.getincrementaldecoder(codec)(errors="replace")
+        encoder = codecs.getincrementalencoder(codec)(errors="replace")
+        for chunk in chunks:
+            out = encoder.encode(replacer.feed(decoder.decode(chunk)))
+            if out:
+                yield out
+        out = encoder.encode(replacer.feed(decoder.decode(b"", final=True)) + replacer.flush(), final=True)
+        if out:
+            yield out
+
+    async def arewrite_chunks(self, chunks: AsyncIterator[bytes], encoding: str) -> AsyncIterator[bytes]:
+        """Équivalent asynchrone de `rewrite_chunks` (moteur ASGI)."""
+        codec = _codec(encoding)
+        if self._bytes_mode(codec):
+            breplacer: StreamReplacer[bytes] = StreamReplacer(self.byte_replacements, b"")  # type: ignore[arg-type]
+            async for chunk in chunks:
+                out = breplacer.feed(chunk)
+                if out:
+                    yield out
+            out = breplacer.flush()
+            if out:
+                yield out
+            return
+        replacer: StreamReplacer[str] = StreamReplacer(self.replacements, "")
+        decoder = codecs.getincrementaldecoder(codec)(errors="replace")
+        encoder = codecs.getincrementalencoder(codec)(errors="replace")
+        async for chunk in chunks:
+            out = encoder.encode(replacer.feed(decoder.decode(chunk)))
+            if out:
+                yield out
+        out = encoder.encode(replacer.feed(decoder.decode(b"", final=True)) + replacer.flush(), final=True)
+        if out:
+            yield out
+
+    def rewrite_body(self, body: bytes, encoding: str) -> bytes:
+        """Corps complet en une fois."""
+        codec = _codec(encoding)
+        if self._bytes_mode(codec):
+            return StreamReplacer(self.byte_replacements, b"").replace(body)  # type: ignore[arg-type]
+        return b"".join(self.rewrite_chunks((body,), encoding))
+
+    def rewrite_set_cookie(self, value: str) -> str:
+        # Domain des cookies ramené sur l'hôte du WAF
+        if self.cookie_domain is not None and self.backend.hostname in value:
+            return value.replace(*self.cookie_domain)
+        return value
+
+    def rewrite_location(self, loc: str) -> str:
+        try:
+            target = urllib.parse.urlparse(loc)
+            # Location absolue vers l'hôte backend (avec ou sans port par défaut): on réécrit
+            if target.scheme and target.netloc and target.netloc in self.backend.netlocs:
+                # Conserver le chemin/query de la Location, remplacer schéma/hôte par ceux du WAF
+                return urllib.parse.urlunparse((
+                    self.waf_scheme,
+                    self.waf_host,  # inclut le port du WAF
+                    target.path,
+                    target.params,
+                    target.query,
+                    target.fragment,
+                ))
+        except Exception:
+            # En cas de doute, on laisse Location telle quelle
+            pass
+        return loc
+
+
+@lru_cache(maxsize=256)
+def rewrite_context(base: str, waf_scheme: str, waf_host: str) -> RewriteContext:
+    """Contexte mis en cache par (backend, schéma, Host); borné car Host vient du client."""
+    return RewriteContext(backend_url(base), waf_scheme, waf_host)
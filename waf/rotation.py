@@ -0,0 +1,311 @@
+from __future__ import annotations
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import re
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+from typing import IO, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl  # type: ignore
+except Exception:  # pragma: no cover - Windows
+    fcntl = None  # type: ignore
+
+try:  # Python >= 3.14
+    from compression import zstd as _zstd  # type: ignore
+except Exception:  # pragma: no cover - optional
+    _zstd = None  # type: ignore
+if _zstd is None:
+    try:
+        import zstandard as _zstandard  # type: ignore
+    except Exception:  # pragma: no cover - optional
+        _zstandard = None  # type: ignore
+else:
+    _zstandard = None  # type: ignore
+
+
+def _zstd_open(path: str, mode: str) -> IO[bytes]:
+    if _zstd is not None:
+        return _zstd.open(path, mode)
+    if _zstandard is not None:
+        return _zstandard.open(path, mode)
+    raise RuntimeError("zstd compression unavailable (Python >= 3.14 or 'zstandard' required)")
+
+
+# Extension -> ouverture binaire (lecture/écriture) des segments compressés
+_COMPRESSORS: Dict[str, Tuple[str, Callable[[str, str], IO[bytes]]]] = {
+    "gzip": (".gz", lambda p, m: gzip.open(p, m)),
+    "bz2": (".bz2", lambda p, m: bz2.open(p, m)),
+    "xz": (".xz", lambda p, m: lzma.open(p, m)),
+    "zstd": (".zst", _zstd_open),
+}
+_OPENERS = {ext: opener for ext, opener in _COMPRESSORS.values()}
+
+
+class RotationPolicy:
+    """Paramètres de rotation (0 = critère désactivé)."""
+
+    __slots__ = ("max_bytes", "interval", "naming", "compress", "keep", "max_age")
+
+    def __init__(
+        self,
+        max_bytes: int = 0,
+        interval: float = 0,
+        naming: str = "timestamp",
+        compress: str = "gzip",
+        keep: int = 0,
+        max_age: float = 0,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.naming = naming
+        self.compress = compress if compress in _COMPRESSORS else "none"
+        self.keep = keep
+        self.max_age = max_age  # secondes
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 or self.interval > 0
+
+
+def _segment_re(path: str) -> re.Pattern:
+    base = re.escape(os.path.basename(path))
+    return re.compile(rf"^{base}\.(\d{{8}}T\d{{6}}Z(?:-\d+)?|\d{{6,}})(\.gz|\.bz2|\.xz|\.zst)?$")
+
+
+def list_segments(path: str) -> List[str]:
+    """Segments fermés de `path`, du plus ancien au plus récent.
+    Si un segment existe en clair et compressé (compression en cours), seul
+    le fichier en clair est retenu.
+    """
+    directory = os.path.dirname(path) or "."
+    pattern = _segment_re(path)
+    found: Dict[str, Tuple[str, str]] = {}
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    for name in names:
+        m = pattern.match(name)
+        if not m:
+            continue
+        stem, ext = m.group(1), m.group(2) or ""
+        if stem in found and found[stem][1] == "":
+            continue
+        found[stem] = (os.path.join(directory, name), ext)
+    return [found[stem][0] for stem in sorted(found, key=_segment_sort_key)]
+
+
+def _segment_sort_key(stem: str) -> Tuple[int, str, int]:
+    # Horodatages et numéros (complétés par des zéros) se trient lexicographiquement,
+    # le suffixe "-N" (plusieurs rotations dans la même seconde) numériquement
+    base, _, n = stem.partition("-")
+    return len(base), base, int(n or 0)
+
+
+def open_segment(path: str) -> IO[bytes]:
+    """Ouvrir un segment (compressé ou non) en lecture binaire."""
+    for ext, opener in _OPENERS.items():
+        if path.endswith(ext):
+            return opener(path, "rb")
+    try:
+        return open(path, "rb")
+    except FileNotFoundError:
+        # Segment compressé (en arrière-plan) entre son listage et son ouverture
+        for ext, opener in _OPENERS.items():
+            if os.path.exists(path + ext):
+                return opener(path + ext, "rb")
+        raise
+
+
+def iter_log_files(path: str) -> List[str]:
+    """Tous les fichiers de logs dans l'ordre chronologique (segments puis fichier courant)."""
+    files = list_segments(path)
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def iter_lines(path: str) -> Iterator[str]:
+    """Lignes de tous les segments puis du fichier courant, dans l'ordre."""
+    for file_path in iter_log_files(path):
+        try:
+            with open_segment(file_path) as raw:
+                with io.TextIOWrapper(raw, encoding="utf-8", errors="replace") as f:
+                    yield from f
+        except OSError:
+            continue
+
+
+def remove_segments(path: str) -> None:
+    for seg in list_segments(path):
+        try:
+            os.remove(seg)
+        except OSError:
+            pass
+
+
+def _first_timestamp(fd: int) -> Optional[float]:
+    # Début d'un fichier = horodatage de sa première ligne ou de son premier
+    # bloc binaire (partagé entre processus)
+    try:
+        head = os.pread(fd, 512, 0)
+    except Exception:
+        return None
+    from .binlog import first_timestamp, sniff  # import local: binlog dépend de ce module
+
+    if sniff(head):
+        return first_timestamp(head)
+    m = re.search(rb'"timestamp"\s*:\s*"([^"]+)"', head.split(b"\n", 1)[0])
+    if not m:
+        return None
+    try:
+        return datetime.fromisoformat(m.group(1).decode("ascii")).timestamp()
+    except ValueError:
+        return None
+
+
+class RotatingAppender:
+    """Ajout de lignes avec rotation, sûr entre plusieurs processus.
+
+    Chaque écriture prend un verrou flock sur le fichier courant puis vérifie
+    que son descripteur pointe toujours sur `path` (sinon un autre processus
+    a effectué la rotation: on rouvre). La rotation elle-même (rename) se fait
+    sous ce même verrou, donc aucune ligne n'est écrite dans un segment fermé.
+    La compression et la rétention sont faites ensuite, hors verrou.
+    """
+
+    def __init__(self, path: str, policy: RotationPolicy) -> None:
+        self.path = path
+        self.policy = policy
+        self._fd: Optional[int] = None
+        self._start: Dict[int, float] = {}
+        self.rotations = 0
+
+    def _open(self) -> int:
+        if self._fd is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        return self._fd
+
+    def close(self) -> None:
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = None
+
+    def _is_current(self, fd: int) -> bool:
+        try:
+            return os.fstat(fd).st_ino == os.stat(self.path).st_ino
+        except OSError:
+            return False
+
+    def _needs_rotation(self, fd: int, incoming: int) -> bool:
+        st = os.fstat(fd)
+        if st.st_size == 0:
+            return False
+        if self.policy.max_bytes > 0 and st.st_size + incoming > self.policy.max_bytes:
+            return True
+        if self.policy.interval > 0:
+            start = self._start.get(st.st_ino)
+            if start is None:
+                start = _first_timestamp(fd) or st.st_mtime
+                self._start = {st.st_ino: start}
+            if time.time() >= start + self.policy.interval:
+                return True
+        return False
+
+    def _segment_name(self) -> str:
+        if self.policy.naming == "numbered":
+            stems = [re.sub(r"\.(gz|bz2|xz|zst)$", "", s).rsplit(".", 1)[-1] for s in list_segments(self.path)]
+            numbers = [int(s) for s in stems if s.isdigit()]
+            return f"{self.path}.{(max(numbers) + 1 if numbers else 1):06d}"
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        candidate = f"{self.path}.{stamp}"
+        n = 0
+        while any(os.path.exists(candidate + ext) for ext in ("", ".gz", ".bz2", ".xz", ".zst")):
+            n += 1
+            candidate = f"{self.path}.{stamp}-{n}"
+        return candidate
+
+    def append(self, data: bytes) -> None:
+        """Écrire `data` (lignes complètes) en un seul bloc, avec rotation si nécessaire."""
+        rotated: Optional[str] = None
+        for _ in range(5):
+            fd = self._open()
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if not self._is_current(fd):
+                    self.close()
+                    continue
+                if self.policy.enabled and self._needs_rotation(fd, len(data)):
+                    rotated = self._segment_name()
+                    os.rename(self.path, rotated)
+                    self.rotations += 1
+                    self.close()
+                    continue
+                view = memoryview(data)
+                while view:
+                    written = os.write(fd, view)
+                    view = view[written:]
+                break
+            finally:
+                if self._fd == fd and fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+        if rotated is not None:
+            threading.Thread(target=self._finish_segment, args=(rotated,), daemon=True).start()
+
+    def _finish_segment(self, segment: str) -> None:
+        compress_segment(segment, self.policy.compress)
+        apply_retention(self.path, self.policy)
+
+
+def compress_segment(segment: str, compress: str) -> str:
+    """Compresser un segment fermé (fichier temporaire puis rename atomique)."""
+    if compress not in _COMPRESSORS:
+        return segment
+    ext, opener = _COMPRESSORS[compress]
+    target = segment + ext
+    tmp = target + ".tmp"
+    try:
+        with open(segment, "rb") as src, opener(tmp, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(tmp, target)
+        os.remove(segment)
+        return target
+    except Exception:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return segment
+
+
+def apply_retention(path: str, policy: RotationPolicy) -> None:
+    """Supprimer les segments au-delà de `keep` ou plus vieux que `max_age`."""
+    segments = list_segments(path)
+    doomed = set()
+    if policy.keep > 0 and len(segments) > policy.keep:
+        doomed.update(segments[: len(segments) - policy.keep])
+    if policy.max_age > 0:
+        cutoff = time.time() - policy.max_age
+        for seg in segments:
+            try:
+                if os.path.getmtime(seg) < cutoff:
+                    doomed.add(seg)
+            except OSError:
+                pass
+    for seg in doomed:
+        try:
+            os.remove(seg)
+        except OSError:
+            pass
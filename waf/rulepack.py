@@ -0,0 +1,327 @@
+"""Packs de règles externes (JSON, TOML ou YAML), rechargés à chaud.
+
+Format (JSON; mêmes clés en TOML `[[rules]]` ou en YAML)::
+
+    {
+      "version": "2026.10.18-1",
+      "rules": [
+        {"name": "SQLI_UNION_SELECT", "pattern": "\\\\bunion\\\\s+select\\\\b", "score": 6,
+         "fields": ["args", "form", "body"], "enabled": true,
+         "anchors": [["union"], ["select"]], "field_pattern": null}
+      ]
+    }
+
+`fields`, `anchors` et `field_pattern` sont facultatifs (cf. `rules.RULE_FIELDS`,
+`rules.RULE_ANCHORS`, `rules.FIELD_PATTERNS`); `enabled` vaut true par défaut.
+Le fichier (`WAF_RULES_FILE`) est compilé en un `RulePack` immuable puis activé
+d'un bloc quand il change ou sur SIGHUP. Un fichier invalide est ignoré: le pack
+précédent reste actif.
+
+    python -m waf.rulepack export rules.json   # règles intégrées → fichier
+    python -m waf.rulepack check rules.json    # valider un fichier
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import re
+import signal
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import tomllib  # type: ignore
+except Exception:  # pragma: no cover - Python < 3.11
+    tomllib = None  # type: ignore
+
+try:
+    import yaml  # type: ignore
+except Exception:  # pragma: no cover - optional
+    yaml = None  # type: ignore
+
+from .config import settings
+from .redos import check_rules, pattern_risk
+from .ruleset import RulePack, active_rule_pack, builtin_rule_pack, install_rule_pack
+
+logger = logging.getLogger(__name__)
+
+FIELD_KINDS = ("path", "args", "form", "body", "headers", "cookies")
+
+
+class RulePackError(ValueError):
+    """Fichier de règles illisible ou invalide."""
+
+
+def _read(path: str) -> Dict[str, Any]:
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+        if ext == ".toml":
+            if tomllib is None:
+                raise RulePackError("TOML nécessite Python >= 3.11 (tomllib)")
+            data = tomllib.loads(raw.decode("utf-8"))
+        elif ext in (".yaml", ".yml"):
+            if yaml is None:
+                raise RulePackError("YAML nécessite PyYAML: pip install pyyaml")
+            data = yaml.safe_load(raw)
+        else:
+            data = json.loads(raw)
+    except RulePackError:
+        raise
+    except Exception as exc:
+        raise RulePackError(f"{path}: {exc}") from exc
+    if not isinstance(data, dict):
+        raise RulePackError(f"{path}: un objet avec 'version' et 'rules' est attendu")
+    return data
+
+
+def _compile(name: str, key: str, source: Any) -> re.Pattern:
+    if not isinstance(source, str) or not source:
+        raise RulePackError(f"règle {name}: '{key}' doit être une chaîne non vide")
+    try:
+        return re.compile(source)
+    except re.error as exc:
+        raise RulePackError(f"règle {name}: {key} invalide ({exc})") from exc
+
+
+def _selectors(name: str, value: Any) -> Tuple[str, ...]:
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        raise RulePackError(f"règle {name}: 'fields' doit être une liste de sélecteurs")
+    for sel in value:
+        if sel.partition(":")[0] not in FIELD_KINDS:
+            raise RulePackError(f"règle {name}: sélecteur inconnu {sel!r} (types: {', '.join(FIELD_KINDS)})")
+    return tuple(value)
+
+
+def _anchors(name: str, value: Any) -> Tuple[Tuple[str, ...], ...]:
+    if not isinstance(value, list) or not all(
+        isinstance(g, list) and g and all(isinstance(lit, str) and lit for lit in g) for g in value
+    ):
+        raise RulePackError(f"règle {name}: 'anchors' doit être une liste de listes de littéraux")
+    return tuple(tuple(g) for g in value)
+
+
+def parse_rule_pack(data: Dict[str, Any], source: str = "<memory>") -> RulePack:
+    """Valider et compiler un pack; lève `RulePackError` à la première erreur."""
+    version = data.get("version")
+    if version is None or str(version) == "":
+        raise RulePackError("'version' manquante")
+    rules = data.get("rules")
+    if not isinstance(rules, list):
+        raise RulePackError("'rules' doit être une liste")
+    patterns = []
+    fields: Dict[str, Tuple[str, ...]] = {}
+    anchors: Dict[str, Tuple[Tuple[str, ...], ...]] = {}
+    field_patterns: Dict[str, re.Pattern] = {}
+    seen = set()
+    for i, rule in enumerate(rules):
+        if not isinstance(rule, dict):
+            raise RulePackError(f"règle #{i}: objet attendu")
+        name = rule.get("name")
+        if not isinstance(name, str) or not name:
+            raise RulePackError(f"règle #{i}: 'name' manquant")
+        if name in seen:
+            raise RulePackError(f"règle {name}: nom en double")
+        seen.add(name)
+        score = rule.get("score")
+        if not isinstance(score, int) or isinstance(score, bool):
+            raise RulePackError(f"règle {name}: 'score' doit être un entier")
+        enabled = rule.get("enabled", True)
+        if not isinstance(enabled, bool):
+            raise RulePackError(f"règle {name}: 'enabled' doit être un booléen")
+        # Règles désactivées validées aussi: les réactiver ne doit pas casser le rechargement
+        pattern = _compile(name, "pattern", rule.get("pattern"))
+        selectors = _selectors(name, rule["fields"]) if rule.get("fields") is not None else None
+        groups = _anchors(name, rule["anchors"]) if rule.get("anchors") is not None else None
+        field_pattern = (
+            _compile(name, "field_pattern", rule["field_pattern"]) if rule.get("field_pattern") is not None else None
+        )
+        if not enabled:
+            continue
+        patterns.append((name, pattern, score))
+        if selectors is not None:
+            fields[name] = selectors
+        if groups:
+            anchors[name] = groups
+        if field_pattern is not None:
+            field_patterns[name] = field_pattern
+    return RulePack(str(version), source, patterns, fields, anchors, field_patterns)
+
+
+def load_rule_pack(path: str) -> RulePack:
+    return parse_rule_pack(_read(path), path)
+
+
+def dump_rule_pack(pack: RulePack) -> Dict[str, Any]:
+    """Représentation sérialisable d'un pack (format de `parse_rule_pack`)."""
+    rules = []
+    for name, pattern, score in pack.patterns:
+        rule: Dict[str, Any] = {"name": name, "pattern": pattern.pattern, "score": score, "enabled": True}
+        if name in pack.fields:
+            rule["fields"] = list(pack.fields[name])
+        if name in pack.anchors:
+            rule["anchors"] = [list(g) for g in pack.anchors[name]]
+        if name in pack.field_patterns:
+            rule["field_pattern"] = pack.field_patterns[name].pattern
+        rules.append(rule)
+    return {"version": pack.version, "rules": rules}
+
+
+_status_lock = threading.Lock()
+_status: Dict[str, Any] = {"loaded_at": None, "reloads": 0, "failures": 0, "last_error": None}
+
+
+def reload_rule_pack(path: Optional[str] = None) -> bool:
+    """Charger `path` (défaut `WAF_RULES_FILE`) et l'activer; en cas d'erreur le
+    pack actif est conservé. Retourne True si un nouveau pack est actif.
+    """
+    path = path or settings.rules_file
+    if not path:
+        return False
+    try:
+        pack = load_rule_pack(path)
+    except RulePackError as exc:
+        logger.error("rule pack reload failed, keeping version %s: %s", active_rule_pack().version, exc)
+        with _status_lock:
+            _status["failures"] += 1
+            _status["last_error"] = str(exc)
+        return False
+    install_rule_pack(pack)
+    # Jeu de règles par champ reconstruit ici plutôt qu'à la prochaine requête
+    from .fields import get_field_ruleset
+
+    get_field_ruleset()
+    logger.warning("rule pack %s loaded from %s (%d rules)", pack.version, path, len(pack))
+    with _status_lock:
+        _status["reloads"] += 1
+        _status["loaded_at"] = time.time()
+        _status["last_error"] = None
+    return True
+
+
+class FileWatcher:
+    """Thread de surveillance d'un fichier (mtime, taille, inode) et des SIGHUP:
+    `on_change(path)` est appelé à chaque changement.
+    """
+
+    def __init__(self, path: str, interval: float, on_change: Callable[[str], Any], name: str) -> None:
+        self.path = path
+        self.interval = interval
+        self.on_change = on_change
+        self._wake = threading.Event()
+        self._signature = self._stat()
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+
+    def _stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def request_reload(self) -> None:
+        self._wake.set()
+
+    def _loop(self) -> None:
+        while True:
+            forced = self._wake.wait(self.interval if self.interval > 0 else None)
+            self._wake.clear()
+            signature = self._stat()
+            if forced or (signature is not None and signature != self._signature):
+                self._signature = signature
+                self.on_change(self.path)
+
+
+_watchers: List[FileWatcher] = []
+_watchers_lock = threading.Lock()
+_sighup_installed = False
+
+
+def watch_file(path: str, interval: float, on_change: Callable[[str], Any], name: str) -> FileWatcher:
+    """Surveiller `path` dans un thread; SIGHUP force le rechargement de tous
+    les fichiers surveillés (gestionnaire installé depuis le thread principal).
+    """
+    global _sighup_installed
+    watcher = FileWatcher(path, interval, on_change, name)
+    watcher.start()
+    with _watchers_lock:
+        _watchers.append(watcher)
+        install = not _sighup_installed and hasattr(signal, "SIGHUP")
+        install = install and threading.current_thread() is threading.main_thread()
+        if install:
+            _sighup_installed = True
+    if install:
+        signal.signal(signal.SIGHUP, lambda signum, frame: [w.request_reload() for w in list(_watchers)])
+    return watcher
+
+
+_watcher: Optional[FileWatcher] = None
+_init_lock = threading.Lock()
+
+
+def init_rule_pack() -> None:
+    """Au démarrage du proxy: charger `WAF_RULES_FILE` s'il est défini, surveiller
+    le fichier et recharger sur SIGHUP. Sans fichier, les règles intégrées restent
+    actives. Idempotent.
+    """
+    global _watcher
+    with _init_lock:
+        if _watcher is not None:
+            return
+        if not settings.rules_file:
+            # Règles intégrées: seulement le contrôle anti-ReDoS au chargement
+            check_rules(active_rule_pack().patterns)
+            return
+        reload_rule_pack()
+        _watcher = watch_file(settings.rules_file, settings.rules_reload_interval, reload_rule_pack, "waf-rulepack")
+
+
+def rule_pack_status() -> Dict[str, Any]:
+    pack = active_rule_pack()
+    with _status_lock:
+        status = dict(_status)
+    return {"version": pack.version, "source": pack.source, "rules": len(pack), **status}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m waf.rulepack", description="Packs de règles du WAF")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="écrire les règles intégrées dans un fichier JSON")
+    export.add_argument("path", nargs="?", help="fichier de sortie (défaut: sortie standard)")
+    export.add_argument("--version", default="builtin", help="version du pack écrit")
+    check = sub.add_parser("check", help="valider un fichier de règles")
+    check.add_argument("path")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        data = dump_rule_pack(builtin_rule_pack())
+        data["version"] = args.version
+        text = json.dumps(data, indent=2, ensure_ascii=False) + "\n"
+        if args.path:
+            with open(args.path, "w", encoding="utf-8") as f:
+                f.write(text)
+        else:
+            print(text, end="")
+        return 0
+    try:
+        pack = load_rule_pack(args.path)
+    except RulePackError as exc:
+        print(f"invalide: {exc}")
+        return 1
+    print(f"version {pack.version}: {len(pack)} règles actives")
+    for name, pattern, _ in pack.patterns:
+        risk = pattern_risk(pattern)
+        if risk is not None:
+            print(f"  {name}: risque {risk.kind} ({risk.detail})")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -2,7 +2,10 @@ from __future__ import annotations
 
 import re
 import urllib.parse
-from typing import List, Tuple, Dict
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .redos import AnalysisBudget
 
 # --- Normalization helpers ---
 
@@ -23,6 +26,13 @@ def _safe_unquote_plus(s: str) -> str:
     return re.sub(r"%[0-9a-fA-F]{2}", _repl, s2)
 
 
+def _unquote_plus(s: str) -> str:
+    try:
+        return urllib.parse.unquote_plus(s)
+    except Exception:
+        return _safe_unquote_plus(s)
+
+
 def url_decode_all(s: str) -> Tuple[str, Dict[str, bool]]:
     """URL-decode de manière robuste; détecte le double décodage.
     Ne plante pas sur des encodages invalides (ex: "%E", "%ZZ").
@@ -31,31 +41,37 @@ def url_decode_all(s: str) -> Tuple[str, Dict[str, bool]]:
     if not s:
         return "", {"double_decoded": False, "had_encoding": False}
     had_encoding = ("%" in s) or ("+" in s)
-    try:
-        once = urllib.parse.unquote_plus(s)
-    except Exception:
-        once = _safe_unquote_plus(s)
-    try:
-        twice = urllib.parse.unquote_plus(once)
-    except Exception:
-        twice = _safe_unquote_plus(once)
+    if not had_encoding:
+        # Sans '%' ni '+', unquote_plus rend le texte inchangé
+        return s, {"double_decoded": False, "had_encoding": False}
+    once = _unquote_plus(s)
+    # Second passage seulement s'il reste quelque chose à décoder
+    twice = _unquote_plus(once) if ("%" in once or "+" in once) else once
     return twice, {"double_decoded": twice != once, "had_encoding": had_encoding}
 
 
+_COMMENT_RE = re.compile(r"/\*+\*/")
+
+
 def normalize_payload(s: str) -> Tuple[str, Dict[str, bool]]:
     """Apply normalization: URL decode, lowercase, remove comments, collapse spaces,
     replace encoded control chars.
     Returns (normalized_text, flags)
+
+    Stages that cannot change the text are skipped (no '%'/'+': no decoding,
+    no '/*': no comment stripping, no '%0': no control-char replacement).
     """
     decoded, flags = url_decode_all(s)
     s2 = decoded.lower()
     # Remove C-style comments often used for bypass: /**/
-    s2 = re.sub(r"/\*+\*/", " ", s2)
+    if "/*" in s2:
+        s2 = _COMMENT_RE.sub(" ", s2)
     # Replace encoded control chars remnants
-    s2 = s2.replace("%0a", " ").replace("%0d", " ").replace("%09", " ")
-    # Collapse multiple spaces/tabs
-    s2 = re.sub(r"\s+", " ", s2)
-    return s2.strip(), flags
+    if "%0" in s2:
+        s2 = s2.replace("%0a", " ").replace("%0d", " ").replace("%09", " ")
+    # Collapse whitespace runs and strip in one pass (str.split() uses the same
+    # Unicode whitespace set as the former `\s+` regex + strip())
+    return " ".join(s2.split()), flags
 
 
 # --- Signature rules ---
@@ -113,11 +129,99 @@ OTHER_PATTERNS: List[Tuple[str, re.Pattern, int]] = [
 
 ALL_PATTERNS = SQLI_PATTERNS + XSS_PATTERNS + ENCODING_PATTERNS + OTHER_PATTERNS
 
-
-def match_rules(text: str) -> List[Tuple[str, int]]:
-    """Return list of (rule_name, score) matched in text."""
+# Littéraux d'ancrage par règle (utilisés par le moteur compilé, cf. waf/ruleset.py).
+# Forme conjonctive: chaque groupe doit avoir au moins un de ses littéraux présent
+# dans le texte pour que la regex puisse matcher. Une règle absente de ce dict
+# est toujours évaluée.
+RULE_ANCHORS: Dict[str, Tuple[Tuple[str, ...], ...]] = {
+    "SQLI_OR_1EQ1": (("'", '"'), ("or",), ("=",)),
+    "SQLI_UNION_SELECT": (("union",), ("select",)),
+    "SQLI_AND_1EQ1": (("and",), ("=",)),
+    "SQLI_SLEEP_FN": (("sleep",), ("(",)),
+    "SQLI_BENCHMARK_FN": (("benchmark",), ("(",)),
+    "SQLI_DROP_TABLE": ((";",), ("drop",), ("table",)),
+    "SQLI_HEX_ENC_OR": (("%27",), ("1%3d1",)),
+    "SQLI_BARE_OR_1EQ1": (("or",), ("=",)),
+    "SQLI_COMMENT_DASH": (("--",),),
+    "SQLI_STACKED_QUERIES": ((";",), ("select",)),
+    "SQLI_URL_COMMENT_SHARP": (("%23",),),
+    "SQLI_PARAM_ID_QUOTE": (("id=",),),
+    "SQLI_PARAM_ID_AND_1EQ1": (("id=",), ("and",)),
+    "SQLI_PARAM_ID_OR_1EQ1": (("id=",), ("or",)),
+    "SQLI_PARAM_ID_UNION_SELECT": (("id=",), ("union",), ("select",)),
+    "SQLI_AND_SLEEP": (("and",), ("sleep",)),
+    "SQLI_PARAM_ID_AND_SLEEP": (("id=",), ("and",), ("sleep",)),
+    "XSS_SCRIPT_TAG": (("<",), ("script",)),
+    "XSS_ATTR_ONERROR": (("onerror",),),
+    "XSS_JS_PROTO": (("javascript:",),),
+    "XSS_QUOTE_BREAK_SCRIPT": (('"',), (">",), ("script",)),
+    "XSS_ENC_SCRIPT": (("%3c",), ("script",), ("%3e",)),
+    "XSS_IMG_ONERROR": (("<img",), ("onerror=",)),
+    "ENC_PERCENT_HEAVY": (("%",),),
+    "PATH_TRAVERSAL": (("../",),),
+    "LFI_WRAPPER": (("php://", "data://"),),
+    "CMD_INJECTION": ((";",), ("id", "whoami", "cat")),
+}
+
+
+# Champs inspectés par règle en mode "fields" (cf. waf/fields.py). Sélecteurs:
+# "path", "args" / "args:<nom>", "form" / "form:<nom>", "body" (corps hors
+# formulaire), "headers" / "headers:user-agent|referer", "cookies" / "cookies:<nom>".
+# Une règle absente de ce dict est évaluée sur tous les champs.
+_INPUTS: Tuple[str, ...] = ("args", "form", "body", "cookies", "headers")
+_ID_PARAM: Tuple[str, ...] = ("args:id", "form:id")
+
+RULE_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "SQLI_OR_1EQ1": _INPUTS,
+    "SQLI_UNION_SELECT": _INPUTS,
+    "SQLI_AND_1EQ1": _INPUTS,
+    "SQLI_SLEEP_FN": _INPUTS,
+    "SQLI_BENCHMARK_FN": _INPUTS,
+    "SQLI_DROP_TABLE": _INPUTS,
+    "SQLI_BARE_OR_1EQ1": _INPUTS,
+    "SQLI_COMMENT_DASH": _INPUTS,
+    "SQLI_STACKED_QUERIES": _INPUTS,
+    "SQLI_PARAM_ID_QUOTE": _ID_PARAM,
+    "SQLI_PARAM_ID_AND_1EQ1": _ID_PARAM,
+    "SQLI_PARAM_ID_OR_1EQ1": _ID_PARAM,
+    "SQLI_PARAM_ID_UNION_SELECT": _ID_PARAM,
+    "SQLI_AND_SLEEP": _INPUTS,
+    "SQLI_PARAM_ID_AND_SLEEP": _ID_PARAM,
+    "XSS_SCRIPT_TAG": ("path",) + _INPUTS,
+    "XSS_ATTR_ONERROR": ("path",) + _INPUTS,
+    "XSS_JS_PROTO": ("path",) + _INPUTS,
+    "XSS_QUOTE_BREAK_SCRIPT": ("path",) + _INPUTS,
+    "XSS_ENC_SCRIPT": ("path",) + _INPUTS,
+    "XSS_IMG_ONERROR": ("path",) + _INPUTS,
+    "PATH_TRAVERSAL": ("path", "args", "form", "body"),
+    "LFI_WRAPPER": ("args", "form", "body"),
+    "CMD_INJECTION": ("args", "form", "body", "cookies"),
+}
+
+# En mode "fields", motif appliqué à la valeur du champ à la place du motif
+# global (le préfixe "[?&]id=" devient inutile: le champ est déjà ciblé)
+FIELD_PATTERNS: Dict[str, re.Pattern] = {
+    "SQLI_PARAM_ID_QUOTE": re.compile(r"^\d*(?:'|%27)"),
+    "SQLI_PARAM_ID_AND_1EQ1": re.compile(r"\band\s*1\s*=\s*1\b"),
+    "SQLI_PARAM_ID_OR_1EQ1": re.compile(r"\bor\s*1\s*=\s*1\b"),
+    "SQLI_PARAM_ID_UNION_SELECT": re.compile(r"\bunion\s+select\b"),
+    "SQLI_PARAM_ID_AND_SLEEP": re.compile(r"\band\s+sleep\s*\("),
+}
+
+
+def match_rules(
+    text: str,
+    budget: Optional["AnalysisBudget"] = None,
+    patterns: Optional[Sequence[Tuple[str, re.Pattern, int]]] = None,
+) -> List[Tuple[str, int]]:
+    """Return list of (rule_name, score) matched in text.
+    With a `budget` (see waf/redos.py), rules it refuses are skipped.
+    `patterns` defaults to ALL_PATTERNS (see ruleset.active_rule_pack for rule packs).
+    """
     matches: List[Tuple[str, int]] = []
-    for name, pattern, score in ALL_PATTERNS:
+    for name, pattern, score in ALL_PATTERNS if patterns is None else patterns:
+        if budget is not None and not budget.allow(pattern, text):
+            continue
         if pattern.search(text):
             matches.append((name, score))
     return matches
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import logging
+import re
+import threading
+from types import MappingProxyType
+from typing import Dict, FrozenSet, List, Mapping, Optional, Sequence, Tuple
+
+from .config import settings
+from .redos import AnalysisBudget, check_rules, clear_pattern_risks
+from .rules import ALL_PATTERNS, FIELD_PATTERNS, RULE_ANCHORS, RULE_FIELDS, match_rules
+
+logger = logging.getLogger(__name__)
+
+RuleTuple = Tuple[str, re.Pattern, int]
+AnchorGroups = Tuple[Tuple[str, ...], ...]
+
+
+class CompiledRuleSet:
+    """Jeu de règles compilé avec pré-filtre par littéraux.
+
+    Un premier passage cherche l'ensemble des littéraux d'ancrage présents dans
+    le texte; seules les regex dont tous les groupes d'ancrage sont satisfaits
+    sont ensuite exécutées. L'ordre et le contenu du résultat sont identiques à
+    `rules.match_rules` (les ancres sont des conditions nécessaires du match).
+    """
+
+    __slots__ = ("_plan", "_literals")
+
+    def __init__(self, patterns: Sequence[RuleTuple], anchors: Dict[str, AnchorGroups]) -> None:
+        plan = []
+        literals = set()
+        for name, pattern, score in patterns:
+            groups = tuple(tuple(g) for g in anchors.get(name, ()))
+            for g in groups:
+                literals.update(g)
+            plan.append((name, pattern, score, groups))
+        self._plan: Tuple[Tuple[str, re.Pattern, int, AnchorGroups], ...] = tuple(plan)
+        # Les littéraux longs (plus sélectifs) d'abord, ordre stable
+        self._literals: Tuple[str, ...] = tuple(sorted(literals, key=lambda lit: (-len(lit), lit)))
+
+    def __len__(self) -> int:
+        return len(self._plan)
+
+    def seen_literals(self, text: str) -> FrozenSet[str]:
+        """Scan multi-littéraux: retourne les ancres présentes dans le texte."""
+        # str.__contains__ (recherche en C) reste plus rapide qu'un automate en Python pur
+        return frozenset(lit for lit in self._literals if lit in text)
+
+    def match(self, text: str, budget: Optional[AnalysisBudget] = None) -> List[Tuple[str, int]]:
+        """Équivalent de `rules.match_rules` avec pré-filtre par ancres."""
+        seen = self.seen_literals(text)
+        matches: List[Tuple[str, int]] = []
+        for name, pattern, score, groups in self._plan:
+            if groups and not all(any(lit in seen for lit in g) for g in groups):
+                continue
+            if budget is not None and not budget.allow(pattern, text):
+                continue
+            if pattern.search(text):
+                matches.append((name, score))
+        return matches
+
+
+class RulePack:
+    """Jeu de règles immuable: motifs compilés (ordre d'évaluation), champs ciblés,
+    ancres et motifs par champ, identifié par sa version.
+
+    Les règles intégrées (`waf/rules.py`) forment le pack "builtin"; un fichier
+    externe le remplace (cf. waf/rulepack.py).
+    """
+
+    __slots__ = ("version", "source", "patterns", "fields", "anchors", "field_patterns")
+
+    def __init__(
+        self,
+        version: str,
+        source: str,
+        patterns: Sequence[RuleTuple],
+        fields: Mapping[str, Tuple[str, ...]],
+        anchors: Mapping[str, AnchorGroups],
+        field_patterns: Mapping[str, re.Pattern],
+    ) -> None:
+        self.version = version
+        self.source = source
+        self.patterns: Tuple[RuleTuple, ...] = tuple(patterns)
+        self.fields: Mapping[str, Tuple[str, ...]] = MappingProxyType(dict(fields))
+        self.anchors: Mapping[str, AnchorGroups] = MappingProxyType(dict(anchors))
+        self.field_patterns: Mapping[str, re.Pattern] = MappingProxyType(dict(field_patterns))
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+
+def builtin_rule_pack() -> RulePack:
+    return RulePack("builtin", "waf/rules.py", ALL_PATTERNS, RULE_FIELDS, RULE_ANCHORS, FIELD_PATTERNS)
+
+
+# Pack actif et sa version compilée: remplacés d'un bloc par install_rule_pack,
+# lus sans verrou sur le chemin des requêtes
+_pack: RulePack = builtin_rule_pack()
+_default_ruleset: Optional[CompiledRuleSet] = None
+_default_lock = threading.Lock()
+_generation = 0
+_verify_lock = threading.Lock()
+_verify_counters = {"checked": 0, "mismatches": 0}
+
+
+def get_ruleset() -> CompiledRuleSet:
+    global _default_ruleset
+    ruleset = _default_ruleset
+    if ruleset is None:
+        with _default_lock:
+            if _default_ruleset is None:
+                _default_ruleset = CompiledRuleSet(_pack.patterns, _pack.anchors)
+            ruleset = _default_ruleset
+    return ruleset
+
+
+def active_rule_pack() -> RulePack:
+    return _pack
+
+
+def rules_version() -> str:
+    """Version du pack de règles actif (exposée dans /healthz et les événements)."""
+    return _pack.version
+
+
+def install_rule_pack(pack: RulePack) -> None:
+    """Activer `pack`: compilé hors verrou, puis échangé d'un bloc avec le pack courant.
+    Les caches dépendant des règles sont invalidés (`rules_generation()`).
+    """
+    global _pack, _default_ruleset, _generation
+    compiled = CompiledRuleSet(pack.patterns, pack.anchors)
+    # Analyses des motifs de l'ancien pack oubliées (mémoire bornée entre rechargements)
+    clear_pattern_risks()
+    check_rules(pack.patterns)
+    with _default_lock:
+        _pack, _default_ruleset = pack, compiled
+        _generation += 1
+
+
+def rules_generation() -> int:
+    """Numéro du jeu de règles actif, incrémenté à chaque changement (caches)."""
+    return _generation
+
+
+def invalidate_ruleset() -> None:
+    """Signaler un changement de règles: le jeu compilé est reconstruit au prochain appel."""
+    global _default_ruleset, _generation
+    with _default_lock:
+        _default_ruleset = None
+        _generation += 1
+
+
+def match_rules_verified(text: str, budget: Optional[AnalysisBudget] = None) -> List[Tuple[str, int]]:
+    """Exécute les deux moteurs et signale toute divergence.
+    Le résultat du moteur historique fait foi.
+    """
+    expected = match_rules(text, budget, _pack.patterns)
+    got = get_ruleset().match(text, budget)
+    if budget is not None and budget.truncated:
+        return expected  # résultats partiels, non comparables
+    with _verify_lock:
+        _verify_counters["checked"] += 1
+        if got != expected:
+            _verify_counters["mismatches"] += 1
+    if got != expected:
+        logger.warning("rule engine mismatch: legacy=%r compiled=%r text=%r", expected, got, text[:200])
+    return expected
+
+
+def verify_stats() -> Dict[str, int]:
+    with _verify_lock:
+        return dict(_verify_counters)
+
+
+def match_rules_active(text: str, budget: Optional[AnalysisBudget] = None) -> List[Tuple[str, int]]:
+    """Matching selon `settings.rule_engine`: legacy, compiled ou verify."""
+    engine = settings.rule_engine
+    if engine == "compiled":
+        return get_ruleset().match(text, budget)
+    if engine == "verify":
+        return match_rules_verified(text, budget)
+    return match_rules(text, budget, _pack.patterns)
@@ -1,13 +1,90 @@
 from __future__ import annotations
 
+import argparse
+import os
+from typing import List, Optional
+
 from .config import settings
-from .proxy import create_app_with_error_handler
 
 
-def main() -> None:
+def _run_wsgi() -> None:
+    from .logger import close_log_writer
+    from .proxy import create_app_with_error_handler
+    from .upstream import close_upstream_pool
+
     app = create_app_with_error_handler()
-    # Use Flask built-in server for demo; for prod, use gunicorn/uvicorn with ASGI/WSGI adapter
-    app.run(host=settings.host, port=settings.port, debug=False)
+    # Use Flask built-in server for demo; for prod, use --workers (prefork) or an external server
+    try:
+        app.run(host=settings.host, port=settings.port, debug=False)
+    finally:
+        close_upstream_pool()
+        close_log_writer()
+
+
+def _require_uvicorn() -> None:
+    try:
+        import uvicorn  # type: ignore  # noqa: F401
+    except Exception:  # pragma: no cover - optional
+        raise SystemExit("Le moteur asgi nécessite uvicorn: pip install 'meow-meow-3000[asgi]'")
+
+
+def _run_asgi() -> None:
+    _require_uvicorn()
+    import uvicorn  # type: ignore
+
+    from .asgi_proxy import create_asgi_app
+
+    uvicorn.run(create_asgi_app(), host=settings.host, port=settings.port, log_level="warning", lifespan="on")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="waf-proxy", description="Meow-Meow-3000 WAF reverse proxy")
+    parser.add_argument(
+        "--engine",
+        choices=["wsgi", "asgi"],
+        default=settings.engine if settings.engine in ("wsgi", "asgi") else "wsgi",
+        help="wsgi: Flask (défaut); asgi: asyncio + httpx.AsyncClient (WAF_ENGINE)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=settings.workers,
+        help="processus workers partageant le socket d'écoute (WAF_WORKERS, 1 = mono-processus)",
+    )
+    parser.add_argument(
+        "--max-requests",
+        type=int,
+        default=settings.max_requests,
+        help="recycler un worker après N requêtes (WAF_MAX_REQUESTS, 0 = jamais)",
+    )
+    # Interne: lancé par le processus maître prefork
+    parser.add_argument("--worker-fd", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.engine == "asgi":
+        _require_uvicorn()
+
+    if args.worker_fd is not None:
+        from .prefork import run_worker
+
+        run_worker(args.worker_fd, args.engine, args.max_requests)
+    elif args.workers > 1 or args.max_requests > 0:
+        if os.name != "posix":
+            raise SystemExit("Le mode prefork (--workers/--max-requests) nécessite un système POSIX")
+        from .prefork import PreforkMaster
+
+        PreforkMaster(
+            workers=args.workers,
+            engine=args.engine,
+            max_requests=args.max_requests,
+            graceful_timeout=settings.graceful_timeout,
+            host=settings.host,
+            port=settings.port,
+        ).run()
+    elif args.engine == "asgi":
+        _run_asgi()
+    else:
+        _run_wsgi()
 
 
 if __name__ == "__main__":
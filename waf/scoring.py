@@ -1,17 +1,18 @@
 from __future__ import annotations
 
+from time import perf_counter
 from typing import Dict, List, Tuple
 
-from .rules import normalize_payload, match_rules
+from .fields import RequestFields, get_field_ruleset
+from .redos import AnalysisBudget, apply_timeout, current_budget, new_budget
+from .rules import normalize_payload
+from .ruleset import active_rule_pack, match_rules_active, rules_generation
+from .timing import current_timer, profile_call
+from .verdict_cache import get_verdict_cache
 
 
-def compute_score(raw_text: str) -> Tuple[int, List[str], Dict[str, bool]]:
-    """Normalize input, match signatures, and compute a score.
-    Returns: (score, matched_rule_names, flags)
-    flags contains keys like: had_encoding, double_decoded
-    """
-    normalized, flags = normalize_payload(raw_text or "")
-    matches = match_rules(normalized)
+def score_from_matches(matches: List[Tuple[str, int]], flags: Dict[str, bool]) -> int:
+    """Sum rule scores and add the encoding bonuses."""
     score = sum(s for _, s in matches)
 
     # Additional scoring based on encoding flags
@@ -19,8 +20,109 @@ def compute_score(raw_text: str) -> Tuple[int, List[str], Dict[str, bool]]:
         score += 3
     if flags.get("double_decoded"):
         score += 4
+    return score
+
+
+def analysis_text(path: str, qs: str, body_text: str, ua: str, referer: str, cookie: str) -> str:
+    """Texte analysé en mode blob: chemin, query, corps et en-têtes retenus, un par ligne."""
+    return "\n".join([path, qs, body_text or "", ua, referer, cookie])
+
+
+def _rule_timings(text: str, top: int = 5) -> Dict[str, float]:
+    """Durée (ms) de chaque regex sur `text`; retourne les `top` plus lentes."""
+    timings = []
+    budget = new_budget()  # second passage: budget distinct de celui de la requête
+    for name, pattern, _ in active_rule_pack().patterns:
+        if not budget.allow(pattern, text):
+            continue
+        t0 = perf_counter()
+        pattern.search(text)
+        timings.append((perf_counter() - t0, name))
+    timings.sort(reverse=True)
+    return {name: round(seconds * 1000, 3) for seconds, name in timings[:top]}
+
+
+def _normalize_and_match(
+    raw_text: str, budget: AnalysisBudget
+) -> Tuple[List[Tuple[str, int]], Dict[str, bool]]:
+    normalized, flags = normalize_payload(raw_text)
+    matches = match_rules_active(normalized, budget)
+    apply_timeout(budget, matches, flags)
+    return matches, flags
+
 
-    return score, [name for name, _ in matches], flags
+def analyze_text(raw_text: str) -> Tuple[List[Tuple[str, int]], Dict[str, bool]]:
+    """Normalize then match; records the stage timings of the current request, if any.
+    Rule evaluation is bounded by the request's analysis budget (waf/redos.py).
+    """
+    timer = current_timer()
+    budget = current_budget()
+    if timer is None:
+        return _normalize_and_match(raw_text, budget)
+    if timer.sample == "cprofile":
+        t0 = perf_counter()
+        (matches, flags), profile = profile_call(_normalize_and_match, raw_text, budget)
+        timer.mark("match", t0)
+        timer.details.setdefault("profile", profile)
+        return matches, flags
+    t0 = perf_counter()
+    normalized, flags = normalize_payload(raw_text)
+    t1 = timer.mark("normalize", t0)
+    matches = match_rules_active(normalized, budget)
+    apply_timeout(budget, matches, flags)
+    timer.mark("match", t1)
+    if timer.sample == "rules":
+        slowest = timer.details.setdefault("rule_timings", {})
+        for name, ms in _rule_timings(normalized).items():
+            slowest[name] = max(ms, slowest.get(name, 0.0))
+    return matches, flags
+
+
+def compute_score(raw_text: str) -> Tuple[int, List[str], Dict[str, bool]]:
+    """Normalize input, match signatures, and compute a score.
+    Returns: (score, matched_rule_names, flags)
+    flags contains keys like: had_encoding, double_decoded
+    """
+    text = raw_text or ""
+    timer = current_timer()
+    cache = get_verdict_cache()
+    key = None
+    # Les requêtes échantillonnées pour le profilage passent toujours par l'analyse
+    if timer is None or timer.sample is None:
+        key, cached = cache.get(text)
+        if cached is not None:
+            return cached
+    generation = rules_generation()
+    matches, flags = analyze_text(text)
+    score = score_from_matches(matches, flags)
+    verdict = (score, [name for name, _ in matches], flags)
+    # Un verdict tronqué par le budget d'analyse n'est pas mis en cache
+    if key is not None and not flags.get("analysis_timeout"):
+        cache.put(key, verdict, generation)
+    return verdict
+
+
+def compute_field_score(
+    fields: RequestFields,
+) -> Tuple[int, List[str], Dict[str, bool], Dict[str, str]]:
+    """Field-aware variant of `compute_score`: each rule only scans the fields it targets.
+    Returns: (score, matched_rule_names, flags, matched_fields) where matched_fields
+    maps each rule to the field that triggered it (e.g. "args:id", "cookies:session").
+    """
+    timer = current_timer()
+    cache = get_verdict_cache()
+    key = None
+    if timer is None or timer.sample is None:
+        key, cached = cache.get("fields\n" + fields.fingerprint())
+        if cached is not None:
+            return cached  # type: ignore[return-value]
+    generation = rules_generation()
+    matches, flags, matched_fields = get_field_ruleset().scan(fields.fields)
+    score = score_from_matches(matches, flags)
+    verdict = (score, [name for name, _ in matches], flags, matched_fields)
+    if key is not None and not flags.get("analysis_timeout"):
+        cache.put(key, verdict, generation)
+    return verdict
 
 
 def severity_from_score(score: int) -> str:
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import cProfile
+import itertools
+import pstats
+import threading
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import settings
+
+# Ordre d'affichage des étapes (Server-Timing et champ `timings` des logs)
+STAGES: Tuple[str, ...] = (
+    "collect",
+    "normalize",
+    "match",
+    "upstream_connect",
+    "upstream",
+    "rewrite",
+    "log",
+)
+
+_current: ContextVar[Optional["StageTimer"]] = ContextVar("waf_stage_timer", default=None)
+_sample_counter = itertools.count(1)
+_sample_lock = threading.Lock()
+
+
+class StageTimer:
+    """Durées par étape d'une requête (perf_counter, monotone et haute résolution).
+
+    `sample` vaut "rules" ou "cprofile" si la requête a été tirée au sort
+    (1 sur `profile_sample_rate`) pour un profilage détaillé de l'analyse.
+    """
+
+    __slots__ = ("started", "stages", "sample", "details")
+
+    def __init__(self, sample: Optional[str] = None) -> None:
+        self.started = perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.sample = sample
+        self.details: Dict[str, Any] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def mark(self, stage: str, since: float) -> float:
+        """Ajouter le temps écoulé depuis `since` à `stage`; retourne l'instant courant."""
+        now = perf_counter()
+        self.add(stage, now - since)
+        return now
+
+    def as_dict(self) -> Dict[str, float]:
+        """Durées en millisecondes (3 décimales), plus `total` depuis la création."""
+        out = {name: round(self.stages[name] * 1000, 3) for name in STAGES if name in self.stages}
+        out["total"] = round((perf_counter() - self.started) * 1000, 3)
+        return out
+
+    def server_timing(self) -> str:
+        """Valeur de l'en-tête `Server-Timing` (durées en ms)."""
+        return ", ".join(f"{name};dur={ms:g}" for name, ms in self.as_dict().items())
+
+
+def _pick_sample() -> Optional[str]:
+    rate = settings.profile_sample_rate
+    if rate <= 0:
+        return None
+    with _sample_lock:
+        n = next(_sample_counter)
+    return settings.profile_mode if n % rate == 0 else None
+
+
+def start_timer() -> StageTimer:
+    """Nouveau chronométrage pour la requête courante (thread ou tâche asyncio)."""
+    timer = StageTimer(_pick_sample())
+    _current.set(timer)
+    return timer
+
+
+def current_timer() -> Optional[StageTimer]:
+    return _current.get()
+
+
+def profile_call(func: Any, *args: Any, top: int = 10) -> Tuple[Any, List[Dict[str, Any]]]:
+    """Exécuter `func(*args)` sous cProfile; retourne (résultat, fonctions les plus coûteuses)."""
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Un autre profileur est déjà actif dans ce thread
+        return func(*args), []
+    try:
+        result = func(*args)
+    finally:
+        profiler.disable()
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, name), (_, calls, _, cumulative, _) in stats.stats.items():  # type: ignore[attr-defined]
+        rows.append({"func": f"{filename.rsplit('/', 1)[-1]}:{line}({name})", "calls": calls, "ms": cumulative * 1000})
+    rows.sort(key=lambda r: r["ms"], reverse=True)
+    return result, [{**r, "ms": round(r["ms"], 3)} for r in rows[:top]]
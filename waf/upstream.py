@@ -0,0 +1,366 @@
+from __future__ import annotations
+
+import asyncio
+import atexit
+import threading
+import urllib.parse
+import weakref
+from time import perf_counter
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional, Tuple
+
+import httpx
+
+from .config import settings
+from .timing import current_timer
+
+
+def _limits_and_timeout(
+    max_connections: int,
+    max_keepalive: int,
+    keepalive_expiry: float,
+    connect_timeout: float,
+    read_timeout: float,
+) -> Tuple[httpx.Limits, httpx.Timeout]:
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive,
+        keepalive_expiry=keepalive_expiry,
+    )
+    timeout = httpx.Timeout(
+        connect=connect_timeout,
+        read=read_timeout,
+        write=read_timeout,
+        pool=connect_timeout,
+    )
+    return limits, timeout
+
+
+def _release_once(slot: Any) -> Callable[[], None]:
+    """Rendre le créneau `slot` une seule fois (fermeture explicite ou ramasse-miettes)."""
+    held = [slot]
+
+    def release() -> None:
+        try:
+            held.pop().release()
+        except IndexError:
+            pass
+
+    return release
+
+
+class _SlotStream(httpx.SyncByteStream):
+    """Corps de réponse en flux qui rend le créneau par hôte à sa fermeture."""
+
+    def __init__(self, stream: Any, release: Callable[[], None]) -> None:
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield from self._stream
+
+    def close(self) -> None:
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+
+class _AsyncSlotStream(httpx.AsyncByteStream):
+    """Équivalent asynchrone de `_SlotStream`."""
+
+    def __init__(self, stream: Any, release: Callable[[], None]) -> None:
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+class _PoolStats:
+    """Compteurs communs aux pools synchrone et asynchrone."""
+
+    _transport: Any
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._closed = False
+        self._counters = {
+            "requests": 0,
+            "connections_new": 0,
+            "connections_reused": 0,
+            "errors": 0,
+            "per_host_waits_timed_out": 0,
+        }
+
+    def _incr(self, key: str) -> None:
+        with self._lock:
+            self._counters[key] += 1
+
+    def _trace_state(self) -> Tuple[Dict[str, Any], Any]:
+        # La trace httpcore indique si une connexion TCP a été ouverte pour cette
+        # requête, et le temps passé à l'établir (TCP + TLS)
+        state: Dict[str, Any] = {"new_connection": False, "connect": 0.0, "_t0": 0.0}
+
+        def _trace(event_name: str, info: Dict[str, Any]) -> None:
+            if event_name.startswith("connection.connect_tcp."):
+                state["new_connection"] = True
+            if event_name in ("connection.connect_tcp.started", "connection.start_tls.started"):
+                state["_t0"] = perf_counter()
+            elif event_name in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+                state["connect"] += perf_counter() - state["_t0"]
+
+        return state, _trace
+
+    @staticmethod
+    def _record_connect(state: Dict[str, Any]) -> None:
+        timer = current_timer()
+        if timer is not None and state["connect"]:
+            timer.add("upstream_connect", state["connect"])
+
+    def stats(self) -> Dict[str, Any]:
+        """Statistiques du pool: connexions actives/inactives, réutilisées vs nouvelles."""
+        in_use = idle = 0
+        try:
+            for conn in self._transport._pool.connections:  # type: ignore[attr-defined]
+                if conn.is_idle():
+                    idle += 1
+                else:
+                    in_use += 1
+        except Exception:
+            pass
+        with self._lock:
+            counters = dict(self._counters)
+        return {"in_use": in_use, "idle": idle, "closed": self._closed, **counters}
+
+    def _mark_closed(self) -> bool:
+        with self._lock:
+            if self._closed:
+                return False
+            self._closed = True
+            return True
+
+
+class UpstreamPool(_PoolStats):
+    """Client HTTP partagé (keep-alive) vers le backend, avec statistiques.
+
+    Un seul pool par processus: les connexions TCP vers DVWA sont réutilisées
+    d'une requête à l'autre au lieu d'ouvrir/fermer un socket à chaque appel.
+    """
+
+    def __init__(
+        self,
+        max_connections: int,
+        max_keepalive: int,
+        keepalive_expiry: float,
+        max_per_host: int,
+        connect_timeout: float,
+        read_timeout: float,
+    ) -> None:
+        super().__init__()
+        limits, timeout = _limits_and_timeout(
+            max_connections, max_keepalive, keepalive_expiry, connect_timeout, read_timeout
+        )
+        self._transport = httpx.HTTPTransport(limits=limits, verify=False)
+        self._client = httpx.Client(
+            transport=self._transport,
+            follow_redirects=False,
+            timeout=timeout,
+        )
+        self._max_per_host = max_per_host
+        self._pool_timeout = connect_timeout
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+
+    def _host_slot(self, url: str) -> Optional[threading.BoundedSemaphore]:
+        if self._max_per_host <= 0:
+            return None
+        netloc = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            slot = self._host_slots.get(netloc)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self._max_per_host)
+                self._host_slots[netloc] = slot
+            return slot
+
+    def request(self, method: str, url: str, stream: bool = False, **kwargs: Any) -> httpx.Response:
+        """Envoyer une requête via le pool. Corps de réponse lu entièrement, sauf
+        avec `stream=True`: l'appelant le lit (`iter_bytes`) puis appelle `close()`.
+        Le créneau par hôte est gardé jusqu'à la fin du corps: rendu après la
+        lecture complète, ou à la fermeture de la réponse en flux.
+        """
+        slot = self._host_slot(url)
+        if slot is not None and not slot.acquire(timeout=self._pool_timeout):
+            self._incr("per_host_waits_timed_out")
+            raise httpx.PoolTimeout(f"per-host limit reached for {url}")
+
+        state, _trace = self._trace_state()
+        extensions = dict(kwargs.pop("extensions", None) or {})
+        extensions["trace"] = _trace
+        try:
+            self._incr("requests")
+            req = self._client.build_request(method, url, extensions=extensions, **kwargs)
+            resp = self._client.send(req, stream=stream)
+        except Exception:
+            self._incr("errors")
+            if slot is not None:
+                slot.release()
+            raise
+        finally:
+            self._record_connect(state)
+        if slot is not None:
+            release = _release_once(slot)
+            if stream:
+                resp.stream = _SlotStream(resp.stream, release)
+                # Filet de sécurité: réponse abandonnée sans close()
+                weakref.finalize(resp, release)
+            else:
+                release()
+        self._incr("connections_new" if state["new_connection"] else "connections_reused")
+        return resp
+
+    def close(self) -> None:
+        if not self._mark_closed():
+            return
+        try:
+            self._client.close()
+        except Exception:
+            pass
+
+
+class AsyncUpstreamPool(_PoolStats):
+    """Équivalent asynchrone (httpx.AsyncClient) pour le moteur ASGI."""
+
+    def __init__(
+        self,
+        max_connections: int,
+        max_keepalive: int,
+        keepalive_expiry: float,
+        max_per_host: int,
+        connect_timeout: float,
+        read_timeout: float,
+    ) -> None:
+        super().__init__()
+        limits, timeout = _limits_and_timeout(
+            max_connections, max_keepalive, keepalive_expiry, connect_timeout, read_timeout
+        )
+        self._transport = httpx.AsyncHTTPTransport(limits=limits, verify=False)
+        self._client = httpx.AsyncClient(
+            transport=self._transport,
+            follow_redirects=False,
+            timeout=timeout,
+        )
+        self._max_per_host = max_per_host
+        self._pool_timeout = connect_timeout
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+
+    def _host_slot(self, url: str) -> Optional[asyncio.Semaphore]:
+        if self._max_per_host <= 0:
+            return None
+        netloc = urllib.parse.urlsplit(url).netloc
+        slot = self._host_slots.get(netloc)
+        if slot is None:
+            slot = asyncio.Semaphore(self._max_per_host)
+            self._host_slots[netloc] = slot
+        return slot
+
+    async def request(self, method: str, url: str, stream: bool = False, **kwargs: Any) -> httpx.Response:
+        """Envoyer une requête via le pool (`stream=True`: voir `UpstreamPool.request`)."""
+        slot = self._host_slot(url)
+        if slot is not None:
+            try:
+                await asyncio.wait_for(slot.acquire(), timeout=self._pool_timeout)
+            except asyncio.TimeoutError:
+                self._incr("per_host_waits_timed_out")
+                raise httpx.PoolTimeout(f"per-host limit reached for {url}")
+
+        state, _sync_trace = self._trace_state()
+
+        async def _trace(event_name: str, info: Dict[str, Any]) -> None:
+            # httpcore attend une coroutine pour la trace en mode asynchrone
+            _sync_trace(event_name, info)
+
+        extensions = dict(kwargs.pop("extensions", None) or {})
+        extensions["trace"] = _trace
+        try:
+            self._incr("requests")
+            req = self._client.build_request(method, url, extensions=extensions, **kwargs)
+            resp = await self._client.send(req, stream=stream)
+        except Exception:
+            self._incr("errors")
+            if slot is not None:
+                slot.release()
+            raise
+        finally:
+            self._record_connect(state)
+        if slot is not None:
+            release = _release_once(slot)
+            if stream:
+                resp.stream = _AsyncSlotStream(resp.stream, release)
+                weakref.finalize(resp, release)
+            else:
+                release()
+        self._incr("connections_new" if state["new_connection"] else "connections_reused")
+        return resp
+
+    async def aclose(self) -> None:
+        if not self._mark_closed():
+            return
+        try:
+            await self._client.aclose()
+        except Exception:
+            pass
+
+
+_pool: Optional[UpstreamPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_upstream_pool() -> UpstreamPool:
+    """Retourne le pool du processus (créé à la première utilisation)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = UpstreamPool(
+                    max_connections=settings.upstream_max_connections,
+                    max_keepalive=settings.upstream_max_keepalive,
+                    keepalive_expiry=settings.upstream_keepalive_expiry,
+                    max_per_host=settings.upstream_max_per_host,
+                    connect_timeout=settings.upstream_connect_timeout,
+                    read_timeout=settings.upstream_read_timeout,
+                )
+    return _pool
+
+
+def upstream_pool_stats() -> Dict[str, Any]:
+    return get_upstream_pool().stats()
+
+
+def close_upstream_pool() -> None:
+    """Fermer proprement les connexions keep-alive (arrêt du processus)."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+
+
+def new_async_upstream_pool() -> AsyncUpstreamPool:
+    """Créer un pool asynchrone (à créer/fermer dans la boucle d'événements qui l'utilise)."""
+    return AsyncUpstreamPool(
+        max_connections=settings.upstream_max_connections,
+        max_keepalive=settings.upstream_max_keepalive,
+        keepalive_expiry=settings.upstream_keepalive_expiry,
+        max_per_host=settings.upstream_max_per_host,
+        connect_timeout=settings.upstream_connect_timeout,
+        read_timeout=settings.upstream_read_timeout,
+    )
+
+
+atexit.register(close_upstream_pool)
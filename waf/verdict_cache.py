@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .config import settings
+from .ruleset import rules_generation
+
+# (score, matched_rules, flags) ou, en mode "fields", (score, matched_rules, flags, matched_fields)
+Verdict = Tuple[Any, ...]
+
+
+def _copy(verdict: Verdict) -> Verdict:
+    # Copies: les appelants peuvent enrichir les flags de leur événement
+    return tuple(list(v) if isinstance(v, list) else dict(v) if isinstance(v, dict) else v for v in verdict)
+
+
+class VerdictCache:
+    """Cache LRU + TTL des verdicts `(score, matched_rules, flags[, matched_fields])`.
+
+    La clé est un condensé (blake2b) du texte d'analyse exact: deux requêtes
+    au chemin, query, corps et en-têtes identiques partagent le même verdict.
+    Les textes plus longs que `max_text` ne sont pas mis en cache (le hachage
+    coûterait autant que l'analyse). Tout changement du jeu de règles
+    (`rules_generation()`) vide le cache.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, max_text: int) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_text = max_text
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[bytes, Tuple[float, Verdict]]" = OrderedDict()
+        self._generation = rules_generation()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "bypassed": 0, "invalidations": 0}
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8", errors="surrogatepass"), digest_size=16).digest()
+
+    def _check_generation(self) -> None:
+        generation = rules_generation()
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+            self._counters["invalidations"] += 1
+
+    def cacheable(self, text: str) -> bool:
+        return self.max_entries > 0 and len(text) <= self.max_text
+
+    def get(self, text: str) -> Tuple[Optional[bytes], Optional[Verdict]]:
+        """Retourne (clé, verdict en cache ou None); clé None si le texte n'est pas cacheable."""
+        if not self.cacheable(text):
+            with self._lock:
+                self._counters["bypassed"] += 1
+            return None, None
+        key = self._key(text)
+        now = time.monotonic()
+        with self._lock:
+            self._check_generation()
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                self._counters["expired"] += 1
+                entry = None
+            if entry is None:
+                self._counters["misses"] += 1
+                return key, None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+        return key, _copy(entry[1])
+
+    def put(self, key: bytes, verdict: Verdict, generation: int) -> None:
+        """Mémoriser un verdict calculé avec le jeu de règles `generation`."""
+        with self._lock:
+            self._check_generation()
+            if generation != self._generation:
+                return  # règles rechargées pendant l'analyse
+            self._entries[key] = (time.monotonic() + self.ttl, _copy(verdict))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            size = len(self._entries)
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            "enabled": self.max_entries > 0,
+            "size": size,
+            "max_entries": self.max_entries,
+            "hit_ratio": round(counters["hits"] / lookups, 4) if lookups else None,
+            **counters,
+        }
+
+
+_cache: Optional[VerdictCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_verdict_cache() -> VerdictCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = VerdictCache(
+                    max_entries=settings.verdict_cache_size,
+                    ttl=settings.verdict_cache_ttl,
+                    max_text=settings.verdict_cache_max_text,
+                )
+    return _cache
+
+
+def verdict_cache_stats() -> Dict[str, Any]:
+    return get_verdict_cache().stats()